@@ -15,9 +15,10 @@ from sqlalchemy import select, func
 
 from app.db.session import session_scope
 from app.db.models import User, Order, Setting, UserService
-from app.marzban.client import get_client
+from app.services.marzban_ops import client_for as mz_client_for
 from app.services.marzban_ops import revoke_sub as marz_revoke_sub
 from app.services.marzban_ops import replace_user_username as ops_replace_username
+from app.services.marzban_ops import get_user as ops_get_user
 from app.utils.username import tg_username
 from app.services.security import is_admin_uid
 from app.utils.qr import generate_qr_png
@@ -86,12 +87,8 @@ async def _render_account_text(tg_id: int) -> Tuple[str, str | None, List[str]]:
             orders_count = int(res.scalar() or 0)
             if getattr(user, "marzban_username", None):
                 username_eff = user.marzban_username
-    # Load Marzban info
-    client = await get_client()
-    try:
-        data = await client.get_user(username_eff)
-    finally:
-        await client.aclose()
+    # Load Marzban info (cached; a slightly stale snapshot is served while it refreshes)
+    data = await ops_get_user(username_eff, allow_stale=True)
     status = str(data.get("status") or "")
     is_disabled = status.lower() == "disabled"
     token = None if is_disabled else (data.get("subscription_token") or (data.get("subscription_url", "").split("/")[-1] if data.get("subscription_url") else None))
@@ -301,7 +298,7 @@ async def cb_account_service_view(cb: CallbackQuery) -> None:
         return
     # Render details for this service username
     try:
-        client = await get_client()
+        client = await mz_client_for(s.username)
         data = await client.get_user(s.username)
     except httpx.HTTPStatusError as e:
         if e.response is not None and e.response.status_code == 404:
@@ -373,7 +370,7 @@ async def cb_account_links(cb: CallbackQuery) -> None:
         u = await session.scalar(select(User).where(User.telegram_id == cb.from_user.id))
         if u and getattr(u, "marzban_username", None):
             username = u.marzban_username
-    client = await get_client()
+    client = await mz_client_for(username)
     try:
         data = await client.get_user(username)
         if str(data.get("status") or "").lower() == "disabled":
@@ -449,7 +446,7 @@ async def cb_account_links_svc(cb: CallbackQuery) -> None:
     if not s:
         await cb.answer("not found", show_alert=True)
         return
-    client = await get_client()
+    client = await mz_client_for(s.username)
     try:
         data = await client.get_user(s.username)
         if str(data.get("status") or "").lower() == "disabled":
@@ -496,7 +493,7 @@ async def cb_account_qr(cb: CallbackQuery) -> None:
         u = await session.scalar(select(User).where(User.telegram_id == cb.from_user.id))
         if u and getattr(u, "marzban_username", None):
             username = u.marzban_username
-    client = await get_client()
+    client = await mz_client_for(username)
     try:
         data = await client.get_user(username)
         if str(data.get("status") or "").lower() == "disabled":
@@ -662,7 +659,7 @@ async def cb_account_qr_svc(cb: CallbackQuery) -> None:
     if not s:
         await cb.answer("not found", show_alert=True)
         return
-    client = await get_client()
+    client = await mz_client_for(s.username)
     try:
         data = await client.get_user(s.username)
         if str(data.get("status") or "").lower() == "disabled":
@@ -702,7 +699,7 @@ async def cb_account_copy_all_svc(cb: CallbackQuery) -> None:
     if not s:
         await cb.answer("not found", show_alert=True)
         return
-    client = await get_client()
+    client = await mz_client_for(s.username)
     try:
         data = await client.get_user(s.username)
         if str(data.get("status") or "").lower() == "disabled":
@@ -810,7 +807,7 @@ async def cb_account_copy_all(cb: CallbackQuery) -> None:
         u = await session.scalar(select(User).where(User.telegram_id == cb.from_user.id))
         if u and getattr(u, "marzban_username", None):
             username = u.marzban_username
-    client = await get_client()
+    client = await mz_client_for(username)
     try:
         data = await client.get_user(username)
         if str(data.get("status") or "").lower() == "disabled":
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+from aiogram import Router, F
+from aiogram.filters import Command
+from aiogram.types import Message, CallbackQuery
+
+from app.services import broadcast as bc_svc
+from app.services.security import has_capability_async, CAP_BROADCAST
+
+
+router = Router()
+
+
+@router.message(Command("admin_broadcast"))
+async def admin_broadcast(message: Message) -> None:
+    """/admin_broadcast <text> (or as a reply to a message) → draft with a confirm button."""
+    if not (message.from_user and await has_capability_async(message.from_user.id, CAP_BROADCAST)):
+        await message.answer("⛔️ شما دسترسی ادمین ندارید.")
+        return
+    parts = (message.text or "").split(maxsplit=1)
+    text = parts[1].strip() if len(parts) > 1 else ""
+    if not text and message.reply_to_message is not None:
+        text = (message.reply_to_message.text or message.reply_to_message.caption or "").strip()
+    if not text:
+        await message.answer("ℹ️ استفاده: /admin_broadcast متن پیام\n(یا این دستور را در پاسخ به یک پیام بفرستید)")
+        return
+    draft = await bc_svc.create_broadcast(text, message.from_user.id)
+    body, markup = bc_svc.render_progress(draft)
+    await message.answer(body, reply_markup=markup)
+
+
+@router.message(Command("admin_broadcasts"))
+async def admin_broadcasts(message: Message) -> None:
+    if not (message.from_user and await has_capability_async(message.from_user.id, CAP_BROADCAST)):
+        await message.answer("⛔️ شما دسترسی ادمین ندارید.")
+        return
+    rows = await bc_svc.recent_broadcasts(10)
+    if not rows:
+        await message.answer("ℹ️ هنوز پیام همگانی ثبت نشده.")
+        return
+    lines = ["📣 پیام‌های همگانی اخیر"]
+    for b in rows:
+        handled = int(b.sent or 0) + int(b.failed or 0) + int(b.blocked or 0)
+        preview = b.text.replace("\n", " ")[:40]
+        lines.append(f"#{b.id} {b.status} {handled}/{b.total} — {preview}")
+    lines.append("\nبرای کنترل: /admin_broadcast_status شناسه")
+    await message.answer("\n".join(lines))
+
+
+@router.message(Command("admin_broadcast_status"))
+async def admin_broadcast_status(message: Message) -> None:
+    if not (message.from_user and await has_capability_async(message.from_user.id, CAP_BROADCAST)):
+        await message.answer("⛔️ شما دسترسی ادمین ندارید.")
+        return
+    parts = (message.text or "").split()
+    if len(parts) < 2 or not parts[1].isdigit():
+        await message.answer("ℹ️ استفاده: /admin_broadcast_status شناسه")
+        return
+    b = await bc_svc.get_broadcast(int(parts[1]))
+    if b is None:
+        await message.answer("❌ پیام همگانی یافت نشد.")
+        return
+    body, markup = bc_svc.render_progress(b)
+    sent = await message.answer(body, reply_markup=markup)
+    if b.status in ("pending", "running", "paused"):
+        # Move live progress updates to this fresh message
+        await bc_svc.set_progress_message(b.id, sent.chat.id, sent.message_id)
+
+
+@router.callback_query(F.data.startswith("bcast:"))
+async def cb_broadcast(cb: CallbackQuery) -> None:
+    if not (cb.from_user and await has_capability_async(cb.from_user.id, CAP_BROADCAST)):
+        await cb.answer("⛔️ دسترسی ندارید", show_alert=True)
+        return
+    try:
+        _, action, raw_id = (cb.data or "").split(":", 2)
+        broadcast_id = int(raw_id)
+    except ValueError:
+        await cb.answer()
+        return
+    if action == "refresh":
+        b = await bc_svc.get_broadcast(broadcast_id)
+    elif action in ("start", "pause", "resume", "cancel"):
+        kwargs = {}
+        if cb.message is not None:
+            # The worker keeps editing the message the admin is looking at
+            kwargs = {"progress_chat_id": cb.message.chat.id, "progress_message_id": cb.message.message_id}
+        b = await bc_svc.set_broadcast_state(broadcast_id, action, **kwargs)
+        if b is None:
+            await cb.answer("این عملیات در وضعیت فعلی ممکن نیست.", show_alert=True)
+            return
+    else:
+        await cb.answer()
+        return
+    if b is None:
+        await cb.answer("❌ پیام همگانی یافت نشد.", show_alert=True)
+        return
+    body, markup = bc_svc.render_progress(b)
+    try:
+        if cb.message is not None:
+            await cb.message.edit_text(body, reply_markup=markup)
+    except Exception:
+        pass
+    await cb.answer()
@@ -162,9 +162,15 @@ async def admin_status(message: Message) -> None:
         return
     username = parts[1].strip()
     status = parts[2].strip()
+    if status not in ("active", "disabled", "on_hold"):
+        await message.answer("فرمت: /admin_status <username> <active|disabled|on_hold>")
+        return
     try:
-        await ops.set_status(username, status)
-        await message.answer("✅ اعمال شد.")
+        from app.services.outbox import enqueue_set_status
+        await enqueue_set_status(
+            username, status, notify_chat_id=message.from_user.id, ok=f"✅ وضعیت سرویس {{username}} به {status} تغییر کرد."
+        )
+        await message.answer("⏳ در صف اعمال قرار گرفت؛ نتیجه اطلاع داده می‌شود.")
     except Exception as e:
         await message.answer(f"⚠️ خطا در admin_status: {e}")
 
@@ -219,14 +225,17 @@ async def admin_list_expired(message: Message) -> None:
         await message.answer("⛔️ شما دسترسی ادمین ندارید.")
         return
     try:
-        rows = await ops.list_expired()
-        if not rows:
+        # Stream the scan: keep the first 20 rows for display and only count the rest
+        lines = []
+        total = 0
+        async for r in ops.iter_expired():
+            total += 1
+            if len(lines) < 20:
+                lines.append(f"- {r.get('username')} | status={r.get('status')} | expire={r.get('expire')}")
+        if not total:
             await message.answer("ℹ️ موردی یافت نشد.")
             return
-        lines = []
-        for r in rows[:20]:
-            lines.append(f"- {r.get('username')} | status={r.get('status')} | expire={r.get('expire')}")
-        await message.answer("ℹ️ کاربران منقضی‌شده (۲۰ مورد اول):\n" + "\n".join(lines))
+        await message.answer(f"ℹ️ کاربران منقضی‌شده (۲۰ مورد اول از {total}):\n" + "\n".join(lines))
     except Exception as e:
         await message.answer(f"⚠️ خطا در admin_list_expired: {e}")
 
@@ -236,11 +245,166 @@ async def admin_delete_expired(message: Message) -> None:
     if not (message.from_user and await has_capability_async(message.from_user.id, CAP_PLANS_MANAGE)):
         await message.answer("⛔️ شما دسترسی ادمین ندارید.")
         return
+    status_msg = await message.answer("⏳ حذف کاربران منقضی‌شده...")
+    panels: Dict[str, Dict[str, Any]] = {}
+
+    def _progress_text() -> str:
+        return "\n".join(
+            f"⏳ {p['panel']}: {p['done']}/{p['total']} | حذف={p['deleted']} | نبود={p['missing']} | خطا={p['failed']}"
+            for p in panels.values()
+        )
+
+    async def _on_progress(p: Dict[str, Any]) -> None:
+        panels[p["panel"]] = p
+        try:
+            await status_msg.edit_text(_progress_text())
+        except Exception:
+            pass
+
     try:
-        res = await ops.delete_expired()
-        await message.answer(f"✅ Deleted expired: {res}")
+        res = await ops.delete_expired(progress=_on_progress)
     except Exception as e:
         await message.answer(f"⚠️ خطا در admin_delete_expired: {e}")
+        return
+    summaries = res if res and all(isinstance(v, dict) for v in res.values()) else {"": res}
+    lines = ["✅ حذف کاربران منقضی‌شده انجام شد."]
+    failures: List[str] = []
+    for panel, summary in summaries.items():
+        prefix = f"{panel}: " if panel else ""
+        if "deleted" not in summary:
+            lines.append(f"{prefix}{summary}")
+            continue
+        lines.append(
+            f"{prefix}حذف={summary.get('deleted', 0)} | نبود={summary.get('missing', 0)} | خطا={summary.get('failed', 0)}"
+            + (" (bulk)" if summary.get("bulk") else "")
+        )
+        failures += [f"- {u}: {r}" for u, r in (summary.get("results") or {}).items() if r.startswith("error")]
+    if failures:
+        lines.append("❌ ناموفق (۲۰ مورد اول):")
+        lines += failures[:20]
+    await message.answer("\n".join(lines))
+
+
+def _fmt_ms(seconds: Any) -> str:
+    return "-" if seconds is None else f"{seconds * 1000:.0f}ms"
+
+
+@router.message(Command("admin_marzban_stats"))
+async def admin_marzban_stats(message: Message) -> None:
+    if not (message.from_user and await has_capability_async(message.from_user.id, CAP_PLANS_MANAGE)):
+        await message.answer("⛔️ شما دسترسی ادمین ندارید.")
+        return
+    from app.marzban.client import get_all_clients, request_metrics
+
+    clients = await get_all_clients()
+    if message.text and message.text.split()[-1] == "reset":
+        for c in clients.values():
+            c.metrics.reset()
+        await message.answer("✅ آمار Marzban صفر شد.")
+        return
+    blocks: List[str] = []
+    for panel, endpoints in request_metrics().items():
+        pool = clients[panel].pool_stats()
+        lines = [
+            f"📊 Marzban [{panel}] — {clients[panel].overload_stats()['breaker']['state']}",
+            f"pool: conns={pool['connections_opened']}/{pool['max_connections']} waits={pool['pool_waits']}"
+            f" wait_p95={_fmt_ms(pool['pool_wait_p95'])} wait_max={_fmt_ms(pool['pool_wait_max'])}",
+        ]
+        for key, st in sorted(endpoints.items(), key=lambda kv: -kv[1]["count"]):
+            statuses = ", ".join(f"{code}:{n}" for code, n in sorted(st["statuses"].items()))
+            lines.append(
+                f"{key}\n  n={st['count']} p50={_fmt_ms(st['p50'])} p95={_fmt_ms(st['p95'])} p99={_fmt_ms(st['p99'])}"
+                f" retry={st['retries']} relogin={st['relogins']} [{statuses}]"
+            )
+        if not endpoints:
+            lines.append("ℹ️ هنوز درخواستی ثبت نشده.")
+        blocks.append("\n".join(lines))
+    # Telegram caps a message at 4096 chars
+    chunk = ""
+    for block in blocks:
+        for line in block.split("\n"):
+            if len(chunk) + len(line) + 1 > 3800:
+                await message.answer(chunk)
+                chunk = ""
+            chunk += ("\n" if chunk else "") + line
+        chunk += "\n"
+    if chunk.strip():
+        await message.answer(chunk.strip())
+
+
+def _fmt_secs(seconds: float) -> str:
+    if seconds < 1:
+        return f"{seconds * 1000:.0f}ms"
+    if seconds < 120:
+        return f"{seconds:.1f}s"
+    return f"{seconds / 60:.1f}m"
+
+
+@router.message(Command("admin_jobs"))
+async def admin_jobs(message: Message) -> None:
+    """/admin_jobs → 24h summary per job; /admin_jobs <name> → its recent runs."""
+    if not (message.from_user and await has_capability_async(message.from_user.id, CAP_PLANS_MANAGE)):
+        await message.answer("⛔️ شما دسترسی ادمین ندارید.")
+        return
+    from app.services.job_scheduler import job_run_stats, recent_job_runs
+
+    parts = (message.text or "").split()
+    if len(parts) > 1:
+        runs = await recent_job_runs(parts[1])
+        if not runs:
+            await message.answer("ℹ️ اجرایی برای این job ثبت نشده.")
+            return
+        lines = [f"🕒 آخرین اجراهای {parts[1]}"]
+        for r in runs:
+            lag = max(0.0, (r.started_at - r.scheduled_at).total_seconds())
+            line = (
+                f"{r.started_at:%m-%d %H:%M:%S} {r.outcome} {_fmt_secs(r.duration_ms / 1000)}"
+                f" lag={_fmt_secs(lag)} items={r.items if r.items is not None else '-'} err={r.errors}"
+            )
+            if r.shard:
+                line += f" shard={r.shard}"
+            if r.error:
+                line += f"\n  {r.error[:200]}"
+            lines.append(line)
+        await message.answer("\n".join(lines)[:3800])
+        return
+    stats = await job_run_stats(24)
+    if not stats:
+        await message.answer("ℹ️ در ۲۴ ساعت گذشته اجرایی ثبت نشده.")
+        return
+    lines = ["📋 Jobs (24h)"]
+    for st in stats:
+        # A job whose runs take longer than its interval cannot keep up with its schedule
+        behind = " ⚠️" if st.interval and (st.max_duration >= st.interval or st.skipped) else ""
+        lines.append(
+            f"{st.job}{behind}\n  runs={st.runs} failed={st.failed} skipped={st.skipped} items={st.items}"
+            f" avg={_fmt_secs(st.avg_duration)} max={_fmt_secs(st.max_duration)} lag={_fmt_secs(st.avg_lag)}"
+            f" every={_fmt_secs(st.interval)} load={(st.avg_duration / st.interval * 100) if st.interval else 0:.0f}%"
+            f"\n  last={st.last_started:%m-%d %H:%M} {st.last_outcome}"
+        )
+    await message.answer("\n".join(lines)[:3800])
+
+
+@router.message(Command("admin_outbound_stats"))
+async def admin_outbound_stats(message: Message) -> None:
+    """Outbound queue of the bot process (the worker logs its own queue periodically)."""
+    if not (message.from_user and await has_capability_async(message.from_user.id, CAP_PLANS_MANAGE)):
+        await message.answer("⛔️ شما دسترسی ادمین ندارید.")
+        return
+    from app.services.outbound import get_outbound
+
+    snap = get_outbound().snapshot()
+    lines = [f"📤 صف ارسال تلگرام (inflight={snap['inflight']}, rate={snap['rate']:.1f}/s)"]
+    for name, st in snap["lanes"].items():
+        lines.append(
+            f"{name}: depth={st['depth']} oldest={_fmt_secs(st['oldest_age'])}"
+            f"\n  sent={st['sent']} failed={st['failed']} blocked={st['blocked']} retry={st['retries']} merged={st['coalesced']}"
+            f"\n  wait p50={_fmt_ms(st['wait_p50'])} p95={_fmt_ms(st['wait_p95'])}"
+            f" | send p50={_fmt_ms(st['send_p50'])} p95={_fmt_ms(st['send_p95'])} p99={_fmt_ms(st['send_p99'])}"
+        )
+    if snap["errors"]:
+        lines.append("errors: " + ", ".join(f"{k}:{v}" for k, v in sorted(snap["errors"].items())))
+    await message.answer("\n".join(lines)[:3800])
 
 
 # ========================
@@ -17,7 +17,7 @@ from app.services import marzban_ops as ops
 from app.services.audit import log_audit
 from app.utils.username import tg_username
 from app.services.security import has_capability_async, CAP_ORDERS_MODERATE
-from app.marzban.client import get_client
+from app.services.marzban_ops import client_for as mz_client_for
 from app.utils.correlation import get_correlation_id
 
 router = Router()
@@ -233,13 +233,16 @@ async def cb_approve_order(cb: CallbackQuery) -> None:
             select(UserService).where(UserService.user_id == user.id, UserService.username == username)
         )
         if not usvc:
-            usvc = UserService(user_id=user.id, username=username, status="active")
+            usvc = UserService(user_id=user.id, username=username, status="active", panel=ops.assigned_panel(username))
             session.add(usvc)
             await session.flush()
         if token:
             usvc.last_token = token
             # keep backward-compat for existing flows
             user.subscription_token = token
+        usvc.expire_at = ops.expire_at_of(info)
+        if user.marzban_username == username:
+            user.expire_at = usvc.expire_at
         # Attach order to the service
         order.user_service_id = usvc.id
         # Mark provisioned if still paid
@@ -271,7 +274,7 @@ async def cb_approve_order(cb: CallbackQuery) -> None:
         links = []
         sub_url = ""
         try:
-            client = await get_client()
+            client = await mz_client_for(username)
             info = await client.get_user(username)
             links = info.get("links") or []
             sub_url = info.get("subscription_url") or ""
@@ -15,7 +15,7 @@ from app.db.session import session_scope
 from app.db.models import User, Order, Setting, Plan, WalletTopUp, UserService
 from app.services.security import has_capability_async, CAP_WALLET_MODERATE
 from app.services import marzban_ops as ops
-from app.marzban.client import get_client
+from app.services.marzban_ops import client_for as mz_client_for
 from app.config import settings
 from app.utils.qr import generate_qr_png
 
@@ -269,13 +269,12 @@ async def cb_user_ban(cb: CallbackQuery) -> None:
             await cb.answer("⛔️ امکان بن کردن ادمین وجود ندارد.", show_alert=True)
             return
         new_status = "disabled" if u.status != "disabled" else "active"
-        try:
-            await ops.set_status(u.marzban_username, new_status)
-            u.status = new_status
-            await session.commit()
-        except Exception:
-            await cb.answer("ops error", show_alert=True)
-            return
+        # Applied by the outbox worker; a failure is reported back to this admin
+        from app.services.outbox import enqueue_set_status
+        if u.marzban_username:
+            await enqueue_set_status(u.marzban_username, new_status, notify_chat_id=cb.from_user.id, session=session)
+        u.status = new_status
+        await session.commit()
     # notify user
     try:
         if new_status == "disabled":
@@ -331,14 +330,20 @@ async def cb_user_banbot(cb: CallbackQuery) -> None:
                     await session.delete(rbk)
             except Exception:
                 pass
-            await session.commit()
         else:
             if not row:
                 session.add(Setting(key=f"USER:{u.telegram_id}:BANNED", value="1"))
             else:
                 row.value = "1"
             u.status = "disabled"
-            await session.commit()
+        # Queue the panel status change for every service in the same transaction as the ban flag;
+        # the worker applies it and reports failures back to this admin
+        target_status = "active" if currently_banned else "disabled"
+        svc_usernames = (await session.execute(select(UserService.username).where(UserService.user_id == uid))).scalars().all()
+        from app.services.outbox import enqueue_set_status
+        for un in svc_usernames:
+            await enqueue_set_status(un, target_status, notify_chat_id=cb.from_user.id, session=session)
+        await session.commit()
     # Invalidate BanGate caches immediately to avoid TTL delays
     try:
         from app.bot.middlewares.ban_gate import invalidate_ban_cache, invalidate_rbk_cache
@@ -346,21 +351,6 @@ async def cb_user_banbot(cb: CallbackQuery) -> None:
         invalidate_rbk_cache(u.telegram_id)
     except Exception:
         pass
-    # Apply status to all services
-    try:
-        # Reload services
-        async with session_scope() as session:
-            svcs = (await session.execute(select(UserService).where(UserService.user_id == uid))).scalars().all()
-            usernames = [s.username for s in svcs]
-        from app.services import marzban_ops as ops
-        target_status = "active" if currently_banned else "disabled"
-        for un in usernames:
-            try:
-                await ops.set_status(un, target_status)
-            except Exception:
-                pass
-    except Exception:
-        pass
     # Notify user
     try:
         if currently_banned:
@@ -1038,7 +1028,7 @@ async def _provision_and_record(uid: int, tpl_id: int) -> Tuple[bool, str]:
         # Upsert UserService for this username
         usvc = await session.scalar(select(UserService).where(UserService.user_id == u2.id, UserService.username == username))
         if not usvc:
-            usvc = UserService(user_id=u2.id, username=username, status="active")
+            usvc = UserService(user_id=u2.id, username=username, status="active", panel=ops.assigned_panel(username))
             session.add(usvc)
             await session.flush()
         # Extract token
@@ -1051,6 +1041,8 @@ async def _provision_and_record(uid: int, tpl_id: int) -> Tuple[bool, str]:
         if token:
             usvc.last_token = token
             u2.subscription_token = token  # backward-compat
+        usvc.expire_at = ops.expire_at_of(info)
+        u2.expire_at = usvc.expire_at
         # Create order linked to the service
         o = Order(
             user_id=u2.id,
@@ -1094,7 +1086,7 @@ async def _provision_and_record(uid: int, tpl_id: int) -> Tuple[bool, str]:
         sub_url = ""
         token2 = token
         try:
-            client = await get_client()
+            client = await mz_client_for(username)
             info2 = await client.get_user(username)
             links = list(map(str, (info2.get("links") or [])))
             sub_url = str(info2.get("subscription_url") or "")
@@ -1173,7 +1165,7 @@ async def _apply_username_change_and_provision(uid: int, tpl_id: int, new_userna
         # Upsert UserService for this username
         usvc = await session.scalar(select(UserService).where(UserService.user_id == u2.id, UserService.username == username))
         if not usvc:
-            usvc = UserService(user_id=u2.id, username=username, status="active")
+            usvc = UserService(user_id=u2.id, username=username, status="active", panel=ops.assigned_panel(username))
             session.add(usvc)
             await session.flush()
         # Extract token
@@ -1185,6 +1177,9 @@ async def _apply_username_change_and_provision(uid: int, tpl_id: int, new_userna
             token = None
         if token:
             usvc.last_token = token
+        usvc.expire_at = ops.expire_at_of(info)
+        if u2.marzban_username == username:
+            u2.expire_at = usvc.expire_at
         # Create order linked to the service
         o = Order(
             user_id=u2.id,
@@ -1229,7 +1224,7 @@ async def _apply_username_change_and_provision(uid: int, tpl_id: int, new_userna
         sub_url = ""
         token2 = token
         try:
-            client = await get_client()
+            client = await mz_client_for(username)
             info2 = await client.get_user(username)
             links = list(map(str, (info2.get("links") or [])))
             sub_url = str(info2.get("subscription_url") or "")
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 import decimal
 import os
 from datetime import datetime
@@ -13,6 +14,7 @@ from app.db.session import session_scope
 from app.db.models import User, Plan, Order
 from app.utils.username import tg_username
 from app.services.audit import log_audit
+from app.services import outbound
 
 router = Router()
 
@@ -321,11 +323,11 @@ async def handle_attach_media(message: Message) -> None:
                 f"Note: {note or '-'}\n"
             )
             kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Approve ✅", callback_data=f"ord:approve:{order.id}"), InlineKeyboardButton(text="Reject ❌", callback_data=f"ord:reject:{order.id}")]])
-            for aid in admin_ids:
-                try:
-                    if is_photo:
-                        await message.bot.send_photo(chat_id=aid, photo=file_id, caption=caption, reply_markup=kb)
-                    else:
-                        await message.bot.send_document(chat_id=aid, document=file_id, caption=caption, reply_markup=kb)
-                except Exception:
-                    pass
+            media = {"photo": file_id} if is_photo else {"document": file_id}
+            await asyncio.gather(*[
+                outbound.send(
+                    aid, "send_photo" if is_photo else "send_document",
+                    lane=outbound.LANE_ADMIN, bot=message.bot, caption=caption, reply_markup=kb, **media,
+                )
+                for aid in admin_ids
+            ])
@@ -12,7 +12,7 @@ from typing import List, Tuple, Dict
 from aiogram.types import BufferedInputFile
 from app.utils.qr import generate_qr_png
 from app.utils.intent_store import set_intent_json, get_intent_json, clear_intent
-from app.marzban.client import get_client
+from app.services.marzban_ops import client_for as mz_client_for
 
 from aiogram import Router, F
 from aiogram.filters import Command
@@ -729,6 +729,7 @@ async def _do_purchase(cb: CallbackQuery, tpl_id: int) -> None:
                     return
                 info = await ops.provision_for_plan(usvc.username, plan)
                 order.user_service_id = usvc.id
+                usvc.expire_at = ops.expire_at_of(info)
                 if isinstance(info, dict):
                     sub_url = info.get("subscription_url", "")
                     token = sub_url.rstrip("/").split("/")[-1] if sub_url else None
@@ -745,10 +746,11 @@ async def _do_purchase(cb: CallbackQuery, tpl_id: int) -> None:
                 # upsert user_service by username
                 usvc = await session.scalar(select(UserService).where(UserService.user_id == db_user.id, UserService.username == username_eff))
                 if not usvc:
-                    usvc = UserService(user_id=db_user.id, username=username_eff, status="active")
+                    usvc = UserService(user_id=db_user.id, username=username_eff, status="active", panel=ops.assigned_panel(username_eff))
                     session.add(usvc)
                     await session.flush()
                 order.user_service_id = usvc.id
+                usvc.expire_at = ops.expire_at_of(info)
                 if isinstance(info, dict):
                     sub_url = info.get("subscription_url", "")
                     token = sub_url.rstrip("/").split("/")[-1] if sub_url else None
@@ -793,7 +795,7 @@ async def _do_purchase(cb: CallbackQuery, tpl_id: int) -> None:
             pass
         # Post-purchase delivery: direct configs, copy-all, QR, manage account
         try:
-            client = await get_client()
+            client = await mz_client_for(deliver_username)
             info2 = await client.get_user(deliver_username)
         except Exception:
             info2 = {}
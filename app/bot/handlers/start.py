@@ -81,6 +81,10 @@ async def handle_start(message: Message) -> None:
                     session.add(u)
                     await session.flush()
                     await session.commit()
+                elif existing.bot_blocked_at is not None:
+                    # Back after blocking the bot: include them in broadcasts again
+                    existing.bot_blocked_at = None
+                    await session.commit()
                 # Upsert Telegram username to settings for search (lowercased)
                 try:
                     tg_un = getattr(message.from_user, "username", None)
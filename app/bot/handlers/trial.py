@@ -11,7 +11,9 @@ from sqlalchemy import select
 from app.db.session import session_scope
 from app.db.models import User, UserService
 from app.utils.username import tg_username
-from app.marzban.client import get_client
+from app.services.marzban_ops import client_for as mz_client_for
+from app.services.marzban_ops import assigned_panel as mz_assigned_panel
+from app.services.marzban_ops import expire_at_of as mz_expire_at_of
 from app.utils.qr import generate_qr_png
 
 
@@ -50,12 +52,15 @@ async def handle_trial(message: Message) -> None:
                 select(UserService).where(UserService.user_id == user.id, UserService.username == username)
             )
             if not svc:
-                svc = UserService(user_id=user.id, username=username, status="active")
+                svc = UserService(user_id=user.id, username=username, status="active", panel=mz_assigned_panel(username))
                 session.add(svc)
                 await session.flush()
             if token:
                 svc.last_token = token
                 user.subscription_token = token
+            svc.expire_at = mz_expire_at_of(result)
+            if user.marzban_username == username:
+                user.expire_at = svc.expire_at
             await session.commit()
             deliver_sid = svc.id
 
@@ -75,7 +80,7 @@ async def handle_trial(message: Message) -> None:
         # Post-provision delivery: send configs and QR similar to plan purchase
         deliver_username = username
         try:
-            client = await get_client()
+            client = await mz_client_for(deliver_username)
             info2 = await client.get_user(deliver_username)
         except Exception:
             info2 = {}
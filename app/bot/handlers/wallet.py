@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 import os
 import re
 from datetime import datetime
@@ -14,6 +15,7 @@ from sqlalchemy import select, update, desc
 from app.db.session import session_scope
 from app.db.models import User, WalletTopUp, Setting
 from app.services.audit import log_audit
+from app.services import outbound
 from app.services.security import has_capability_async, CAP_WALLET_MODERATE, get_admin_ids
 from app.utils.username import tg_username
 from app.utils.intent_store import set_intent_json, get_intent_json, clear_intent
@@ -717,14 +719,14 @@ async def handle_wallet_photo(message: Message) -> None:
             f"Amount: {int(amount/10):,} تومان\n"
         )
         kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Approve ✅", callback_data=f"wallet:approve:{topup.id}"), InlineKeyboardButton(text="Reject ❌", callback_data=f"wallet:reject:{topup.id}"), InlineKeyboardButton(text="رد با دلیل 📝", callback_data=f"wallet:rejectr:{topup.id}")]])
-        for aid in admin_ids:
-            try:
-                if is_photo:
-                    await message.bot.send_photo(chat_id=aid, photo=file_id, caption=caption, reply_markup=kb)
-                else:
-                    await message.bot.send_document(chat_id=aid, document=file_id, caption=caption, reply_markup=kb)
-            except Exception:
-                pass
+        media = {"photo": file_id} if is_photo else {"document": file_id}
+        await asyncio.gather(*[
+            outbound.send(
+                aid, "send_photo" if is_photo else "send_document",
+                lane=outbound.LANE_ADMIN, bot=message.bot, caption=caption, reply_markup=kb, **media,
+            )
+            for aid in admin_ids
+        ])
 
 
 @router.callback_query(F.data.startswith("wallet:rejectr:"))
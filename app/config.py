@@ -43,6 +43,59 @@ class Settings:
     marzban_base_url: str = os.getenv("MARZBAN_BASE_URL", "")
     marzban_admin_username: str = os.getenv("MARZBAN_ADMIN_USERNAME", "")
     marzban_admin_password: str = os.getenv("MARZBAN_ADMIN_PASSWORD", "")
+    # Extra panels as JSON list of {name, base_url, username, password, weight, accept_new};
+    # MARZBAN_BASE_URL above is the "default" panel. Placement: least_users | weighted
+    marzban_panels: str = os.getenv("MARZBAN_PANELS", "")
+    marzban_placement: str = os.getenv("MARZBAN_PLACEMENT", "least_users").strip().lower()
+    marzban_default_panel_weight: float = float(os.getenv("MARZBAN_DEFAULT_PANEL_WEIGHT", "1"))
+    # Page size for bulk GET /api/users reads (scheduler jobs)
+    marzban_page_size: int = int(os.getenv("MARZBAN_PAGE_SIZE", "200"))
+    # User snapshot cache (marzban_ops.get_user): entries, fresh TTL and extra stale-while-revalidate window (seconds)
+    marzban_cache_size: int = int(os.getenv("MARZBAN_CACHE_SIZE", "2048"))
+    marzban_cache_ttl: float = float(os.getenv("MARZBAN_CACHE_TTL", "20"))
+    marzban_cache_stale_ttl: float = float(os.getenv("MARZBAN_CACHE_STALE_TTL", "120"))
+    # vless inbound catalog cache TTL (seconds); the worker also refreshes it periodically
+    marzban_inbounds_ttl: float = float(os.getenv("MARZBAN_INBOUNDS_TTL", "900"))
+    # Send one PUT per field instead of a combined patch (older panels that reject combined updates)
+    marzban_staged_updates: bool = _bool(os.getenv("MARZBAN_STAGED_UPDATES"), False)
+    # Adaptive (AIMD) concurrency cap for panel requests; latency above target counts as overload
+    marzban_concurrency_initial: int = int(os.getenv("MARZBAN_CONCURRENCY_INITIAL", "8"))
+    marzban_concurrency_min: int = int(os.getenv("MARZBAN_CONCURRENCY_MIN", "2"))
+    marzban_concurrency_max: int = int(os.getenv("MARZBAN_CONCURRENCY_MAX", "32"))
+    marzban_latency_target: float = float(os.getenv("MARZBAN_LATENCY_TARGET", "2.0"))
+    # Circuit breaker: consecutive failures before failing fast, and seconds before a probe
+    marzban_breaker_threshold: int = int(os.getenv("MARZBAN_BREAKER_THRESHOLD", "5"))
+    marzban_breaker_reset: float = float(os.getenv("MARZBAN_BREAKER_RESET", "30"))
+    # Refresh the admin JWT this many seconds before its exp; share it via the settings table
+    marzban_token_refresh_margin: float = float(os.getenv("MARZBAN_TOKEN_REFRESH_MARGIN", "300"))
+    marzban_share_token: bool = _bool(os.getenv("MARZBAN_SHARE_TOKEN"), True)
+    # Shared httpx client: HTTP/2 (needs h2), pool size, keep-alive and connections opened at startup
+    marzban_http2: bool = _bool(os.getenv("MARZBAN_HTTP2"), False)
+    marzban_pool_max_connections: int = int(os.getenv("MARZBAN_POOL_MAX_CONNECTIONS", "32"))
+    marzban_pool_max_keepalive: int = int(os.getenv("MARZBAN_POOL_MAX_KEEPALIVE", "16"))
+    marzban_keepalive_expiry: float = float(os.getenv("MARZBAN_KEEPALIVE_EXPIRY", "60"))
+    marzban_pool_timeout: float = float(os.getenv("MARZBAN_POOL_TIMEOUT", "10"))
+    marzban_warmup_connections: int = int(os.getenv("MARZBAN_WARMUP_CONNECTIONS", "2"))
+    # Per-user delete fallback (no bulk endpoint): parallel DELETEs and extra attempts per user
+    marzban_delete_concurrency: int = int(os.getenv("MARZBAN_DELETE_CONCURRENCY", "8"))
+    marzban_delete_retries: int = int(os.getenv("MARZBAN_DELETE_RETRIES", "2"))
+    # Mutation outbox (drained by the worker): pool size, poll interval, attempts, backoff (s), stale-claim lease (s)
+    outbox_workers: int = int(os.getenv("OUTBOX_WORKERS", "4"))
+    outbox_poll_interval: float = float(os.getenv("OUTBOX_POLL_INTERVAL", "1"))
+    outbox_max_attempts: int = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+    outbox_backoff_base: float = float(os.getenv("OUTBOX_BACKOFF_BASE", "5"))
+    outbox_backoff_max: float = float(os.getenv("OUTBOX_BACKOFF_MAX", "600"))
+    outbox_lease_seconds: int = int(os.getenv("OUTBOX_LEASE_SECONDS", "300"))
+    # Worker job scheduler: per-job lease (s) across replicas, max random start delay (s), schedule overrides
+    job_lease_ttl: float = float(os.getenv("JOB_LEASE_TTL", "120"))
+    job_jitter: float = float(os.getenv("JOB_JITTER", "30"))
+    job_schedules: str = os.getenv("JOB_SCHEDULES", "")
+    # Per-user job sharding: heartbeat period (s); JOB_SHARD_COUNT > 0 pins this replica to JOB_SHARD_INDEX
+    job_heartbeat_interval: float = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "15"))
+    job_shard_count: int = int(os.getenv("JOB_SHARD_COUNT", "0"))
+    job_shard_index: int = int(os.getenv("JOB_SHARD_INDEX", "0"))
+    # job_runs history kept for the admin job view (days)
+    job_runs_retention_days: int = int(os.getenv("JOB_RUNS_RETENTION_DAYS", "30"))
 
     telegram_bot_token: str = os.getenv("TELEGRAM_BOT_TOKEN", "")
     telegram_admin_ids: List[int] = field(default_factory=lambda: _parse_csv_ints(os.getenv("TELEGRAM_ADMIN_IDS", "")))
@@ -51,6 +104,31 @@ class Settings:
 
     notify_usage_thresholds: str = os.getenv("NOTIFY_USAGE_THRESHOLDS", "0.7,0.9")
     notify_expiry_days: str = os.getenv("NOTIFY_EXPIRY_DAYS", "3,1,0")
+    # Bulk notification sends (scheduler jobs): parallel sends and overall messages per second
+    notify_send_concurrency: int = int(os.getenv("NOTIFY_SEND_CONCURRENCY", "8"))
+    notify_send_rate: float = float(os.getenv("NOTIFY_SEND_RATE", "20"))
+    # Broadcasts (worker): msgs/s (within the worker's outbound share), parallel sends, users per page (commit + resume point),
+    # poll interval (s), progress edit interval (s), stalled-sender takeover (s)
+    broadcast_rate: float = float(os.getenv("BROADCAST_RATE", "25"))
+    broadcast_concurrency: int = int(os.getenv("BROADCAST_CONCURRENCY", "8"))
+    broadcast_page_size: int = int(os.getenv("BROADCAST_PAGE_SIZE", "100"))
+    broadcast_poll_interval: float = float(os.getenv("BROADCAST_POLL_INTERVAL", "5"))
+    broadcast_progress_interval: float = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+    broadcast_lease_seconds: int = int(os.getenv("BROADCAST_LEASE_SECONDS", "300"))
+    # Outbound Telegram queue: msgs/s for the whole bot (all processes), the bot process's share of it
+    # (worker replicas split the rest), parallel API calls, min seconds between messages to one
+    # private chat / group, retries on flood wait or network errors, stats log interval (s)
+    outbound_rate: float = float(os.getenv("OUTBOUND_RATE", "28"))
+    outbound_bot_share: float = float(os.getenv("OUTBOUND_BOT_SHARE", "0.5"))
+    outbound_concurrency: int = int(os.getenv("OUTBOUND_CONCURRENCY", "8"))
+    outbound_chat_interval: float = float(os.getenv("OUTBOUND_CHAT_INTERVAL", "1.0"))
+    outbound_group_interval: float = float(os.getenv("OUTBOUND_GROUP_INTERVAL", "3.0"))
+    outbound_max_retries: int = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+    outbound_stats_interval: float = float(os.getenv("OUTBOUND_STATS_INTERVAL", "300"))
+    # Usage time series retention: hourly (days), daily (days), monthly (months)
+    usage_hourly_retention_days: int = int(os.getenv("USAGE_HOURLY_RETENTION_DAYS", "14"))
+    usage_daily_retention_days: int = int(os.getenv("USAGE_DAILY_RETENTION_DAYS", "400"))
+    usage_monthly_retention_months: int = int(os.getenv("USAGE_MONTHLY_RETENTION_MONTHS", "36"))
 
     required_channel: str = os.getenv("REQUIRED_CHANNEL", "")
     phone_verification_enabled_default: bool = _bool(os.getenv("PHONE_VERIFICATION_ENABLED"), False)
@@ -60,11 +138,25 @@ class Settings:
     notify_user_on_admin_ops: bool = _bool(os.getenv("NOTIFY_USER_ON_ADMIN_OPS"), True)
 
     log_chat_id: str = os.getenv("LOG_CHAT_ID", "")
+    # notify_log digest: buffer log-channel events for this many seconds (0 = send each at once)
+    # or until this many events, then post them merged into one message
+    log_digest_window: float = float(os.getenv("LOG_DIGEST_WINDOW", "60"))
+    log_digest_max_events: int = int(os.getenv("LOG_DIGEST_MAX_EVENTS", "100"))
 
     cleanup_expired_after_days: int = int(os.getenv("CLEANUP_EXPIRED_AFTER_DAYS", "7"))
+    # Expired-service cleanup: notice lead time before deletion (h), services handled per run
+    cleanup_notice_hours: int = int(os.getenv("CLEANUP_NOTICE_HOURS", "24"))
+    cleanup_expired_batch: int = int(os.getenv("CLEANUP_EXPIRED_BATCH", "500"))
     pending_order_autocancel_hours: int = int(os.getenv("PENDING_ORDER_AUTOCANCEL_HOURS", "12"))
     rate_limit_user_msg_per_min: int = int(os.getenv("RATE_LIMIT_USER_MSG_PER_MIN", "20"))
     receipt_retention_days: int = int(os.getenv("RECEIPT_RETENTION_DAYS", "30"))
+    # Archival of old rows to JSONL.gz (0 days = keep forever); rows per chunk and pause between chunks (s)
+    retention_archive_dir: str = os.getenv("RETENTION_ARCHIVE_DIR", "./data/archive")
+    retention_orders_days: int = int(os.getenv("RETENTION_ORDERS_DAYS", "365"))
+    retention_topups_days: int = int(os.getenv("RETENTION_TOPUPS_DAYS", "365"))
+    retention_audit_days: int = int(os.getenv("RETENTION_AUDIT_DAYS", "180"))
+    retention_batch: int = int(os.getenv("RETENTION_BATCH", "500"))
+    retention_pause: float = float(os.getenv("RETENTION_PAUSE", "0.2"))
 
     # Trial settings
     trial_enabled: bool = _bool(os.getenv("TRIAL_ENABLED"), False)
@@ -0,0 +1,31 @@
+"""
+Add user_services.panel for multi-panel routing
+
+Revision ID: 20261017_000005_service_panel
+Revises: 20250920_000004_coupons
+Create Date: 2026-10-17 00:00:00
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "20261017_000005_service_panel"
+down_revision = "20250920_000004_coupons"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing services live on the single (default) panel
+    op.add_column(
+        "user_services",
+        sa.Column("panel", sa.String(length=64), nullable=False, server_default="default"),
+    )
+    op.create_index("ix_user_services_panel", "user_services", ["panel"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_user_services_panel", table_name="user_services")
+    op.drop_column("user_services", "panel")
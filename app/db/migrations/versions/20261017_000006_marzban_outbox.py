@@ -0,0 +1,51 @@
+"""
+Create marzban_outbox for queued Marzban mutations
+
+Revision ID: 20261017_000006_marzban_outbox
+Revises: 20261017_000005_service_panel
+Create Date: 2026-10-17 00:00:00
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "20261017_000006_marzban_outbox"
+down_revision = "20261017_000005_service_panel"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "marzban_outbox",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("idempotency_key", sa.String(length=191), nullable=False),
+        sa.Column("username", sa.String(length=191), nullable=False),
+        sa.Column("op", sa.String(length=32), nullable=False),
+        sa.Column("payload", sa.Text(), nullable=True),
+        sa.Column("status", sa.String(length=16), nullable=False, server_default="pending"),
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("next_attempt_at", sa.DateTime(), nullable=False, server_default=sa.text("CURRENT_TIMESTAMP")),
+        sa.Column("locked_by", sa.String(length=64), nullable=True),
+        sa.Column("locked_at", sa.DateTime(), nullable=True),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.Column("callback", sa.String(length=64), nullable=True),
+        sa.Column("callback_data", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False, server_default=sa.text("CURRENT_TIMESTAMP")),
+        sa.Column("updated_at", sa.DateTime(), nullable=False, server_default=sa.text("CURRENT_TIMESTAMP")),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_marzban_outbox_idempotency_key", "marzban_outbox", ["idempotency_key"], unique=True)
+    op.create_index("ix_marzban_outbox_username", "marzban_outbox", ["username"])
+    op.create_index("ix_marzban_outbox_status", "marzban_outbox", ["status"])
+    op.create_index("ix_marzban_outbox_next_attempt_at", "marzban_outbox", ["next_attempt_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_marzban_outbox_next_attempt_at", table_name="marzban_outbox")
+    op.drop_index("ix_marzban_outbox_status", table_name="marzban_outbox")
+    op.drop_index("ix_marzban_outbox_username", table_name="marzban_outbox")
+    op.drop_index("ix_marzban_outbox_idempotency_key", table_name="marzban_outbox")
+    op.drop_table("marzban_outbox")
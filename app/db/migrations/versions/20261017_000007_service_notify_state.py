@@ -0,0 +1,40 @@
+"""
+Create service_notify_state for per-service usage/expiry notifications
+
+Revision ID: 20261017_000007_service_notify_state
+Revises: 20261017_000006_marzban_outbox
+Create Date: 2026-10-17 00:00:00
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "20261017_000007_service_notify_state"
+down_revision = "20261017_000006_marzban_outbox"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "service_notify_state",
+        sa.Column("username", sa.String(length=191), primary_key=True),
+        sa.Column("last_usage_bytes", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("last_usage_ratio", sa.Numeric(5, 4), nullable=False, server_default="0"),
+        sa.Column("last_notified_usage_threshold", sa.Numeric(5, 4), nullable=True),
+        sa.Column("last_notified_expiry_day", sa.Integer(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=False, server_default=sa.text("CURRENT_TIMESTAMP")),
+    )
+    # Carry over the per-user state so upgraded installs don't re-send notifications
+    op.execute(
+        "INSERT INTO service_notify_state (username, last_usage_bytes, last_usage_ratio, "
+        "last_notified_usage_threshold, last_notified_expiry_day) "
+        "SELECT marzban_username, last_usage_bytes, last_usage_ratio, "
+        "last_notified_usage_threshold, last_notified_expiry_day FROM users"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("service_notify_state")
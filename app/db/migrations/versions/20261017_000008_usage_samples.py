@@ -0,0 +1,36 @@
+"""
+Create usage_samples (per-service traffic time series)
+
+Revision ID: 20261017_000008_usage_samples
+Revises: 20261017_000007_service_notify_state
+Create Date: 2026-10-17 00:00:00
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "20261017_000008_usage_samples"
+down_revision = "20261017_000007_service_notify_state"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # PK (username, resolution, bucket_ts) serves per-service range scans;
+    # the secondary index serves rollups and retention deletes
+    op.create_table(
+        "usage_samples",
+        sa.Column("username", sa.String(length=191), primary_key=True),
+        sa.Column("resolution", sa.String(length=1), primary_key=True),
+        sa.Column("bucket_ts", sa.BigInteger(), primary_key=True),
+        sa.Column("delta_bytes", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("used_bytes", sa.BigInteger(), nullable=False, server_default="0"),
+    )
+    op.create_index("ix_usage_samples_resolution_bucket", "usage_samples", ["resolution", "bucket_ts"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_usage_samples_resolution_bucket", table_name="usage_samples")
+    op.drop_table("usage_samples")
@@ -0,0 +1,28 @@
+"""
+Add user_services.expire_at (local expiry index)
+
+Revision ID: 20261017_000009_service_expire_at
+Revises: 20261017_000008_usage_samples
+Create Date: 2026-10-17 00:00:00
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "20261017_000009_service_expire_at"
+down_revision = "20261017_000008_usage_samples"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Filled on provisioning/extension and by the hourly usage sync
+    op.add_column("user_services", sa.Column("expire_at", sa.DateTime(), nullable=True))
+    op.create_index("ix_user_services_expire_at", "user_services", ["expire_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_user_services_expire_at", table_name="user_services")
+    op.drop_column("user_services", "expire_at")
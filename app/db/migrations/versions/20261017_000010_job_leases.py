@@ -0,0 +1,32 @@
+"""
+Add job_leases (one worker replica per scheduled job slot)
+
+Revision ID: 20261017_000010_job_leases
+Revises: 20261017_000009_service_expire_at
+Create Date: 2026-10-17 00:00:00
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "20261017_000010_job_leases"
+down_revision = "20261017_000009_service_expire_at"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "job_leases",
+        sa.Column("name", sa.String(length=64), primary_key=True),
+        sa.Column("owner", sa.String(length=128), nullable=True),
+        sa.Column("lease_until", sa.DateTime(), nullable=True),
+        sa.Column("last_slot", sa.BigInteger(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("job_leases")
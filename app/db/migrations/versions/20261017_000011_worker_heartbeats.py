@@ -0,0 +1,32 @@
+"""
+Add worker_heartbeats (shard ring for per-user scheduler jobs)
+
+Revision ID: 20261017_000011_worker_heartbeats
+Revises: 20261017_000010_job_leases
+Create Date: 2026-10-17 00:00:00
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "20261017_000011_worker_heartbeats"
+down_revision = "20261017_000010_job_leases"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "worker_heartbeats",
+        sa.Column("worker_id", sa.String(length=128), primary_key=True),
+        sa.Column("beat_at", sa.DateTime(), nullable=False),
+        sa.Column("started_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_worker_heartbeats_beat_at", "worker_heartbeats", ["beat_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_worker_heartbeats_beat_at", table_name="worker_heartbeats")
+    op.drop_table("worker_heartbeats")
@@ -0,0 +1,44 @@
+"""
+Add job_runs (scheduler run history)
+
+Revision ID: 20261017_000012_job_runs
+Revises: 20261017_000011_worker_heartbeats
+Create Date: 2026-10-17 00:00:00
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "20261017_000012_job_runs"
+down_revision = "20261017_000011_worker_heartbeats"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "job_runs",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("job", sa.String(length=64), nullable=False),
+        sa.Column("shard", sa.String(length=16), nullable=True),
+        sa.Column("owner", sa.String(length=128), nullable=False),
+        sa.Column("scheduled_at", sa.DateTime(), nullable=False),
+        sa.Column("started_at", sa.DateTime(), nullable=False),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+        sa.Column("duration_ms", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("interval_s", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("items", sa.Integer(), nullable=True),
+        sa.Column("errors", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("outcome", sa.String(length=16), nullable=False),
+        sa.Column("error", sa.Text(), nullable=True),
+    )
+    op.create_index("ix_job_runs_job_started", "job_runs", ["job", "started_at"])
+    op.create_index("ix_job_runs_started_at", "job_runs", ["started_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_job_runs_started_at", table_name="job_runs")
+    op.drop_index("ix_job_runs_job_started", table_name="job_runs")
+    op.drop_table("job_runs")
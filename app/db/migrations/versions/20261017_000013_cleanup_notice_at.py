@@ -0,0 +1,25 @@
+"""
+Add service_notify_state.cleanup_notice_at
+
+Revision ID: 20261017_000013_cleanup_notice_at
+Revises: 20261017_000012_job_runs
+Create Date: 2026-10-17 00:00:00
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "20261017_000013_cleanup_notice_at"
+down_revision = "20261017_000012_job_runs"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("service_notify_state", sa.Column("cleanup_notice_at", sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("service_notify_state", "cleanup_notice_at")
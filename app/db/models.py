@@ -4,7 +4,7 @@ from datetime import datetime
 from typing import Optional
 from decimal import Decimal
 
-from sqlalchemy import BigInteger, Boolean, DateTime, Enum, ForeignKey, Integer, Numeric, String, Text
+from sqlalchemy import BigInteger, Boolean, DateTime, Enum, ForeignKey, Index, Integer, Numeric, String, Text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .base import Base
@@ -28,6 +28,8 @@ class User(Base):
     last_notified_expiry_day: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
 
     balance: Mapped[Decimal] = mapped_column(Numeric(12, 2), default=Decimal("0"))
+    # Set when Telegram reports the user blocked the bot; broadcasts skip these users
+    bot_blocked_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True, index=True)
 
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -55,11 +57,136 @@ class UserService(Base):
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
     username: Mapped[str] = mapped_column(String(191), unique=True, index=True)
     status: Mapped[str] = mapped_column(String(32), index=True, default="active")
+    # Marzban panel (registry name) hosting this service
+    panel: Mapped[str] = mapped_column(String(64), index=True, default="default")
+    # Local copy of the panel expiry (naive UTC, None = unlimited) for indexed expiry queries
+    expire_at: Mapped[Optional[datetime]] = mapped_column(DateTime, index=True, nullable=True)
     last_token: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
+class ServiceNotifyState(Base):
+    """Per-service usage/expiry notification state (keyed by the Marzban username of the service)."""
+
+    __tablename__ = "service_notify_state"
+
+    username: Mapped[str] = mapped_column(String(191), primary_key=True)
+    last_usage_bytes: Mapped[int] = mapped_column(BigInteger, default=0)
+    last_usage_ratio: Mapped[Decimal] = mapped_column(Numeric(5, 4), default=Decimal("0"))
+    last_notified_usage_threshold: Mapped[Optional[Decimal]] = mapped_column(Numeric(5, 4), nullable=True)
+    last_notified_expiry_day: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    # When the expired-service cleanup notice was delivered (naive UTC)
+    cleanup_notice_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class UsageSample(Base):
+    """Traffic time series per service; hourly rows are rolled up into daily, then monthly rows."""
+
+    __tablename__ = "usage_samples"
+    __table_args__ = (Index("ix_usage_samples_resolution_bucket", "resolution", "bucket_ts"),)
+
+    username: Mapped[str] = mapped_column(String(191), primary_key=True)
+    resolution: Mapped[str] = mapped_column(String(1), primary_key=True)  # h|d|m
+    bucket_ts: Mapped[int] = mapped_column(BigInteger, primary_key=True)  # UTC epoch seconds, bucket start
+    delta_bytes: Mapped[int] = mapped_column(BigInteger, default=0)  # traffic used within the bucket
+    used_bytes: Mapped[int] = mapped_column(BigInteger, default=0)  # panel used_traffic at the last sample
+
+
+class MarzbanOutbox(Base):
+    """Pending Marzban mutation; drained in id order per username by the worker (app.services.outbox)."""
+
+    __tablename__ = "marzban_outbox"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    idempotency_key: Mapped[str] = mapped_column(String(191), unique=True, index=True)
+    username: Mapped[str] = mapped_column(String(191), index=True)
+    op: Mapped[str] = mapped_column(String(32))
+    payload: Mapped[Optional[str]] = mapped_column(Text, nullable=True)  # JSON kwargs
+    status: Mapped[str] = mapped_column(String(16), index=True, default="pending")  # pending|running|done|failed
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, index=True, default=datetime.utcnow)
+    locked_by: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    locked_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    # Completion callback registered in app.services.outbox (e.g. "notify") and its JSON data
+    callback: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    callback_data: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+
+class JobLease(Base):
+    """Per-job lease so each scheduler slot runs on one worker replica (app.services.job_scheduler)."""
+
+    __tablename__ = "job_leases"
+
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    owner: Mapped[Optional[str]] = mapped_column(String(128), nullable=True)  # host:pid of the holder
+    lease_until: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    last_slot: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)  # last claimed slot (UTC epoch)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class WorkerHeartbeat(Base):
+    """Live worker replicas; sharded scheduler jobs split users across the fresh rows."""
+
+    __tablename__ = "worker_heartbeats"
+
+    worker_id: Mapped[str] = mapped_column(String(128), primary_key=True)  # host:pid
+    beat_at: Mapped[datetime] = mapped_column(DateTime, index=True, default=datetime.utcnow)
+    started_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class JobRun(Base):
+    """One scheduler job run (per shard for sharded jobs); pruned after JOB_RUNS_RETENTION_DAYS."""
+
+    __tablename__ = "job_runs"
+    __table_args__ = (Index("ix_job_runs_job_started", "job", "started_at"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    job: Mapped[str] = mapped_column(String(64))
+    shard: Mapped[Optional[str]] = mapped_column(String(16), nullable=True)  # "index/count" for sharded jobs
+    owner: Mapped[str] = mapped_column(String(128))
+    scheduled_at: Mapped[datetime] = mapped_column(DateTime)  # slot time; started_at - scheduled_at = lag
+    started_at: Mapped[datetime] = mapped_column(DateTime, index=True)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    duration_ms: Mapped[int] = mapped_column(Integer, default=0)
+    interval_s: Mapped[int] = mapped_column(Integer, default=0)  # schedule period at this slot
+    items: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    errors: Mapped[int] = mapped_column(Integer, default=0)
+    outcome: Mapped[str] = mapped_column(String(16))  # ok|partial|error|skipped
+    error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+
+
+class Broadcast(Base):
+    """Mass message to all users, sent by the worker in users.id order (app.services.broadcast)."""
+
+    __tablename__ = "broadcasts"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    text: Mapped[str] = mapped_column(Text)
+    status: Mapped[str] = mapped_column(String(16), index=True, default="pending")  # pending|running|paused|cancelled|done
+    created_by: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)  # admin telegram id
+    # Resume point: every user with id <= cursor has been handled
+    cursor_user_id: Mapped[int] = mapped_column(Integer, default=0)
+    total: Mapped[int] = mapped_column(Integer, default=0)
+    sent: Mapped[int] = mapped_column(Integer, default=0)
+    failed: Mapped[int] = mapped_column(Integer, default=0)
+    blocked: Mapped[int] = mapped_column(Integer, default=0)
+    # Admin message the worker edits with progress
+    progress_chat_id: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    progress_message_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    locked_by: Mapped[Optional[str]] = mapped_column(String(128), nullable=True)
+    heartbeat_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
 class Order(Base):
     __tablename__ = "orders"
 
@@ -20,6 +20,7 @@ from app.bot.handlers import trial as trial_handlers
 from app.bot.handlers import wallet as wallet_handlers
 from app.bot.handlers import admin_users as admin_users_handlers
 from app.bot.handlers import admin_trial as admin_trial_handlers
+from app.bot.handlers import admin_broadcast as admin_broadcast_handlers
 from app.bot.middlewares.rate_limit import RateLimitMiddleware
 from app.bot.middlewares.ban_gate import BanGateMiddleware
 from app.bot.middlewares.correlation import CorrelationMiddleware
@@ -196,6 +197,7 @@ async def main() -> None:
     dp.include_router(admin_orders_handlers.router)
     dp.include_router(admin_users_handlers.router)
     dp.include_router(admin_trial_handlers.router)
+    dp.include_router(admin_broadcast_handlers.router)
     # Coupons admin
     from app.bot.handlers import admin_coupons as admin_coupons_handlers
     dp.include_router(admin_coupons_handlers.router)
@@ -225,6 +227,18 @@ async def main() -> None:
 
     dp.include_router(bridge_router)
 
+    # Open Marzban connections (and fetch the admin token) before the first update arrives
+    try:
+        from app.marzban.client import get_all_clients as _get_mz_clients
+        for _mz_client in (await _get_mz_clients()).values():
+            await _mz_client.warm_up()
+    except Exception:
+        logging.warning("Marzban warm-up skipped", exc_info=True)
+
+    # This process sends with the bot's share of OUTBOUND_RATE; worker replicas use the rest
+    from app.services.outbound import ROLE_BOT, configure_outbound
+    configure_outbound(ROLE_BOT)
+
     # Polling startup
     logging.info("Starting Telegram bot polling ...")
     await bot.delete_webhook(drop_pending_updates=True)
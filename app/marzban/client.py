@@ -1,37 +1,231 @@
 from __future__ import annotations
 
 import asyncio
+import base64
+import hashlib
+import json
 import logging
 import random
+import time
 from dataclasses import dataclass
-from typing import Any, Dict, Optional
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
 
 import httpx
 
 from app.config import settings
+from app.marzban.limiter import AdaptiveLimiter, CircuitBreaker, CircuitOpenError
+from app.marzban.metrics import LatencyHistogram, RequestMetrics
+from app.marzban.registry import DEFAULT_PANEL, default_panel, get_panels
+
+
+# A connection acquire slower than this counts as a pool wait
+POOL_WAIT_THRESHOLD = 0.005
+
+_SETUP_EVENTS = {"connection.connect_tcp", "connection.start_tls"}
+_HEADER_EVENTS = {"http11.send_request_headers.started", "http2.send_request_headers.started"}
 
 
 @dataclass
 class MarzbanAuth:
     access_token: Optional[str] = None
+    # Epoch seconds from the JWT "exp" claim (None if the token carries no exp)
+    expires_at: Optional[float] = None
+
+
+def _jwt_exp(token: str) -> Optional[float]:
+    """Read the exp claim of a JWT without verifying it (we only need the refresh deadline)."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload.encode()).decode()).get("exp")
+        return float(exp) if exp else None
+    except Exception:
+        return None
+
+
+def _to_epoch(value: Union[datetime, int, float]) -> float:
+    """Unix seconds for a datetime (naive values are taken as UTC) or a number."""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return float(value)
+
+
+def _http2_enabled() -> bool:
+    if not settings.marzban_http2:
+        return False
+    try:
+        import h2  # type: ignore  # noqa: F401
+    except ImportError:
+        logging.warning("MARZBAN_HTTP2=1 but the 'h2' package is not installed; using HTTP/1.1")
+        return False
+    return True
 
 
 class MarzbanClient:
-    def __init__(self, base_url: str, username: str, password: str) -> None:
+    def __init__(
+        self,
+        base_url: str,
+        username: str,
+        password: str,
+        panel: str = DEFAULT_PANEL,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ) -> None:
+        self.panel = panel
         self.base_url = base_url.rstrip("/")
         self.username = username
         self.password = password
         self._auth = MarzbanAuth()
-        self._client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=10.0, read=10.0, write=10.0))
+        self._max_connections = max(1, settings.marzban_pool_max_connections)
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=10.0, read=10.0, write=10.0, pool=settings.marzban_pool_timeout),
+            limits=httpx.Limits(
+                # One panel host per client, so the pool cap is the per-host cap
+                max_connections=self._max_connections,
+                max_keepalive_connections=min(settings.marzban_pool_max_keepalive, self._max_connections),
+                keepalive_expiry=settings.marzban_keepalive_expiry,
+            ),
+            http2=_http2_enabled() if transport is None else False,
+            # Custom transport is for in-process targets (e.g. app.marzban.fake_server)
+            transport=transport,
+        )
+        # Pool metrics: time each request spent waiting for a pooled connection (measured from
+        # the request start to its first header write, minus TCP/TLS setup), waits over
+        # POOL_WAIT_THRESHOLD, and new TCP connects
+        self._pool_inflight = 0
+        self.pool_wait = LatencyHistogram()
+        self.pool_waits = 0
+        self.connections_opened = 0
         self._auth_lock = asyncio.Lock()
+        self._refresh_task: Optional["asyncio.Task[None]"] = None
         self._max_attempts = 3
         self._backoff_base = 0.5  # seconds
+        # Single-flight: identical in-flight GETs share one request
+        self._inflight: Dict[Tuple[Any, ...], "asyncio.Task[httpx.Response]"] = {}
+        self.coalesced_requests = 0
+        # Per-endpoint latency histograms, retries, 401 re-logins and final statuses
+        self.metrics = RequestMetrics()
+        # Overload protection: AIMD concurrency cap (interactive lane first) and fail-fast breaker
+        self._limiter = AdaptiveLimiter(
+            initial=settings.marzban_concurrency_initial,
+            min_limit=settings.marzban_concurrency_min,
+            max_limit=settings.marzban_concurrency_max,
+            latency_target=settings.marzban_latency_target,
+        )
+        self._breaker = CircuitBreaker(
+            failure_threshold=settings.marzban_breaker_threshold,
+            reset_timeout=settings.marzban_breaker_reset,
+        )
+
+    def _token_fresh(self) -> bool:
+        if not self._auth.access_token:
+            return False
+        exp = self._auth.expires_at
+        return exp is None or time.time() < exp - settings.marzban_token_refresh_margin
 
     async def _ensure_token(self) -> None:
-        if self._auth.access_token:
+        if self._token_fresh():
             return
         async with self._auth_lock:
-            if self._auth.access_token:
+            if self._token_fresh():
+                return
+            if await self._load_shared_token():
+                return
+            await self._login()
+
+    def _set_token(self, token: str) -> None:
+        self._auth.access_token = token
+        self._auth.expires_at = _jwt_exp(token)
+        self._schedule_refresh()
+
+    def _schedule_refresh(self) -> None:
+        """Re-login in the background shortly before the token expires, so requests never pay for it."""
+        exp = self._auth.expires_at
+        if exp is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        current = self._refresh_task
+        # When the refresh task itself re-logs in, cancelling it here would also cancel the
+        # _store_shared_token that follows, and other processes would never see the new token
+        if current is not None and not current.done() and current is not asyncio.current_task():
+            current.cancel()
+        delay = max(1.0, exp - settings.marzban_token_refresh_margin - time.time())
+        # Small jitter so bot and worker replicas don't refresh in lockstep
+        delay += random.uniform(0, min(30.0, delay * 0.05))
+
+        async def _refresh() -> None:
+            try:
+                await asyncio.sleep(delay)
+                async with self._auth_lock:
+                    if self._token_fresh():
+                        return
+                    if not await self._load_shared_token():
+                        await self._login()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning("Marzban background token refresh failed: %s", e)
+
+        self._refresh_task = loop.create_task(_refresh())
+
+    @property
+    def _shared_token_key(self) -> str:
+        digest = hashlib.sha1(f"{self.base_url}|{self.username}".encode()).hexdigest()[:16]
+        return f"MARZBAN:TOKEN:{digest}"
+
+    async def _load_shared_token(self) -> bool:
+        """Adopt a still-valid token another process stored in the settings table."""
+        if not settings.marzban_share_token:
+            return False
+        try:
+            from app.db.session import session_scope
+            from app.db.models import Setting
+
+            async with session_scope() as session:
+                row = await session.get(Setting, self._shared_token_key)
+                token = str(row.value).strip() if row and row.value else ""
+        except Exception as e:
+            logging.debug("Marzban shared token load failed: %s", e)
+            return False
+        if not token or token == self._auth.access_token:
+            return False
+        exp = _jwt_exp(token)
+        if exp is not None and time.time() >= exp - settings.marzban_token_refresh_margin:
+            return False
+        self._set_token(token)
+        logging.info("Marzban token reused from shared store")
+        return True
+
+    async def _store_shared_token(self, token: str) -> None:
+        if not settings.marzban_share_token:
+            return
+        try:
+            from app.db.session import session_scope
+            from app.db.models import Setting
+
+            async with session_scope() as session:
+                row = await session.get(Setting, self._shared_token_key)
+                if not row:
+                    session.add(Setting(key=self._shared_token_key, value=token))
+                else:
+                    row.value = token
+                await session.commit()
+        except Exception as e:
+            logging.debug("Marzban shared token store failed: %s", e)
+
+    async def _relogin_after_401(self, stale_token: Optional[str]) -> None:
+        async with self._auth_lock:
+            # Another request already replaced the rejected token; reuse it
+            if self._auth.access_token and self._auth.access_token != stale_token:
+                return
+            # Keep the rejected token in place until replaced: clearing it would send concurrent
+            # requests unauthenticated, and would let _load_shared_token re-adopt the same token
+            if await self._load_shared_token():
                 return
             await self._login()
 
@@ -53,8 +247,9 @@ class MarzbanClient:
         token = data_json.get("access_token")
         if not token:
             raise RuntimeError("Marzban token missing in response")
-        self._auth.access_token = token
+        self._set_token(token)
         logging.info("Marzban token acquired")
+        await self._store_shared_token(token)
 
     def _headers(self) -> Dict[str, str]:
         headers = {"Content-Type": "application/json", "accept": "application/json"}
@@ -62,24 +257,161 @@ class MarzbanClient:
             headers["Authorization"] = f"Bearer {self._auth.access_token}"
         return headers
 
+    @staticmethod
+    def _coalesce_key(method: str, path: str, allowed_statuses: Optional[set[int]], kwargs: Dict[str, Any]) -> Optional[Tuple[Any, ...]]:
+        # Only plain idempotent GETs are shared; anything with a body or custom headers runs alone
+        if method.upper() != "GET" or set(kwargs) - {"params"}:
+            return None
+        params = kwargs.get("params") or {}
+        try:
+            frozen_params = tuple(sorted((str(k), str(v)) for k, v in dict(params).items()))
+        except Exception:
+            return None
+        return (path, frozen_params, tuple(sorted(allowed_statuses or ())))
+
     async def _request(self, method: str, path: str, allowed_statuses: Optional[set[int]] = None, **kwargs: Any) -> httpx.Response:
+        key = self._coalesce_key(method, path, allowed_statuses, kwargs)
+        if key is None:
+            return await self._send(method, path, allowed_statuses, **kwargs)
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced_requests += 1
+        else:
+            task = asyncio.ensure_future(self._send(method, path, allowed_statuses, **kwargs))
+            self._inflight[key] = task
+
+            def _done(t: "asyncio.Task[httpx.Response]", key: Tuple[Any, ...] = key) -> None:
+                if self._inflight.get(key) is t:
+                    self._inflight.pop(key, None)
+                # Mark exception as retrieved even if every waiter was cancelled
+                if not t.cancelled():
+                    t.exception()
+
+            task.add_done_callback(_done)
+        # shield: a cancelled caller must not cancel the request other callers are waiting on
+        return await asyncio.shield(task)
+
+    def coalescing_stats(self) -> Dict[str, int]:
+        return {"coalesced_requests": self.coalesced_requests, "inflight": len(self._inflight)}
+
+    async def _http(self, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        """One HTTP exchange under the adaptive limiter; feeds outcome to limiter and breaker."""
+        if not self._breaker.allow():
+            raise CircuitOpenError(f"Marzban circuit open; rejecting {method} {url}")
+        async with self._limiter.slot() as outcome:
+            self._pool_inflight += 1
+            try:
+                resp = await self._client.request(
+                    method, url, headers=self._headers(), extensions={"trace": self._request_trace()}, **kwargs
+                )
+            except httpx.TransportError:
+                self._breaker.record_failure()
+                raise
+            finally:
+                self._pool_inflight -= 1
+            if resp.status_code == 429 or resp.status_code >= 500:
+                outcome["ok"] = False
+                self._breaker.record_failure()
+            else:
+                self._breaker.record_success()
+            return resp
+
+    def _request_trace(self):
+        """httpcore trace hook for one request: counts connects and measures the pool wait."""
+        started = time.monotonic()
+        setup = 0.0
+        setup_started: Optional[float] = None
+        measured = False
+
+        async def _trace(event_name: str, info: Dict[str, Any]) -> None:
+            nonlocal setup, setup_started, measured
+            now = time.monotonic()
+            base, _, phase = event_name.rpartition(".")
+            if base in _SETUP_EVENTS:
+                if phase == "started":
+                    setup_started = now
+                elif setup_started is not None:
+                    setup += now - setup_started
+                    setup_started = None
+                if event_name == "connection.connect_tcp.complete":
+                    self.connections_opened += 1
+            elif event_name in _HEADER_EVENTS and not measured:
+                measured = True
+                waited = max(0.0, now - started - setup)
+                self.pool_wait.observe(waited)
+                if waited >= POOL_WAIT_THRESHOLD:
+                    self.pool_waits += 1
+
+        return _trace
+
+    def pool_stats(self) -> Dict[str, Any]:
+        return {
+            "max_connections": self._max_connections,
+            "inflight": self._pool_inflight,
+            "pool_waits": self.pool_waits,
+            "pool_wait_p95": self.pool_wait.quantile(0.95),
+            "pool_wait_max": self.pool_wait.max,
+            "connections_opened": self.connections_opened,
+        }
+
+    async def warm_up(self, connections: Optional[int] = None) -> None:
+        """Log in and open keep-alive connections before traffic starts (best-effort)."""
+        n = max(0, int(settings.marzban_warmup_connections if connections is None else connections))
+        if not self.base_url:
+            return
+        try:
+            await self._ensure_token()
+            if n:
+                # Concurrent cheap authenticated GETs force n parallel connections into the pool
+                await asyncio.gather(
+                    *[self._send("GET", "/api/admin", allowed_statuses={401, 403, 404, 405}) for _ in range(n)],
+                    return_exceptions=True,
+                )
+            logging.info("Marzban client warmed up", extra={"extra": {"connections": self.connections_opened}})
+        except Exception as e:
+            logging.warning("Marzban warm-up failed: %s", e)
+
+    def overload_stats(self) -> Dict[str, Any]:
+        return {"limiter": self._limiter.stats(), "breaker": self._breaker.stats()}
+
+    async def _send(self, method: str, path: str, allowed_statuses: Optional[set[int]] = None, **kwargs: Any) -> httpx.Response:
+        started = time.monotonic()
+        outcome = "error"
+        try:
+            resp = await self._send_attempts(method, path, allowed_statuses, **kwargs)
+            outcome = str(resp.status_code)
+            return resp
+        except httpx.HTTPStatusError as e:
+            outcome = str(e.response.status_code) if e.response is not None else e.__class__.__name__
+            raise
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            outcome = e.__class__.__name__
+            raise
+        finally:
+            self.metrics.observe(method, path, time.monotonic() - started, outcome)
+
+    async def _send_attempts(self, method: str, path: str, allowed_statuses: Optional[set[int]] = None, **kwargs: Any) -> httpx.Response:
         await self._ensure_token()
         url = f"{self.base_url}{path}"
         last_exc: Optional[Exception] = None
         for attempt in range(1, self._max_attempts + 1):
             try:
-                resp = await self._client.request(method, url, headers=self._headers(), **kwargs)
+                sent_token = self._auth.access_token
+                resp = await self._http(method, url, **kwargs)
                 if resp.status_code == 401:
-                    # token expired → retry once after re-login
-                    async with self._auth_lock:
-                        self._auth.access_token = None
-                        await self._login()
-                    resp = await self._client.request(method, url, headers=self._headers(), **kwargs)
+                    # token rejected (revoked/expired early) → retry once after re-login
+                    self.metrics.record_relogin(method, path)
+                    await self._relogin_after_401(sent_token)
+                    resp = await self._http(method, url, **kwargs)
 
                 if resp.status_code in {429, 502, 503, 504}:
                     if attempt < self._max_attempts:
                         delay = self._backoff_base * (2 ** (attempt - 1)) + random.uniform(0, 0.25)
                         logging.warning("Retryable status %s on %s %s, attempt %d/%d, sleeping %.2fs", resp.status_code, method, url, attempt, self._max_attempts, delay)
+                        self.metrics.record_retry(method, path)
                         await asyncio.sleep(delay)
                         continue
                 # Allow certain statuses to pass through without raising/logging (e.g., 409 conflict on create)
@@ -87,11 +419,15 @@ class MarzbanClient:
                     return resp
                 resp.raise_for_status()
                 return resp
+            except CircuitOpenError:
+                # Fail fast; retrying would only queue behind an open breaker
+                raise
             except (httpx.ConnectError, httpx.ReadTimeout, httpx.WriteError, httpx.ReadError, httpx.TransportError, httpx.TimeoutException) as e:  # type: ignore[attr-defined]
                 last_exc = e
                 if attempt < self._max_attempts:
                     delay = self._backoff_base * (2 ** (attempt - 1)) + random.uniform(0, 0.25)
                     logging.warning("Network error on %s %s: %s, attempt %d/%d, sleeping %.2fs", method, url, e, attempt, self._max_attempts, delay)
+                    self.metrics.record_retry(method, path)
                     await asyncio.sleep(delay)
                     continue
                 logging.exception("HTTP transport error on %s %s after %d attempts: %s", method, url, attempt, e)
@@ -122,6 +458,68 @@ class MarzbanClient:
             )
         return resp.json()
 
+    async def get_users(self, offset: int = 0, limit: int = 100, **params: Any) -> Dict[str, Any]:
+        """Fetch one page of users via GET /api/users?offset=&limit=.
+
+        Extra keyword params (e.g. status, sort) are forwarded as query args; None values are dropped.
+        Always returns a dict shaped like {"users": [...], "total": int | None}.
+        """
+        query: Dict[str, Any] = {"offset": int(offset), "limit": int(limit)}
+        query.update({k: v for k, v in params.items() if v is not None})
+        resp = await self._request("GET", "/api/users", params=query)
+        data = resp.json()
+        if isinstance(data, list):
+            # Some panel builds return a bare list without total
+            return {"users": data, "total": None}
+        return {"users": data.get("users", []) or [], "total": data.get("total")}
+
+    async def iter_user_pages(self, page_size: Optional[int] = None, **params: Any) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Yield pages of user snapshots until the panel runs out of users.
+
+        Costs ceil(total / page_size) requests; only one page is held in memory at a time.
+        """
+        size = max(1, int(page_size or settings.marzban_page_size))
+        offset = 0
+        while True:
+            page = await self.get_users(offset=offset, limit=size, **params)
+            users = [u for u in page["users"] if isinstance(u, dict)]
+            if not users:
+                return
+            yield users
+            offset += len(page["users"])
+            total = page.get("total")
+            if len(page["users"]) < size or (total is not None and offset >= int(total)):
+                return
+
+    async def iter_users(
+        self,
+        status: Optional[str] = None,
+        expired_before: Union[datetime, int, float, None] = None,
+        page_size: Optional[int] = None,
+        **params: Any,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Stream user snapshots one by one with bounded memory (one page at a time).
+
+        - status: panel-side filter (active, disabled, limited, expired, on_hold).
+        - expired_before: only users with 0 < expire <= this moment, like GET /api/users/expired.
+          Pages are then requested sorted by expire, so the scan stops at the first later expiry
+          instead of walking the whole panel.
+        """
+        cutoff = _to_epoch(expired_before) if expired_before is not None else None
+        if cutoff is not None:
+            params.setdefault("sort", "expire")
+        by_expire = params.get("sort") == "expire"
+        async for page in self.iter_user_pages(page_size, status=status, **params):
+            for user in page:
+                if cutoff is None:
+                    yield user
+                    continue
+                expire = int(user.get("expire") or 0)
+                if 0 < expire <= cutoff:
+                    yield user
+                elif by_expire and expire > cutoff:
+                    return
+
     async def create_user(self, username: str, template_id: int, data_limit: int, expire: int, note: str = "") -> Dict[str, Any]:
         payload = {
             "username": username,
@@ -158,27 +556,42 @@ class MarzbanClient:
         return
 
     async def aclose_hard(self) -> None:
+        if self._refresh_task is not None and not self._refresh_task.done():
+            self._refresh_task.cancel()
         await self._client.aclose()
 
 
-_shared_client: Optional[MarzbanClient] = None
+_shared_clients: Dict[str, MarzbanClient] = {}
 
 
-async def get_client() -> MarzbanClient:
-    global _shared_client
-    if _shared_client is None:
-        _shared_client = MarzbanClient(
-            settings.marzban_base_url,
-            settings.marzban_admin_username,
-            settings.marzban_admin_password,
-        )
-    return _shared_client
+async def get_client(panel: Optional[str] = None) -> MarzbanClient:
+    """Shared client for a panel from the registry (default panel when None)."""
+    name = panel or default_panel()
+    client = _shared_clients.get(name)
+    if client is None:
+        cfg = get_panels().get(name)
+        if cfg is None:
+            raise KeyError(f"unknown Marzban panel: {name}")
+        client = MarzbanClient(cfg.base_url, cfg.username, cfg.password, panel=name)
+        _shared_clients[name] = client
+    return client
+
+
+async def get_all_clients() -> Dict[str, MarzbanClient]:
+    """Clients for every configured panel (for fan-out jobs)."""
+    return {name: await get_client(name) for name in get_panels()}
+
+
+def request_metrics() -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """Per-panel endpoint metrics of the shared clients: {panel: {"GET /api/user/{username}": {...}}}."""
+    return {name: client.metrics.snapshot() for name, client in _shared_clients.items()}
 
 
 async def aclose_shared() -> None:
-    global _shared_client
-    if _shared_client is not None:
+    clients = list(_shared_clients.values())
+    _shared_clients.clear()
+    for client in clients:
         try:
-            await _shared_client.aclose_hard()
-        finally:
-            _shared_client = None
+            await client.aclose_hard()
+        except Exception:
+            pass
@@ -0,0 +1,349 @@
+"""In-process stand-in for the Marzban 0.8.4 endpoints this project uses.
+
+FakeMarzban is a plain ASGI app (no web framework needed), meant to be mounted with
+httpx.ASGITransport so MarzbanClient, marzban_ops and provisioning can run without a panel:
+
+    fake = FakeMarzban(latency=0.01, error_rate=0.05)
+    client = MarzbanClient("http://marzban.test", "admin", "secret", transport=fake.transport())
+
+Fault injection: fixed/ranged latency, random 5xx at error_rate, and queued 401/429 responses
+(inject_401 / inject_429). Per-endpoint request counts are kept in `calls`.
+"""
+from __future__ import annotations
+
+import asyncio
+import base64
+import json
+import random
+import re
+import secrets
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple, Union
+from urllib.parse import parse_qs
+
+import httpx
+
+Latency = Union[float, Tuple[float, float]]
+
+_ROUTES: List[Tuple[str, "re.Pattern[str]", str]] = [
+    ("POST", re.compile(r"^/api/admin/token$"), "token"),
+    ("GET", re.compile(r"^/api/admin$"), "admin"),
+    ("GET", re.compile(r"^/api/inbounds$"), "inbounds"),
+    ("GET", re.compile(r"^/api/user_template$"), "templates"),
+    ("POST", re.compile(r"^/api/user$"), "create_user"),
+    ("GET", re.compile(r"^/api/users$"), "list_users"),
+    ("GET", re.compile(r"^/api/users/expired$"), "list_expired"),
+    ("DELETE", re.compile(r"^/api/users/expired$"), "delete_expired"),
+    ("POST", re.compile(r"^/api/user/(?P<username>[^/]+)/reset$"), "reset_user"),
+    ("POST", re.compile(r"^/api/user/(?P<username>[^/]+)/revoke_sub$"), "revoke_sub"),
+    ("GET", re.compile(r"^/api/user/(?P<username>[^/]+)$"), "get_user"),
+    ("PUT", re.compile(r"^/api/user/(?P<username>[^/]+)$"), "update_user"),
+    ("DELETE", re.compile(r"^/api/user/(?P<username>[^/]+)$"), "delete_user"),
+    ("GET", re.compile(r"^/sub4me/(?P<token>[^/]+)/info$"), "sub_info"),
+    ("GET", re.compile(r"^/sub4me/(?P<token>[^/]+)/usage$"), "sub_usage"),
+]
+
+
+def _b64(data: Dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+
+class FakeMarzban:
+    def __init__(
+        self,
+        *,
+        admin_username: str = "admin",
+        admin_password: str = "secret",
+        latency: Latency = 0.0,
+        error_rate: float = 0.0,
+        token_ttl: int = 86400,
+        inbound_tags: Optional[List[str]] = None,
+        templates: Optional[List[Dict[str, Any]]] = None,
+        bulk_expired_delete: bool = True,
+        username_filter: bool = True,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.admin_username = admin_username
+        self.admin_password = admin_password
+        self.latency = latency
+        self.error_rate = float(error_rate)
+        self.token_ttl = int(token_ttl)
+        self.inbound_tags = list(inbound_tags if inbound_tags is not None else ["VLESS TCP", "Info"])
+        self.templates = list(templates or [])
+        # Older panels lack DELETE /api/users/expired; False makes it 404 like they do
+        self.bulk_expired_delete = bulk_expired_delete
+        # Some panel builds ignore ?username= on GET /api/users; False does the same
+        self.username_filter = username_filter
+        self.users: Dict[str, Dict[str, Any]] = {}
+        self.tokens: Dict[str, float] = {}
+        self.calls: Counter[str] = Counter()
+        self.logins = 0
+        self._pending_401 = 0
+        self._pending_429 = 0
+        self._rng = random.Random(seed)
+
+    # ---- test helpers ----
+    def transport(self) -> httpx.ASGITransport:
+        return httpx.ASGITransport(app=self)
+
+    def inject_401(self, count: int = 1) -> None:
+        """Answer the next `count` authenticated requests with 401 (as if the token expired)."""
+        self._pending_401 += int(count)
+
+    def inject_429(self, count: int = 1) -> None:
+        self._pending_429 += int(count)
+
+    def revoke_tokens(self) -> None:
+        self.tokens.clear()
+
+    def add_user(self, username: str, **fields: Any) -> Dict[str, Any]:
+        user = self._new_user({"username": username, **fields})
+        self.users[username] = user
+        return user
+
+    def reset_calls(self) -> None:
+        self.calls.clear()
+        self.logins = 0
+
+    # ---- ASGI ----
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            return
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        status, payload = await self._dispatch(
+            scope["method"].upper(),
+            scope["path"],
+            parse_qs(scope.get("query_string", b"").decode()),
+            {k.decode().lower(): v.decode() for k, v in scope.get("headers", [])},
+            body,
+        )
+        raw = json.dumps(payload).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(raw)).encode())],
+        })
+        await send({"type": "http.response.body", "body": raw})
+
+    async def _sleep(self) -> None:
+        delay = self.latency
+        if isinstance(delay, tuple):
+            delay = self._rng.uniform(*delay)
+        if delay and delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _dispatch(
+        self, method: str, path: str, query: Dict[str, List[str]], headers: Dict[str, str], body: bytes
+    ) -> Tuple[int, Any]:
+        await self._sleep()
+        for route_method, pattern, name in _ROUTES:
+            match = pattern.match(path)
+            if route_method == method and match:
+                break
+        else:
+            self.calls[f"{method} {path}"] += 1
+            return 404, {"detail": "Not Found"}
+        self.calls[name] += 1
+        params = match.groupdict()
+
+        if name == "token":
+            return self._token(body)
+        if name not in {"sub_info", "sub_usage"}:
+            if self._pending_401 > 0:
+                self._pending_401 -= 1
+                return 401, {"detail": "Could not validate credentials"}
+            if not self._authorized(headers):
+                return 401, {"detail": "Could not validate credentials"}
+        if self._pending_429 > 0:
+            self._pending_429 -= 1
+            return 429, {"detail": "Too Many Requests"}
+        if self.error_rate and self._rng.random() < self.error_rate:
+            return 503, {"detail": "injected failure"}
+        handler = getattr(self, f"_h_{name}")
+        try:
+            data = json.loads(body) if body else {}
+        except Exception:
+            return 422, {"detail": "invalid JSON"}
+        return handler(params=params, query=query, data=data)
+
+    # ---- auth ----
+    def _token(self, body: bytes) -> Tuple[int, Any]:
+        form = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+        if form.get("username") != self.admin_username or form.get("password") != self.admin_password:
+            return 401, {"detail": "Incorrect username or password"}
+        self.logins += 1
+        exp = int(time.time()) + self.token_ttl
+        token = ".".join([_b64({"alg": "HS256", "typ": "JWT"}), _b64({"sub": self.admin_username, "access": "sudo", "exp": exp}), secrets.token_urlsafe(16)])
+        self.tokens[token] = float(exp)
+        return 200, {"access_token": token, "token_type": "bearer"}
+
+    def _authorized(self, headers: Dict[str, str]) -> bool:
+        auth = headers.get("authorization", "")
+        if not auth.lower().startswith("bearer "):
+            return False
+        exp = self.tokens.get(auth[7:].strip())
+        return exp is not None and exp > time.time()
+
+    # ---- users ----
+    def _new_user(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        sub_token = secrets.token_urlsafe(24)
+        user = {
+            "username": data["username"],
+            "status": data.get("status", "active"),
+            "expire": int(data.get("expire") or 0),
+            "data_limit": int(data.get("data_limit") or 0),
+            "data_limit_reset_strategy": data.get("data_limit_reset_strategy", "no_reset"),
+            "used_traffic": int(data.get("used_traffic") or 0),
+            "lifetime_used_traffic": int(data.get("used_traffic") or 0),
+            "inbounds": data.get("inbounds") or {"vless": [t for t in self.inbound_tags if t.lower() != "info"]},
+            "proxies": data.get("proxies") or {"vless": {}},
+            "note": data.get("note", ""),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()),
+            "subscription_token": sub_token,
+            "subscription_url": f"/sub/{sub_token}",
+        }
+        user["links"] = [f"vless://{data['username']}@fake.local:443?security=tls#{t}" for t in user["inbounds"].get("vless", [])]
+        return user
+
+    def _is_expired(self, user: Dict[str, Any], now: Optional[float] = None) -> bool:
+        exp = int(user.get("expire") or 0)
+        return exp > 0 and exp <= (now or time.time())
+
+    def _view(self, user: Dict[str, Any]) -> Dict[str, Any]:
+        out = dict(user)
+        if out["status"] == "active":
+            if self._is_expired(out):
+                out["status"] = "expired"
+            elif out["data_limit"] and out["used_traffic"] >= out["data_limit"]:
+                out["status"] = "limited"
+        return out
+
+    def _find_user(self, username: str) -> Optional[Dict[str, Any]]:
+        return self.users.get(username)
+
+    def _h_admin(self, **_: Any) -> Tuple[int, Any]:
+        return 200, {"username": self.admin_username, "is_sudo": True}
+
+    def _h_inbounds(self, **_: Any) -> Tuple[int, Any]:
+        return 200, {"vless": [{"tag": t, "protocol": "vless", "network": "tcp", "tls": "tls", "port": 443} for t in self.inbound_tags]}
+
+    def _h_templates(self, **_: Any) -> Tuple[int, Any]:
+        return 200, self.templates
+
+    def _h_create_user(self, data: Dict[str, Any], **_: Any) -> Tuple[int, Any]:
+        username = str(data.get("username") or "")
+        if not username:
+            return 422, {"detail": "username required"}
+        if username in self.users:
+            return 409, {"detail": "User already exists"}
+        for tag in (data.get("inbounds") or {}).get("vless", []):
+            if tag not in self.inbound_tags:
+                return 400, {"detail": f"Inbound {tag} doesn't exist"}
+        user = self._new_user(data)
+        self.users[username] = user
+        return 200, self._view(user)
+
+    def _h_get_user(self, params: Dict[str, str], **_: Any) -> Tuple[int, Any]:
+        user = self._find_user(params["username"])
+        if user is None:
+            return 404, {"detail": "User not found"}
+        return 200, self._view(user)
+
+    def _h_update_user(self, params: Dict[str, str], data: Dict[str, Any], **_: Any) -> Tuple[int, Any]:
+        user = self._find_user(params["username"])
+        if user is None:
+            return 404, {"detail": "User not found"}
+        for key in ("status", "expire", "data_limit", "data_limit_reset_strategy", "note", "inbounds", "proxies"):
+            if key in data:
+                user[key] = data[key]
+        return 200, self._view(user)
+
+    def _h_delete_user(self, params: Dict[str, str], **_: Any) -> Tuple[int, Any]:
+        if self.users.pop(params["username"], None) is None:
+            return 404, {"detail": "User not found"}
+        return 200, {}
+
+    def _h_reset_user(self, params: Dict[str, str], **_: Any) -> Tuple[int, Any]:
+        user = self._find_user(params["username"])
+        if user is None:
+            return 404, {"detail": "User not found"}
+        user["used_traffic"] = 0
+        return 200, self._view(user)
+
+    def _h_revoke_sub(self, params: Dict[str, str], **_: Any) -> Tuple[int, Any]:
+        user = self._find_user(params["username"])
+        if user is None:
+            return 404, {"detail": "User not found"}
+        user["subscription_token"] = secrets.token_urlsafe(24)
+        user["subscription_url"] = f"/sub/{user['subscription_token']}"
+        return 200, self._view(user)
+
+    def _h_list_users(self, query: Dict[str, List[str]], **_: Any) -> Tuple[int, Any]:
+        views = [self._view(u) for u in self.users.values()]
+        if query.get("status"):
+            views = [u for u in views if u["status"] == query["status"][0]]
+        if query.get("username") and self.username_filter:
+            wanted = set(query["username"])
+            views = [u for u in views if u["username"] in wanted]
+        if query.get("search"):
+            needle = query["search"][0].lower()
+            views = [u for u in views if needle in u["username"].lower() or needle in str(u.get("note", "")).lower()]
+        for key in reversed((query.get("sort") or [""])[0].split(",")):
+            if key.lstrip("-") in {"username", "used_traffic", "data_limit", "expire", "created_at"}:
+                field = key.lstrip("-")
+                views.sort(key=lambda u: u.get(field) or 0, reverse=key.startswith("-"))
+        total = len(views)
+        offset = int((query.get("offset") or ["0"])[0])
+        limit_raw = (query.get("limit") or [None])[0]
+        page = views[offset:] if limit_raw is None else views[offset:offset + int(limit_raw)]
+        return 200, {"users": page, "total": total}
+
+    def _expired_users(self, query: Dict[str, List[str]]) -> List[Dict[str, Any]]:
+        before = (query.get("expired_before") or [None])[0]
+        before_ts = time.time()
+        if before:
+            try:
+                before_ts = time.mktime(time.strptime(before[:19], "%Y-%m-%dT%H:%M:%S"))
+            except ValueError:
+                pass
+        # Like Marzban: only users whose status is expired/limited (not ones disabled by an admin)
+        return [
+            u for u in self.users.values()
+            if self._is_expired(u, before_ts) and self._view(u)["status"] in ("expired", "limited")
+        ]
+
+    def _h_list_expired(self, query: Dict[str, List[str]], **_: Any) -> Tuple[int, Any]:
+        # 0.8.4 returns a plain list; entries are full users here to match how callers read them
+        return 200, [self._view(u) for u in self._expired_users(query)]
+
+    def _h_delete_expired(self, query: Dict[str, List[str]], **_: Any) -> Tuple[int, Any]:
+        if not self.bulk_expired_delete:
+            return 404, {"detail": "Not Found"}
+        removed = [u["username"] for u in self._expired_users(query)]
+        for name in removed:
+            self.users.pop(name, None)
+        return 200, removed
+
+    def _user_by_sub_token(self, token: str) -> Optional[Dict[str, Any]]:
+        for user in self.users.values():
+            if user.get("subscription_token") == token:
+                return user
+        return None
+
+    def _h_sub_info(self, params: Dict[str, str], **_: Any) -> Tuple[int, Any]:
+        user = self._user_by_sub_token(params["token"])
+        if user is None:
+            return 404, {"detail": "Not Found"}
+        return 200, self._view(user)
+
+    def _h_sub_usage(self, params: Dict[str, str], **_: Any) -> Tuple[int, Any]:
+        user = self._user_by_sub_token(params["token"])
+        if user is None:
+            return 404, {"detail": "Not Found"}
+        return 200, {"username": user["username"], "usages": [{"node_name": "Master", "used_traffic": user["used_traffic"]}]}
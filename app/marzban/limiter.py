@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterator, List, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes: lower value is served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("marzban_priority", default=PRIORITY_INTERACTIVE)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+@contextmanager
+def request_priority(priority: int) -> Iterator[None]:
+    """Run Marzban calls made inside this block in the given lane (e.g. scheduler jobs → background)."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class CircuitOpenError(httpx.TransportError):
+    """Raised without touching the network while the Marzban circuit breaker is open."""
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limiter with priority lanes.
+
+    - Additive increase: each healthy response grows the limit by 1/limit (≈ +1 per window of requests).
+    - Multiplicative decrease: a 429/5xx/transport error or a response slower than latency_target
+      shrinks the limit by `backoff`, at most once per `cooldown` seconds.
+    - Waiters are woken strictly by (priority, arrival), so interactive bot requests overtake
+      queued background traffic.
+    """
+
+    def __init__(
+        self,
+        *,
+        initial: float = 8,
+        min_limit: float = 1,
+        max_limit: float = 32,
+        latency_target: float = 2.0,
+        backoff: float = 0.7,
+        cooldown: float = 1.0,
+    ) -> None:
+        self.min_limit = max(1.0, float(min_limit))
+        self.max_limit = max(self.min_limit, float(max_limit))
+        self.limit = min(max(float(initial), self.min_limit), self.max_limit)
+        self.latency_target = float(latency_target)
+        self.backoff = float(backoff)
+        self.cooldown = float(cooldown)
+        self.inflight = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._last_decrease = 0.0
+        self.decreases = 0
+        self.waited = 0
+
+    def _wake(self) -> None:
+        while self._waiters and self.inflight < int(self.limit):
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():
+                continue
+            self.inflight += 1
+            fut.set_result(None)
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE) -> None:
+        if self.inflight < int(self.limit) and not self._waiters:
+            self.inflight += 1
+            return
+        self.waited += 1
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Slot was granted just before cancellation; hand it back
+                self.inflight -= 1
+                self._wake()
+            raise
+
+    def release(self, latency: float, ok: bool) -> None:
+        self.inflight = max(0, self.inflight - 1)
+        now = time.monotonic()
+        if not ok or latency > self.latency_target:
+            if now - self._last_decrease >= self.cooldown:
+                self._last_decrease = now
+                new_limit = max(self.min_limit, self.limit * self.backoff)
+                if new_limit < self.limit:
+                    self.decreases += 1
+                    logger.info("marzban limiter decrease", extra={"extra": {"limit": round(new_limit, 2), "latency": round(latency, 3), "ok": ok}})
+                self.limit = new_limit
+        else:
+            self.limit = min(self.max_limit, self.limit + 1.0 / max(self.limit, 1.0))
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self, priority: int | None = None) -> AsyncIterator[Dict[str, bool]]:
+        """Hold one concurrency slot; the caller sets outcome["ok"] = False on overload signals."""
+        await self.acquire(current_priority() if priority is None else priority)
+        started = time.monotonic()
+        outcome = {"ok": True}
+        try:
+            yield outcome
+        except BaseException:
+            outcome["ok"] = False
+            raise
+        finally:
+            self.release(time.monotonic() - started, outcome["ok"])
+
+    def stats(self) -> Dict[str, float]:
+        queued = sum(1 for _, _, f in self._waiters if not f.done())
+        return {
+            "limit": round(self.limit, 2),
+            "inflight": self.inflight,
+            "queued": queued,
+            "waited": self.waited,
+            "decreases": self.decreases,
+        }
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker: closed → open (fail fast) → half_open (one probe)."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._probe_inflight = False
+        self._probe_started = 0.0
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        now = time.monotonic()
+        if self.state == "open" and now - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            self._probe_inflight = False
+        # A probe that never reported back (e.g. cancelled) must not wedge the breaker
+        if self.state == "half_open" and (not self._probe_inflight or now - self._probe_started >= self.reset_timeout):
+            self._probe_inflight = True
+            self._probe_started = now
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self) -> None:
+        if self.state != "closed":
+            logger.info("marzban circuit closed")
+        self.state = "closed"
+        self.failures = 0
+        self._probe_inflight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning("marzban circuit opened", extra={"extra": {"failures": self.failures}})
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self._probe_inflight = False
+
+    def stats(self) -> Dict[str, object]:
+        return {"state": self.state, "failures": self.failures, "rejected": self.rejected}
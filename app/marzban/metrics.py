@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import bisect
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+# Latency bucket upper bounds in seconds (last bucket is +Inf)
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.25, 0.35, 0.5, 0.75,
+    1.0, 1.5, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 30.0, 60.0,
+)
+
+# Path templates, most specific first; dynamic segments are collapsed so metrics stay low-cardinality
+_PATH_RULES: List[Tuple["re.Pattern[str]", str]] = [
+    (re.compile(r"^/api/user/[^/]+/(reset|revoke_sub|usage|active-next)$"), r"/api/user/{username}/\1"),
+    (re.compile(r"^/api/user/[^/]+$"), "/api/user/{username}"),
+    (re.compile(r"^/api/admin/(?!token$)[^/]+$"), "/api/admin/{username}"),
+    (re.compile(r"^/api/user_template/\d+$"), "/api/user_template/{id}"),
+    (re.compile(r"^/api/node/\d+(/.*)?$"), r"/api/node/{id}\1"),
+    (re.compile(r"^/sub4me/[^/]+/(info|usage)$"), r"/sub4me/{token}/\1"),
+    (re.compile(r"^/sub4me/[^/]+$"), "/sub4me/{token}"),
+]
+
+
+def normalize_path(path: str) -> str:
+    """Collapse usernames/tokens/ids in a Marzban API path (e.g. /api/user/{username})."""
+    path = path.split("?", 1)[0].rstrip("/") or "/"
+    for pattern, template in _PATH_RULES:
+        if pattern.match(path):
+            return pattern.sub(template, path)
+    return path
+
+
+class LatencyHistogram:
+    """Fixed-bucket histogram; quantiles are interpolated inside the matching bucket."""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(self.max, lower + (upper - lower) * ((rank - seen) / n))
+            seen += n
+        return self.max
+
+
+class EndpointStats:
+    def __init__(self) -> None:
+        self.latency = LatencyHistogram()
+        self.statuses: Counter[str] = Counter()
+        self.retries = 0
+        self.relogins = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        h = self.latency
+        return {
+            "count": h.count,
+            "mean": (h.total / h.count) if h.count else None,
+            "p50": h.quantile(0.50),
+            "p95": h.quantile(0.95),
+            "p99": h.quantile(0.99),
+            "max": h.max,
+            "retries": self.retries,
+            "relogins": self.relogins,
+            "statuses": dict(self.statuses),
+            "buckets": dict(zip([*map(str, h.buckets), "+Inf"], h.counts)),
+        }
+
+
+class RequestMetrics:
+    """Per-endpoint request metrics for one MarzbanClient, keyed by "METHOD /normalized/path".
+
+    Latency covers the whole logical request (retries and re-login included); the status is the
+    final outcome: an HTTP code, or the exception class name when no response came back.
+    """
+
+    def __init__(self) -> None:
+        self.endpoints: Dict[str, EndpointStats] = {}
+
+    def _get(self, method: str, path: str) -> EndpointStats:
+        key = f"{method.upper()} {normalize_path(path)}"
+        stats = self.endpoints.get(key)
+        if stats is None:
+            stats = self.endpoints[key] = EndpointStats()
+        return stats
+
+    def observe(self, method: str, path: str, seconds: float, status: str) -> None:
+        stats = self._get(method, path)
+        stats.latency.observe(seconds)
+        stats.statuses[status] += 1
+
+    def record_retry(self, method: str, path: str) -> None:
+        self._get(method, path).retries += 1
+
+    def record_relogin(self, method: str, path: str) -> None:
+        self._get(method, path).relogins += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {key: stats.snapshot() for key, stats in sorted(self.endpoints.items())}
+
+    def reset(self) -> None:
+        self.endpoints.clear()
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import json
+import logging
+import random
+from dataclasses import dataclass
+from typing import Dict, List, Mapping
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PANEL = "default"
+
+
+@dataclass(frozen=True)
+class PanelConfig:
+    name: str
+    base_url: str
+    username: str
+    password: str
+    weight: float = 1.0
+    # Excluded from placement of new services (existing services keep working)
+    accept_new: bool = True
+
+
+def _parse_panels(raw: str) -> List[PanelConfig]:
+    """Parse MARZBAN_PANELS: a JSON list of {name, base_url, username, password, weight?, accept_new?}."""
+    if not raw.strip():
+        return []
+    try:
+        items = json.loads(raw)
+    except Exception:
+        logger.error("MARZBAN_PANELS is not valid JSON; ignoring")
+        return []
+    panels: List[PanelConfig] = []
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict) or not item.get("name") or not item.get("base_url"):
+            logger.warning("MARZBAN_PANELS entry skipped (name/base_url required)")
+            continue
+        panels.append(
+            PanelConfig(
+                name=str(item["name"]).strip(),
+                base_url=str(item["base_url"]).strip(),
+                username=str(item.get("username") or settings.marzban_admin_username),
+                password=str(item.get("password") or settings.marzban_admin_password),
+                weight=max(0.0, float(item.get("weight", 1.0) or 0.0)),
+                accept_new=bool(item.get("accept_new", True)),
+            )
+        )
+    return panels
+
+
+_PANELS: Dict[str, PanelConfig] | None = None
+
+
+def get_panels() -> Dict[str, PanelConfig]:
+    """All configured panels by name. MARZBAN_BASE_URL (if set) is the "default" panel."""
+    global _PANELS
+    if _PANELS is None:
+        panels: Dict[str, PanelConfig] = {}
+        if settings.marzban_base_url:
+            panels[DEFAULT_PANEL] = PanelConfig(
+                name=DEFAULT_PANEL,
+                base_url=settings.marzban_base_url,
+                username=settings.marzban_admin_username,
+                password=settings.marzban_admin_password,
+                weight=settings.marzban_default_panel_weight,
+                accept_new=settings.marzban_default_panel_weight > 0,
+            )
+        for p in _parse_panels(settings.marzban_panels):
+            panels[p.name] = p
+        if not panels:
+            # Keep legacy behaviour: an unconfigured default panel
+            panels[DEFAULT_PANEL] = PanelConfig(DEFAULT_PANEL, "", settings.marzban_admin_username, settings.marzban_admin_password)
+        _PANELS = panels
+    return _PANELS
+
+
+def default_panel() -> str:
+    panels = get_panels()
+    return DEFAULT_PANEL if DEFAULT_PANEL in panels else next(iter(panels))
+
+
+def is_multi_panel() -> bool:
+    return len(get_panels()) > 1
+
+
+def choose_panel(service_counts: Mapping[str, int]) -> str:
+    """Pick a panel for a new service according to MARZBAN_PLACEMENT.
+
+    - least_users (default): lowest service count per unit of weight.
+    - weighted: random choice proportional to weight.
+    """
+    candidates = [p for p in get_panels().values() if p.accept_new and p.weight > 0]
+    if not candidates:
+        return default_panel()
+    if len(candidates) == 1:
+        return candidates[0].name
+    if settings.marzban_placement == "weighted":
+        return random.choices(candidates, weights=[p.weight for p in candidates], k=1)[0].name
+    return min(candidates, key=lambda p: (service_counts.get(p.name, 0) / p.weight, p.name)).name
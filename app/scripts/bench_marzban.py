@@ -0,0 +1,122 @@
+"""Load-test MarzbanClient against the in-process fake panel (default) or a real one.
+
+    python -m app.scripts.bench_marzban --users 500 --concurrency 32 --latency 0.02 --error-rate 0.01
+    python -m app.scripts.bench_marzban --real     # uses MARZBAN_BASE_URL / admin credentials
+
+Each virtual user runs create → get → update → get against its own username. Users are
+created like the bot does (minimal payload + vless inbounds) and every `--prefix` user the run
+created is deleted again at the end, also when the run fails or is interrupted.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Dict, List
+
+from app.config import settings
+from app.marzban.client import MarzbanClient
+from app.marzban.fake_server import FakeMarzban
+from app.services.marzban_ops import _minimal_payload, post_user_with_inbounds
+
+
+def _pct(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def _run(args: argparse.Namespace) -> None:
+    fake = None
+    if args.real:
+        client = MarzbanClient(settings.marzban_base_url, settings.marzban_admin_username, settings.marzban_admin_password)
+    else:
+        settings.marzban_share_token = False
+        fake = FakeMarzban(latency=(args.latency * 0.5, args.latency * 1.5), error_rate=args.error_rate, seed=1)
+        if args.inject_401:
+            fake.inject_401(args.inject_401)
+        if args.inject_429:
+            fake.inject_429(args.inject_429)
+        client = MarzbanClient("http://marzban.bench", fake.admin_username, fake.admin_password, transport=fake.transport())
+
+    latencies: Dict[str, List[float]] = {"create": [], "get": [], "update": []}
+    errors = 0
+    sem = asyncio.Semaphore(args.concurrency)
+    created: List[str] = []
+
+    async def timed(op: str, coro):
+        started = time.perf_counter()
+        result = await coro
+        latencies[op].append(time.perf_counter() - started)
+        return result
+
+    async def scenario(i: int) -> None:
+        nonlocal errors
+        username = f"{args.prefix}{i}"
+        async with sem:
+            try:
+                # Recorded before the call: a timed-out create may still have succeeded on the panel
+                created.append(username)
+                resp = await timed("create", post_user_with_inbounds(client, _minimal_payload(username, note="bench")))
+                if resp.status_code == 409:
+                    # Someone else's user: never delete it
+                    created.remove(username)
+                    raise RuntimeError(f"{username} already exists; pick another --prefix")
+                await timed("get", client.get_user(username))
+                await timed("update", client.update_user(username, {"data_limit": 10 * 1024**3}))
+                await timed("get", client.get_user(username))
+            except Exception:
+                errors += 1
+
+    async def cleanup() -> int:
+        async def _delete(username: str) -> bool:
+            async with sem:
+                try:
+                    await client._request("DELETE", f"/api/user/{username}", allowed_statuses={404})
+                    return True
+                except Exception:
+                    return False
+
+        results = await asyncio.gather(*[_delete(u) for u in created])
+        return sum(1 for ok in results if not ok)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*[scenario(i) for i in range(args.users)])
+    finally:
+        elapsed = time.perf_counter() - started
+        left = await cleanup()
+        if left:
+            print(f"  WARNING: {left} {args.prefix}* users could not be deleted; remove them by hand")
+
+    total_ops = sum(len(v) for v in latencies.values())
+    print(f"users={args.users} concurrency={args.concurrency} elapsed={elapsed:.2f}s ops={total_ops} ops/s={total_ops / elapsed:.1f} errors={errors}")
+    for op, vals in latencies.items():
+        if vals:
+            print(
+                f"  {op:<7} n={len(vals):<6} mean={statistics.mean(vals) * 1000:.1f}ms "
+                f"p50={_pct(vals, 0.50) * 1000:.1f}ms p95={_pct(vals, 0.95) * 1000:.1f}ms p99={_pct(vals, 0.99) * 1000:.1f}ms"
+            )
+    print(f"  overload={client.overload_stats()} coalesced={client.coalescing_stats()}")
+    if fake is not None:
+        print(f"  server calls={dict(fake.calls)} logins={fake.logins}")
+    await client.aclose_hard()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.02, help="fake panel mean latency (seconds)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fake panel random 503 ratio")
+    parser.add_argument("--inject-401", type=int, default=0)
+    parser.add_argument("--inject-429", type=int, default=0)
+    parser.add_argument("--prefix", default="bench_")
+    parser.add_argument("--real", action="store_true", help="target MARZBAN_BASE_URL instead of the fake panel (bench users are deleted afterwards)")
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
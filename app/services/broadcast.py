@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from sqlalchemy import func, or_, select, update
+
+from app.config import settings
+from app.db.models import Broadcast, Setting, User
+from app.db.session import session_scope
+from app.utils.rate import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# draft → pending (confirmed) → running ⇄ paused → done | cancelled
+OPEN_STATUSES = ("pending", "running")
+_STATUS_LABELS = {
+    "draft": "📝 پیش‌نویس",
+    "pending": "⏳ در صف",
+    "running": "📤 در حال ارسال",
+    "paused": "⏸ متوقف",
+    "cancelled": "✖️ لغو شده",
+    "done": "✅ پایان یافته",
+}
+
+# Shared by every broadcast in this process; claims keep one running broadcast across replicas.
+# It only caps the broadcast's part of the bulk lane: every send (and progress edit) still goes
+# through the outbound queue, whose bucket holds this process to its share of OUTBOUND_RATE.
+# Each user gets one message per broadcast, which keeps the per-chat limit by construction.
+_bucket: Optional[TokenBucket] = None
+
+
+def _get_bucket() -> TokenBucket:
+    global _bucket
+    if _bucket is None:
+        _bucket = TokenBucket(settings.broadcast_rate, capacity=settings.broadcast_rate)
+    return _bucket
+
+
+def _worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"[:128]
+
+
+def _eligible():
+    return User.bot_blocked_at.is_(None)
+
+
+async def create_broadcast(text: str, created_by: Optional[int]) -> Broadcast:
+    """Store a draft; nothing is sent until set_broadcast_state(id, "start")."""
+    async with session_scope() as session:
+        total = int(await session.scalar(select(func.count(User.id)).where(_eligible())) or 0)
+        bc = Broadcast(text=text, status="draft", created_by=created_by, total=total)
+        session.add(bc)
+        await session.commit()
+        await session.refresh(bc)
+        return bc
+
+
+async def get_broadcast(broadcast_id: int) -> Optional[Broadcast]:
+    async with session_scope() as session:
+        return await session.get(Broadcast, broadcast_id)
+
+
+async def recent_broadcasts(limit: int = 10) -> List[Broadcast]:
+    async with session_scope() as session:
+        return list((await session.execute(select(Broadcast).order_by(Broadcast.id.desc()).limit(limit))).scalars().all())
+
+
+_TRANSITIONS: Dict[str, Tuple[Tuple[str, ...], str]] = {
+    "start": (("draft",), "pending"),
+    "pause": (("pending", "running"), "paused"),
+    "resume": (("paused",), "pending"),
+    "cancel": (("draft", "pending", "running", "paused"), "cancelled"),
+}
+
+
+async def set_broadcast_state(
+    broadcast_id: int,
+    action: str,
+    *,
+    progress_chat_id: Optional[int] = None,
+    progress_message_id: Optional[int] = None,
+) -> Optional[Broadcast]:
+    """Apply start/pause/resume/cancel; returns the updated row, or None if not allowed now.
+
+    The worker notices pause/cancel at its next page and stops; resume hands the broadcast
+    back to the queue, and it continues from its cursor.
+    """
+    allowed, target = _TRANSITIONS[action]
+    values: Dict[str, object] = {"status": target}
+    if action == "resume":
+        # Pause/cancel keep the lock so the page in flight still records its cursor and counts
+        values["locked_by"] = None
+    if target == "cancelled":
+        values["finished_at"] = datetime.utcnow()
+    if progress_chat_id is not None:
+        values.update(progress_chat_id=progress_chat_id, progress_message_id=progress_message_id)
+    async with session_scope() as session:
+        res = await session.execute(
+            update(Broadcast).where(Broadcast.id == broadcast_id, Broadcast.status.in_(allowed)).values(**values)
+        )
+        await session.commit()
+        if not res.rowcount:
+            return None
+        return await session.get(Broadcast, broadcast_id)
+
+
+async def set_progress_message(broadcast_id: int, chat_id: int, message_id: int) -> None:
+    async with session_scope() as session:
+        await session.execute(
+            update(Broadcast).where(Broadcast.id == broadcast_id).values(progress_chat_id=chat_id, progress_message_id=message_id)
+        )
+        await session.commit()
+
+
+def render_progress(bc: Broadcast) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Progress text and control buttons (shared by the admin handler and the worker)."""
+    handled = int(bc.sent or 0) + int(bc.failed or 0) + int(bc.blocked or 0)
+    pct = min(100, handled * 100 // bc.total) if bc.total else 100
+    preview = bc.text if len(bc.text) <= 300 else bc.text[:300] + "…"
+    text = (
+        f"📣 پیام همگانی #{bc.id} — {_STATUS_LABELS.get(bc.status, bc.status)}\n"
+        f"پیشرفت: {handled}/{bc.total} ({pct}%)\n"
+        f"✅ ارسال: {bc.sent} | ❌ خطا: {bc.failed} | 🚫 مسدود: {bc.blocked}\n\n{preview}"
+    )
+    buttons: List[InlineKeyboardButton] = []
+    if bc.status == "draft":
+        buttons.append(InlineKeyboardButton(text="🚀 شروع ارسال", callback_data=f"bcast:start:{bc.id}"))
+    if bc.status in OPEN_STATUSES:
+        buttons.append(InlineKeyboardButton(text="⏸ توقف", callback_data=f"bcast:pause:{bc.id}"))
+    if bc.status == "paused":
+        buttons.append(InlineKeyboardButton(text="▶️ ادامه", callback_data=f"bcast:resume:{bc.id}"))
+    if bc.status in ("draft", "pending", "running", "paused"):
+        buttons.append(InlineKeyboardButton(text="✖️ لغو", callback_data=f"bcast:cancel:{bc.id}"))
+        buttons.append(InlineKeyboardButton(text="🔄", callback_data=f"bcast:refresh:{bc.id}"))
+    return text, (InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None)
+
+
+async def _report(bc: Broadcast) -> None:
+    if not bc.progress_chat_id or not bc.progress_message_id:
+        return
+    from app.services import outbound
+    from app.services.notifications import _get_bot
+
+    bot = await _get_bot()
+    if bot is None:
+        return
+    text, markup = render_progress(bc)
+    # Edits count against the same outbound budget as the sends; failures ("message is not
+    # modified" and friends) are fine, progress is best effort
+    await outbound.send(
+        int(bc.progress_chat_id), "edit_message_text", lane=outbound.LANE_ADMIN, bot=bot,
+        message_id=int(bc.progress_message_id), text=text, reply_markup=markup,
+    )
+
+
+async def _claim(worker: str) -> Optional[int]:
+    """Take the oldest open broadcast unless another replica is actively sending one."""
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=settings.broadcast_lease_seconds)
+    free = or_(Broadcast.locked_by.is_(None), Broadcast.locked_by == worker, Broadcast.heartbeat_at < stale)
+    async with session_scope() as session:
+        busy = await session.scalar(
+            select(Broadcast.id).where(
+                Broadcast.status == "running", Broadcast.heartbeat_at >= stale, Broadcast.locked_by != worker
+            ).limit(1)
+        )
+        if busy:
+            return None
+        candidate = await session.scalar(
+            select(Broadcast.id).where(Broadcast.status.in_(OPEN_STATUSES), free).order_by(Broadcast.id).limit(1)
+        )
+        if candidate is None:
+            return None
+        res = await session.execute(
+            update(Broadcast)
+            .where(Broadcast.id == candidate, Broadcast.status.in_(OPEN_STATUSES), free)
+            .values(status="running", locked_by=worker, heartbeat_at=now, started_at=func.coalesce(Broadcast.started_at, now))
+        )
+        await session.commit()
+        return int(candidate) if res.rowcount else None
+
+
+async def _send_one(bot, chat_id: int, text: str) -> str:
+    """Deliver one message: "sent", "blocked" or "failed".
+
+    The broadcast bucket caps this broadcast's share; the outbound queue's bulk lane does the
+    actual send, so flood waits and retries are shared with every other sender in the process.
+    """
+    from app.services import outbound
+
+    await _get_bucket().acquire()
+    return await outbound.send(
+        chat_id, lane=outbound.LANE_BULK, bot=bot, coalesce=False, text=text, disable_web_page_preview=True
+    )
+
+
+async def _banned_ids(session, telegram_ids: List[int]) -> set:
+    keys = [f"USER:{tid}:BANNED" for tid in telegram_ids]
+    rows = (await session.execute(select(Setting.key, Setting.value).where(Setting.key.in_(keys)))).all()
+    return {int(k.split(":")[1]) for k, v in rows if str(v).strip().lower() in {"1", "true"}}
+
+
+async def _run(broadcast_id: int, worker: str) -> None:
+    """Send page by page from the cursor; each page's results and cursor land in one commit."""
+    from app.services.notifications import _get_bot
+
+    bot = await _get_bot()
+    if bot is None:
+        return
+    page_size = max(1, settings.broadcast_page_size)
+    sem = asyncio.Semaphore(max(1, settings.broadcast_concurrency))
+    last_report = 0.0
+
+    async def _guarded(chat_id: int, text: str) -> str:
+        async with sem:
+            return await _send_one(bot, chat_id, text)
+
+    while True:
+        # Progress edits are Telegram round trips (and may hit a flood wait): they run after the
+        # session is closed so a slow edit never holds a DB connection
+        async with session_scope() as session:
+            bc = await session.get(Broadcast, broadcast_id)
+            stopped = bc is None or bc.status != "running" or bc.locked_by != worker
+            rows = []
+            if not stopped:
+                rows = (
+                    await session.execute(
+                        select(User.id, User.telegram_id)
+                        .where(User.id > bc.cursor_user_id, _eligible())
+                        .order_by(User.id)
+                        .limit(page_size)
+                    )
+                ).all()
+            if not stopped and not rows:
+                # Users who joined or blocked the bot mid-run make `total` drift; the final count is
+                # what was actually handled, so a finished broadcast always shows 100%
+                await session.execute(
+                    update(Broadcast).where(Broadcast.id == broadcast_id)
+                    .values(
+                        status="done",
+                        finished_at=datetime.utcnow(),
+                        locked_by=None,
+                        total=Broadcast.sent + Broadcast.failed + Broadcast.blocked,
+                    )
+                )
+                await session.commit()
+                await session.refresh(bc)
+            elif rows:
+                banned = await _banned_ids(session, [int(r[1]) for r in rows])
+                text = bc.text
+        if stopped:
+            # Paused/cancelled by an admin (or taken over after a stall)
+            if bc is not None:
+                await _report(bc)
+            return
+        if not rows:
+            await _report(bc)
+            logger.info("broadcast done", extra={"extra": {"id": bc.id, "sent": bc.sent, "failed": bc.failed, "blocked": bc.blocked}})
+            return
+        targets = [(int(uid), int(tid)) for uid, tid in rows if int(tid) not in banned]
+        outcomes = await asyncio.gather(*[_guarded(tid, text) for _, tid in targets])
+        blocked_ids = [uid for (uid, _), o in zip(targets, outcomes) if o == "blocked"]
+        now = datetime.utcnow()
+        report: Optional[Broadcast] = None
+        async with session_scope() as session:
+            if blocked_ids:
+                await session.execute(update(User).where(User.id.in_(blocked_ids)).values(bot_blocked_at=now))
+            await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id, Broadcast.locked_by == worker)
+                .values(
+                    cursor_user_id=int(rows[-1][0]),
+                    sent=Broadcast.sent + sum(1 for o in outcomes if o == "sent"),
+                    failed=Broadcast.failed + sum(1 for o in outcomes if o == "failed"),
+                    # Users banned in the bot are part of `total` but never messaged: count them as
+                    # blocked so the progress still adds up to the total
+                    blocked=Broadcast.blocked + len(blocked_ids) + (len(rows) - len(targets)),
+                    heartbeat_at=now,
+                )
+            )
+            await session.commit()
+            if time.monotonic() - last_report >= settings.broadcast_progress_interval:
+                last_report = time.monotonic()
+                report = await session.get(Broadcast, broadcast_id)
+        if report is not None:
+            await _report(report)
+
+
+async def run_broadcasts() -> None:
+    """Worker loop: pick up confirmed broadcasts and send them (resumes after restarts)."""
+    worker = _worker_id()
+    while True:
+        try:
+            broadcast_id = await _claim(worker)
+            if broadcast_id is not None:
+                logger.info("broadcast started", extra={"extra": {"id": broadcast_id, "worker": worker}})
+                await _run(broadcast_id, worker)
+                continue
+        except Exception:
+            logger.exception("broadcast loop error")
+        await asyncio.sleep(settings.broadcast_poll_interval)
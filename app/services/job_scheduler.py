@@ -0,0 +1,516 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
+
+from sqlalchemy import delete, or_, select, true, update
+from sqlalchemy.exc import IntegrityError
+
+from app.config import settings
+from app.db.models import JobLease, JobRun, WorkerHeartbeat
+from app.db.session import session_scope
+from app.marzban.limiter import PRIORITY_BACKGROUND, request_priority
+
+logger = logging.getLogger(__name__)
+
+
+class IntervalSchedule:
+    """Fire every `seconds`, aligned to the epoch so every replica computes the same slots."""
+
+    def __init__(self, seconds: float) -> None:
+        self.seconds = max(1.0, float(seconds))
+
+    def next_after(self, ts: float) -> float:
+        return (int(ts // self.seconds) + 1) * self.seconds
+
+    def __repr__(self) -> str:
+        return f"every {int(self.seconds)}s"
+
+
+class CronSchedule:
+    """Five-field cron expression (minute hour day-of-month month day-of-week), evaluated in UTC.
+
+    Fields accept *, n, a-b, */s, a-b/s and comma lists; day-of-week is 0-6 (0 or 7 = Sunday).
+    As in cron, when both day fields are restricted a day matching either one fires.
+    """
+
+    _RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expr: str) -> None:
+        parts = expr.split()
+        if len(parts) != 5:
+            raise ValueError(f"cron expression needs 5 fields: {expr!r}")
+        self.expr = expr
+        fields = [self._parse(p, lo, hi) for p, (lo, hi) in zip(parts, self._RANGES)]
+        self.minutes, self.hours, self.days, self.months, dows = fields
+        self.dows = {d % 7 for d in dows}
+        self.dom_any = parts[2] == "*"
+        self.dow_any = parts[4] == "*"
+
+    @staticmethod
+    def _parse(part: str, lo: int, hi: int) -> Set[int]:
+        values: Set[int] = set()
+        for item in part.split(","):
+            rng, _, step_raw = item.partition("/")
+            step = int(step_raw) if step_raw else 1
+            if rng == "*":
+                start, end = lo, hi
+            elif "-" in rng:
+                a, b = rng.split("-", 1)
+                start, end = int(a), int(b)
+            else:
+                start = int(rng)
+                end = hi if step_raw else start
+            if start < lo or end > hi or start > end or step < 1:
+                raise ValueError(f"invalid cron field {part!r}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, d: datetime) -> bool:
+        dom = d.day in self.days
+        dow = ((d.weekday() + 1) % 7) in self.dows
+        if self.dom_any or self.dow_any:
+            return dom and dow
+        return dom or dow
+
+    def next_after(self, ts: float) -> float:
+        d = datetime.fromtimestamp(ts, tz=timezone.utc).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = d + timedelta(days=366 * 5)
+        while d < limit:
+            if d.month not in self.months or not self._day_matches(d):
+                d = (d + timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if d.hour not in self.hours:
+                d = (d + timedelta(hours=1)).replace(minute=0)
+                continue
+            if d.minute not in self.minutes:
+                d += timedelta(minutes=1)
+                continue
+            return d.timestamp()
+        raise ValueError(f"cron expression never fires: {self.expr!r}")
+
+    def __repr__(self) -> str:
+        return f"cron {self.expr}"
+
+
+Schedule = Union[IntervalSchedule, CronSchedule]
+
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_schedule(expr: Union[str, int, float]) -> Schedule:
+    """"every 15m" / "every 6h" / "3600" (seconds) → interval; five fields → cron."""
+    if isinstance(expr, (int, float)):
+        return IntervalSchedule(expr)
+    text = expr.strip().lower()
+    if text.startswith("every "):
+        text = text[6:].strip()
+    if text and len(text.split()) == 1:
+        unit = text[-1]
+        if unit in _UNITS:
+            return IntervalSchedule(float(text[:-1]) * _UNITS[unit])
+        return IntervalSchedule(float(text))
+    return CronSchedule(expr.strip())
+
+
+def _schedule_overrides() -> Dict[str, str]:
+    """JOB_SCHEDULES="notify_usage=*/30 * * * *;sync_plans=every 6h" overrides defaults per job."""
+    out: Dict[str, str] = {}
+    for item in settings.job_schedules.split(";"):
+        name, sep, expr = item.partition("=")
+        if sep and name.strip() and expr.strip():
+            out[name.strip()] = expr.strip()
+    return out
+
+
+@dataclass(frozen=True)
+class Shard:
+    """This replica's slice of the users of a per-user job: rows with user_id % count == index."""
+
+    index: int = 0
+    count: int = 1
+
+    def clause(self, column):
+        """WHERE clause selecting this shard's rows of an integer user id column."""
+        if self.count <= 1:
+            return true()
+        return column % self.count == self.index
+
+
+ALL_USERS = Shard()
+
+
+def _run_counts(result: Any) -> Tuple[Optional[int], int]:
+    """(items, errors) from a job's return value: {"items": n, "errors": m}, an int, or None."""
+    if isinstance(result, dict):
+        items = result.get("items")
+        return (int(items) if items is not None else None, int(result.get("errors") or 0))
+    if isinstance(result, int) and not isinstance(result, bool):
+        return result, 0
+    return None, 0
+
+
+@dataclass
+class Job:
+    name: str
+    func: Callable[[], Awaitable[object]]
+    schedule: Schedule
+    # Random delay (seconds) added to every fire so jobs sharing a slot don't start together
+    jitter: float = 0.0
+    # Leased jobs run on exactly one replica per slot; per-process jobs (cache warmers) on every replica
+    leased: bool = True
+    # Sharded jobs take shard=Shard(...) and run on every live replica, one lease per shard index
+    sharded: bool = False
+    run_at_start: bool = False
+    running: bool = field(default=False, init=False)
+    skipped: int = field(default=0, init=False)
+
+
+class JobScheduler:
+    """Runs jobs on interval/cron schedules with jitter, skip-if-running and a DB lease per job.
+
+    Every replica computes the same slot timestamps. For leased jobs a replica claims a slot by
+    moving job_leases.last_slot forward while no other replica holds a live lease, so each slot
+    runs once; the holder renews the lease while running. If it dies, the lease expires after
+    JOB_LEASE_TTL and the next slot is picked up by any surviving replica.
+
+    Replicas heartbeat into worker_heartbeats; sharded jobs split users by user_id % N where N is
+    the number of live replicas (or JOB_SHARD_COUNT/JOB_SHARD_INDEX when pinned), so shards
+    rebalance as replicas come and go.
+    """
+
+    def __init__(self, owner: Optional[str] = None, lease_ttl: Optional[float] = None) -> None:
+        self.owner = (owner or f"{socket.gethostname()}:{os.getpid()}")[:128]
+        self.lease_ttl = float(lease_ttl or settings.job_lease_ttl)
+        self.jobs: Dict[str, Job] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._fires: Set[asyncio.Task] = set()
+        self.shard = ALL_USERS
+        # Called with the new shard whenever the set of live replicas changes
+        self.on_shard_change: Optional[Callable[[Shard], None]] = None
+
+    def add(
+        self,
+        name: str,
+        func: Callable[[], Awaitable[object]],
+        schedule: Union[str, int, float],
+        *,
+        jitter: Optional[float] = None,
+        leased: bool = True,
+        sharded: bool = False,
+        run_at_start: bool = False,
+    ) -> Job:
+        expr = _schedule_overrides().get(name, schedule)
+        job = Job(
+            name=name,
+            func=func,
+            schedule=parse_schedule(expr),
+            jitter=settings.job_jitter if jitter is None else float(jitter),
+            leased=leased or sharded,
+            sharded=sharded,
+            run_at_start=run_at_start,
+        )
+        self.jobs[name] = job
+        return job
+
+    @staticmethod
+    def _lease_name(job: Job, shard: Shard) -> str:
+        return f"{job.name}#{shard.index}" if job.sharded else job.name
+
+    async def _acquire(self, name: str, slot: int) -> bool:
+        now = datetime.utcnow()
+        until = now + timedelta(seconds=self.lease_ttl)
+        async with session_scope() as session:
+            res = await session.execute(
+                update(JobLease)
+                .where(
+                    JobLease.name == name,
+                    or_(JobLease.last_slot.is_(None), JobLease.last_slot < slot),
+                    or_(JobLease.lease_until.is_(None), JobLease.lease_until < now, JobLease.owner == self.owner),
+                )
+                .values(owner=self.owner, lease_until=until, last_slot=slot)
+            )
+            if res.rowcount:
+                await session.commit()
+                return True
+            exists = await session.scalar(select(JobLease.name).where(JobLease.name == name))
+            if exists:
+                return False
+            session.add(JobLease(name=name, owner=self.owner, lease_until=until, last_slot=slot))
+            try:
+                await session.commit()
+                return True
+            except IntegrityError:
+                # Another replica created the row for this slot first
+                await session.rollback()
+                return False
+
+    async def _renew(self, name: str) -> bool:
+        async with session_scope() as session:
+            res = await session.execute(
+                update(JobLease)
+                .where(JobLease.name == name, JobLease.owner == self.owner)
+                .values(lease_until=datetime.utcnow() + timedelta(seconds=self.lease_ttl))
+            )
+            await session.commit()
+            return bool(res.rowcount)
+
+    async def _release(self, name: str) -> None:
+        try:
+            async with session_scope() as session:
+                await session.execute(
+                    update(JobLease)
+                    .where(JobLease.name == name, JobLease.owner == self.owner)
+                    .values(lease_until=datetime.utcnow())
+                )
+                await session.commit()
+        except Exception:
+            logger.warning("job lease release failed", extra={"extra": {"job": name}}, exc_info=True)
+
+    async def _keep_lease(self, name: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                if not await self._renew(name):
+                    logger.warning("job lease lost while running", extra={"extra": {"job": name}})
+            except Exception:
+                logger.warning("job lease renew failed", extra={"extra": {"job": name}}, exc_info=True)
+
+    async def _beat(self) -> None:
+        """Refresh this replica's heartbeat and recompute its shard from the live replicas."""
+        now = datetime.utcnow()
+        async with session_scope() as session:
+            res = await session.execute(
+                update(WorkerHeartbeat).where(WorkerHeartbeat.worker_id == self.owner).values(beat_at=now)
+            )
+            if not res.rowcount:
+                session.add(WorkerHeartbeat(worker_id=self.owner, beat_at=now, started_at=now))
+            # Rows of replicas gone for a long time are only noise
+            await session.execute(
+                delete(WorkerHeartbeat).where(WorkerHeartbeat.beat_at < now - timedelta(seconds=self._live_window() * 20))
+            )
+            await session.commit()
+            live = (
+                await session.execute(
+                    select(WorkerHeartbeat.worker_id)
+                    .where(WorkerHeartbeat.beat_at >= now - timedelta(seconds=self._live_window()))
+                    .order_by(WorkerHeartbeat.worker_id)
+                )
+            ).scalars().all()
+        if settings.job_shard_count > 0:
+            shard = Shard(settings.job_shard_index % settings.job_shard_count, settings.job_shard_count)
+        else:
+            members = list(live) if self.owner in live else sorted([*live, self.owner])
+            shard = Shard(members.index(self.owner), len(members))
+        if shard != self.shard:
+            logger.info("worker shard changed", extra={"extra": {"owner": self.owner, "index": shard.index, "count": shard.count}})
+            self.shard = shard
+            if self.on_shard_change is not None:
+                self.on_shard_change(shard)
+
+    @staticmethod
+    def _live_window() -> float:
+        return max(1.0, settings.job_heartbeat_interval) * 3
+
+    async def _heartbeat_loop(self) -> None:
+        while True:
+            await asyncio.sleep(max(1.0, settings.job_heartbeat_interval))
+            try:
+                await self._beat()
+            except Exception:
+                logger.warning("worker heartbeat failed", extra={"extra": {"owner": self.owner}}, exc_info=True)
+
+    async def _record_run(
+        self,
+        job: Job,
+        shard: Shard,
+        slot: int,
+        started_at: datetime,
+        seconds: float,
+        outcome: str,
+        counts: Tuple[Optional[int], int] = (None, 0),
+        error: Optional[str] = None,
+    ) -> None:
+        """Append the run to job_runs; history is best effort and never fails the job."""
+        try:
+            async with session_scope() as session:
+                session.add(JobRun(
+                    job=job.name,
+                    shard=f"{shard.index}/{shard.count}" if job.sharded else None,
+                    owner=self.owner,
+                    scheduled_at=datetime.utcfromtimestamp(slot),
+                    started_at=started_at,
+                    finished_at=started_at + timedelta(seconds=seconds),
+                    duration_ms=int(seconds * 1000),
+                    interval_s=int(job.schedule.next_after(slot) - slot),
+                    items=counts[0],
+                    errors=counts[1],
+                    outcome=outcome,
+                    error=error[:2000] if error else None,
+                ))
+                await session.commit()
+        except Exception:
+            logger.warning("job run record failed", extra={"extra": {"job": job.name}}, exc_info=True)
+
+    async def run_job(self, job: Job, slot: int, shard: Shard = ALL_USERS) -> None:
+        """Run one slot of a job (lease already held for leased jobs) and record it in job_runs."""
+        lease = self._lease_name(job, shard)
+        job.running = True
+        renewer = asyncio.create_task(self._keep_lease(lease)) if job.leased else None
+        started_at = datetime.utcnow()
+        started = time.monotonic()
+        try:
+            # Scheduler traffic yields to interactive bot requests at the Marzban limiter
+            with request_priority(PRIORITY_BACKGROUND):
+                if job.sharded:
+                    result = await job.func(shard=shard)
+                else:
+                    result = await job.func()
+            counts = _run_counts(result)
+            outcome = "partial" if counts[1] else "ok"
+            await self._record_run(job, shard, slot, started_at, time.monotonic() - started, outcome, counts)
+        except Exception as e:
+            logger.exception("periodic job error: %s", e, extra={"extra": {"job": job.name}})
+            await self._record_run(
+                job, shard, slot, started_at, time.monotonic() - started, "error", error=f"{e.__class__.__name__}: {e}"
+            )
+        finally:
+            job.running = False
+            if renewer is not None:
+                renewer.cancel()
+                await self._release(lease)
+
+    async def _fire(self, job: Job, slot: int) -> None:
+        if job.running:
+            job.skipped += 1
+            logger.warning("job still running; slot skipped", extra={"extra": {"job": job.name, "slot": slot}})
+            shard = self.shard if job.sharded else ALL_USERS
+            await self._record_run(job, shard, slot, datetime.utcnow(), 0.0, "skipped")
+            return
+        shard = self.shard if job.sharded else ALL_USERS
+        if job.leased:
+            try:
+                if not await self._acquire(self._lease_name(job, shard), slot):
+                    return
+            except Exception:
+                logger.warning("job lease acquire failed", extra={"extra": {"job": job.name}}, exc_info=True)
+                return
+        await self.run_job(job, slot, shard)
+
+    async def _loop(self, job: Job) -> None:
+        if job.run_at_start:
+            await self._fire(job, int(time.time()))
+        while True:
+            slot = job.schedule.next_after(time.time())
+            delay = slot - time.time() + (random.uniform(0, job.jitter) if job.jitter > 0 else 0.0)
+            await asyncio.sleep(max(0.0, delay))
+            # Runs as its own task so a long run doesn't delay the next slot computation
+            task = asyncio.create_task(self._fire(job, int(slot)))
+            self._fires.add(task)
+            task.add_done_callback(self._fires.discard)
+
+    async def start(self) -> None:
+        try:
+            await self._beat()
+        except Exception:
+            logger.warning("worker heartbeat failed", extra={"extra": {"owner": self.owner}}, exc_info=True)
+        self._tasks.append(asyncio.create_task(self._heartbeat_loop()))
+        for job in self.jobs.values():
+            self._tasks.append(asyncio.create_task(self._loop(job)))
+        logger.info(
+            "job scheduler started",
+            extra={"extra": {"owner": self.owner, "shard": f"{self.shard.index}/{self.shard.count}", "jobs": {j.name: repr(j.schedule) for j in self.jobs.values()}}},
+        )
+
+    async def stop(self) -> None:
+        for task in [*self._tasks, *self._fires]:
+            task.cancel()
+        self._tasks.clear()
+        # Leave the shard ring right away instead of waiting for the heartbeat to go stale
+        try:
+            async with session_scope() as session:
+                await session.execute(delete(WorkerHeartbeat).where(WorkerHeartbeat.worker_id == self.owner))
+                await session.commit()
+        except Exception:
+            logger.warning("worker heartbeat removal failed", extra={"extra": {"owner": self.owner}}, exc_info=True)
+
+
+async def prune_job_runs() -> Dict[str, int]:
+    """Drop job_runs older than JOB_RUNS_RETENTION_DAYS in bounded chunks."""
+    cutoff = datetime.utcnow() - timedelta(days=max(1, settings.job_runs_retention_days))
+    deleted = 0
+    while True:
+        async with session_scope() as session:
+            ids = (
+                await session.execute(select(JobRun.id).where(JobRun.started_at < cutoff).limit(5000))
+            ).scalars().all()
+            if not ids:
+                break
+            await session.execute(delete(JobRun).where(JobRun.id.in_(ids)))
+            await session.commit()
+            deleted += len(ids)
+            if len(ids) < 5000:
+                break
+    return {"items": deleted}
+
+
+@dataclass
+class JobStats:
+    job: str
+    runs: int = 0
+    failed: int = 0
+    skipped: int = 0
+    items: int = 0
+    avg_duration: float = 0.0  # seconds
+    max_duration: float = 0.0
+    avg_lag: float = 0.0  # seconds between the scheduled slot and the actual start
+    interval: int = 0  # seconds
+    last_started: Optional[datetime] = None
+    last_outcome: Optional[str] = None
+
+
+async def job_run_stats(hours: int = 24) -> List[JobStats]:
+    """Per-job summary of the runs started in the last `hours` (skipped slots counted apart)."""
+    since = datetime.utcnow() - timedelta(hours=hours)
+    async with session_scope() as session:
+        rows = (
+            await session.execute(
+                select(JobRun).where(JobRun.started_at >= since).order_by(JobRun.started_at)
+            )
+        ).scalars().all()
+    by_job: Dict[str, List[JobRun]] = {}
+    for r in rows:
+        by_job.setdefault(r.job, []).append(r)
+    out: List[JobStats] = []
+    for name, runs in sorted(by_job.items()):
+        done = [r for r in runs if r.outcome != "skipped"]
+        st = JobStats(job=name, runs=len(done), skipped=len(runs) - len(done))
+        st.failed = sum(1 for r in done if r.outcome == "error")
+        st.items = sum(int(r.items or 0) for r in done)
+        if done:
+            st.avg_duration = sum(r.duration_ms for r in done) / len(done) / 1000
+            st.max_duration = max(r.duration_ms for r in done) / 1000
+            st.avg_lag = sum(max(0.0, (r.started_at - r.scheduled_at).total_seconds()) for r in done) / len(done)
+        st.interval = int(runs[-1].interval_s or 0)
+        st.last_started = runs[-1].started_at
+        st.last_outcome = runs[-1].outcome
+        out.append(st)
+    return out
+
+
+async def recent_job_runs(job: str, limit: int = 15) -> List[JobRun]:
+    async with session_scope() as session:
+        return list(
+            (
+                await session.execute(
+                    select(JobRun).where(JobRun.job == job).order_by(JobRun.started_at.desc()).limit(limit)
+                )
+            ).scalars().all()
+        )
@@ -1,112 +1,507 @@
 from __future__ import annotations
 
+import asyncio
 import logging
+import random
+import time
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, List
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional
 
 import httpx
 
-from app.marzban.client import get_client
+from sqlalchemy import func, select, update
+
+from app.marzban.client import get_all_clients, get_client
+from app.marzban.registry import DEFAULT_PANEL, choose_panel, default_panel, get_panels, is_multi_panel
+from app.db.session import session_scope
+from app.db.models import User, UserService
+from app.marzban.limiter import PRIORITY_BACKGROUND, request_priority
 from app.db.models import Plan
+from app.config import settings
+from app.utils.ttl_cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# Read-through cache of user snapshots keyed by username.
+# Mutating ops below refresh (or drop) the entry so readers never see pre-mutation state.
+_SNAPSHOT_CACHE: TTLCache[str, Dict[str, Any]] = TTLCache(
+    maxsize=settings.marzban_cache_size,
+    ttl=settings.marzban_cache_ttl,
+    stale_ttl=settings.marzban_cache_stale_ttl,
+)
+_REVALIDATING: Dict[str, asyncio.Task] = {}
+# username -> monotonic deadline; until then fetched snapshots are returned but not cached
+_CACHE_HOLD: Dict[str, float] = {}
+
+
+def _cache_put(username: str, snapshot: Any) -> None:
+    if not (isinstance(snapshot, dict) and username):
+        return
+    hold = _CACHE_HOLD.get(username)
+    if hold is not None:
+        if hold > time.monotonic():
+            return
+        _CACHE_HOLD.pop(username, None)
+    _SNAPSHOT_CACHE.set(username, snapshot)
+
+
+def invalidate_user(username: str, *, hold: float = 0.0) -> None:
+    """Drop the cached snapshot for username (call after out-of-band panel changes).
+
+    hold > 0 also keeps username out of the cache for that many seconds, for changes another
+    process applies later (outbox): a snapshot read in between would still show the old state.
+    """
+    _SNAPSHOT_CACHE.pop(username)
+    if hold > 0:
+        now = time.monotonic()
+        if len(_CACHE_HOLD) >= settings.marzban_cache_size:
+            for name in [n for n, until in _CACHE_HOLD.items() if until <= now]:
+                del _CACHE_HOLD[name]
+        _CACHE_HOLD[username] = now + hold
+
+
+def snapshot_cache_stats() -> Dict[str, int]:
+    """Hit/miss counters for the user snapshot cache."""
+    stats = _SNAPSHOT_CACHE.stats()
+    stats["revalidating"] = len(_REVALIDATING)
+    return stats
+
 
-async def _get_vless_inbound_tags(client) -> List[str]:
+# username -> panel name. Filled from user_services.panel, or by placement for a brand-new
+# username so every call of a provisioning flow lands on the same panel before the row exists.
+_PANEL_OF: TTLCache[str, str] = TTLCache(maxsize=settings.marzban_cache_size * 4, ttl=600.0)
+_PLACEMENT_LOCK = asyncio.Lock()
+
+
+async def _lookup_panel(username: str) -> Optional[str]:
+    try:
+        async with session_scope() as session:
+            return await session.scalar(select(UserService.panel).where(UserService.username == username))
+    except Exception as e:
+        logger.warning("panel lookup failed; using default", extra={"extra": {"username": username, "err": str(e)}})
+        return None
+
+
+async def _place_new_service() -> str:
+    counts: Dict[str, int] = {}
+    if settings.marzban_placement != "weighted":
+        async with session_scope() as session:
+            rows = await session.execute(
+                select(UserService.panel, func.count(UserService.id))
+                .where(UserService.status != "deleted")
+                .group_by(UserService.panel)
+            )
+            counts = {str(p): int(n) for p, n in rows.all()}
+    return choose_panel(counts)
+
+
+async def panel_for(username: str, *, for_create: bool = False) -> str:
+    """Resolve the panel hosting username.
+
+    Known services use user_services.panel; unknown usernames live on the default panel,
+    unless for_create=True, in which case the placement policy picks a panel.
+    """
+    if not is_multi_panel():
+        return default_panel()
+    cached = _PANEL_OF.get(username)
+    if cached is not None:
+        return cached
+    panel = await _lookup_panel(username)
+    if panel is None and for_create:
+        async with _PLACEMENT_LOCK:
+            panel = _PANEL_OF.get(username)
+            if panel is None:
+                try:
+                    panel = await _place_new_service()
+                except Exception as e:
+                    logger.warning("placement failed; using default", extra={"extra": {"err": str(e)}})
+                    panel = default_panel()
+                logger.info("service placed", extra={"extra": {"username": username, "panel": panel}})
+    panel = panel if panel in get_panels() else default_panel()
+    _PANEL_OF.set(username, panel)
+    return panel
+
+
+def assigned_panel(username: str) -> str:
+    """Panel chosen for username in this process (for persisting user_services.panel)."""
+    if not is_multi_panel():
+        return default_panel()
+    return _PANEL_OF.get(username) or default_panel()
+
+
+async def client_for(username: str, *, for_create: bool = False):
+    """Shared MarzbanClient of the panel hosting username."""
+    return await get_client(await panel_for(username, for_create=for_create))
+
+
+async def _fetch_user(username: str) -> Dict[str, Any]:
+    client = await client_for(username)
+    try:
+        data = await client.get_user(username)
+    finally:
+        await client.aclose()
+    _cache_put(username, data)
+    return data
+
+
+def _schedule_revalidate(username: str) -> None:
+    if username in _REVALIDATING:
+        return
+
+    async def _run() -> None:
+        try:
+            with request_priority(PRIORITY_BACKGROUND):
+                await _fetch_user(username)
+        except httpx.HTTPStatusError as e:
+            if e.response is not None and e.response.status_code == 404:
+                invalidate_user(username)
+        except Exception as e:
+            logger.debug("snapshot revalidate failed", extra={"extra": {"username": username, "err": str(e)}})
+        finally:
+            _REVALIDATING.pop(username, None)
+
+    _REVALIDATING[username] = asyncio.create_task(_run())
+
+
+def expire_at_of(snapshot: Any) -> Optional[datetime]:
+    """Naive-UTC expiry of a panel snapshot (None when unlimited), as stored in expire_at columns."""
+    try:
+        ts = int((snapshot or {}).get("expire") or 0)
+    except (AttributeError, TypeError, ValueError):
+        return None
+    return datetime.fromtimestamp(ts, tz=timezone.utc).replace(tzinfo=None) if ts > 0 else None
+
+
+_EXPIRY_SYNC_TASKS: set[asyncio.Task] = set()
+
+
+async def record_expiry(username: str, snapshot: Any) -> None:
+    """Mirror a service's panel expiry into user_services.expire_at (and users.expire_at)."""
+    expire_at = expire_at_of(snapshot)
+    try:
+        async with session_scope() as session:
+            await session.execute(update(UserService).where(UserService.username == username).values(expire_at=expire_at))
+            await session.execute(update(User).where(User.marzban_username == username).values(expire_at=expire_at))
+            await session.commit()
+    except Exception:
+        logger.warning("expiry index update failed", extra={"extra": {"username": username}}, exc_info=True)
+
+
+def schedule_expiry_sync(username: str, snapshot: Any) -> None:
+    """record_expiry() in the background: callers may hold row locks in an open transaction
+    (e.g. a purchase debiting the wallet), which an inline UPDATE would wait on."""
+    task = asyncio.create_task(record_expiry(username, snapshot))
+    _EXPIRY_SYNC_TASKS.add(task)
+    task.add_done_callback(_EXPIRY_SYNC_TASKS.discard)
+
+
+# Shared vless inbound catalog per panel: name -> (tags, fetched_at monotonic). Refreshed by the
+# scheduler and dropped when the panel rejects a create because of an unknown inbound.
+_INBOUND_TAGS: Dict[str, tuple[List[str], float]] = {}
+_INBOUND_LOCK = asyncio.Lock()
+
+
+def invalidate_inbound_tags(panel: Optional[str] = None) -> None:
+    if panel is None:
+        _INBOUND_TAGS.clear()
+    else:
+        _INBOUND_TAGS.pop(panel, None)
+
+
+async def _fetch_vless_inbound_tags(client) -> List[str]:
     try:
         resp = await client._request("GET", "/api/inbounds")
         data = resp.json()
         vless = data.get("vless", []) if isinstance(data, dict) else []
         tags = [item.get("tag") for item in vless if isinstance(item, dict) and item.get("tag")]
+        # Filter out control/info tags if present
         return [t for t in tags if t and t.lower() != "info"] or tags
     except Exception as e:
         logger.warning("failed to fetch inbounds: %s", e)
         return []
 
 
-async def create_user_minimal(username: str, note: str = "") -> Dict[str, Any]:
-    client = await get_client()
+async def get_vless_inbound_tags(client=None, *, force: bool = False) -> List[str]:
+    """Return vless inbound tags from the shared catalog, fetching /api/inbounds only when stale."""
+    if client is None:
+        client = await get_client()
+    panel = getattr(client, "panel", DEFAULT_PANEL)
+    ttl = settings.marzban_inbounds_ttl
+    cached = _INBOUND_TAGS.get(panel)
+    if not force and cached is not None and (time.monotonic() - cached[1]) <= ttl:
+        return list(cached[0])
+    async with _INBOUND_LOCK:
+        cached = _INBOUND_TAGS.get(panel)
+        if not force and cached is not None and (time.monotonic() - cached[1]) <= ttl:
+            return list(cached[0])
+        tags = await _fetch_vless_inbound_tags(client)
+        if tags:
+            # Do not cache failures/empty catalogs; next caller retries
+            _INBOUND_TAGS[panel] = (tags, time.monotonic())
+        return list(tags)
+
+
+async def refresh_all_inbound_tags() -> Dict[str, int]:
+    """Refresh every panel's catalog concurrently; returns tag counts per panel."""
+    clients = await get_all_clients()
+    results = await asyncio.gather(*[get_vless_inbound_tags(c, force=True) for c in clients.values()])
+    return {name: len(tags) for name, tags in zip(clients, results)}
+
+
+def is_unknown_inbound_error(resp: httpx.Response) -> bool:
+    """True if a create was rejected because a referenced inbound does not exist on the panel."""
+    if resp.status_code not in {400, 404, 422}:
+        return False
     try:
-        vless_tags = await _get_vless_inbound_tags(client)
-        payload: Dict[str, Any] = {
-            "username": username,
-            "status": "active",
-            "expire": 0,
+        body = resp.text.lower()
+    except Exception:
+        return False
+    return "inbound" in body
+
+
+async def post_user_with_inbounds(client, payload: Dict[str, Any]) -> httpx.Response:
+    """POST /api/user using the cached vless catalog; on an unknown-inbound rejection,
+    refresh the catalog once and retry. 409 passes through for the caller to handle.
+    """
+    payload["inbounds"] = {"vless": await get_vless_inbound_tags(client)}
+    resp = await client._request("POST", "/api/user", allowed_statuses={400, 404, 409, 422}, json=payload)
+    if is_unknown_inbound_error(resp):
+        logger.info("create rejected for unknown inbound; refreshing catalog", extra={"extra": {"username": payload.get("username")}})
+        invalidate_inbound_tags(getattr(client, "panel", None))
+        payload["inbounds"] = {"vless": await get_vless_inbound_tags(client, force=True)}
+        resp = await client._request("POST", "/api/user", allowed_statuses={400, 404, 409, 422}, json=payload)
+    if resp.status_code != 409:
+        resp.raise_for_status()
+    return resp
+
+
+def _minimal_payload(username: str, note: str = "") -> Dict[str, Any]:
+    return {
+        "username": username,
+        "status": "active",
+        "expire": 0,
+        "data_limit": 0,
+        "data_limit_reset_strategy": "no_reset",
+        "proxies": {"vless": {}},
+        "next_plan": {
+            "add_remaining_traffic": False,
             "data_limit": 0,
-            "data_limit_reset_strategy": "no_reset",
-            "inbounds": {"vless": vless_tags},
-            "proxies": {"vless": {}},
-            "next_plan": {
-                "add_remaining_traffic": False,
-                "data_limit": 0,
-                "expire": 0,
-                "fire_on_either": True,
-            },
-            "note": note,
-        }
-        try:
-            # allow 409 to pass through without raising/logging; we'll fallback to GET
-            resp = await client._request("POST", "/api/user", allowed_statuses={409}, json=payload)
-            if resp.status_code == 409:
-                resp = await client._request("GET", f"/api/user/{username}")
-            return resp.json()
-        except httpx.HTTPStatusError:
-            # other HTTP errors propagate
-            raise
+            "expire": 0,
+            "fire_on_either": True,
+        },
+        "note": note,
+    }
+
+
+async def create_user_minimal(username: str, note: str = "") -> Dict[str, Any]:
+    client = await client_for(username, for_create=True)
+    try:
+        # 409 passes through without raising/logging; we'll fallback to GET
+        resp = await post_user_with_inbounds(client, _minimal_payload(username, note))
+        if resp.status_code == 409:
+            resp = await client._request("GET", f"/api/user/{username}")
+        data = resp.json()
+        _cache_put(username, data)
+        return data
     finally:
         await client.aclose()
 
 
-async def update_user_limits(username: str, data_limit_gb: int | float, duration_days: int) -> Dict[str, Any]:
-    client = await get_client()
+# Field order for staged updates (panels that reject combined PUT payloads)
+_STAGED_ORDER = ("expire", "data_limit", "status")
+
+
+async def apply_user_patch(username: str, patch: Dict[str, Any], *, client=None) -> Dict[str, Any]:
+    """Apply a field patch with a single PUT /api/user/{username} and return the new snapshot.
+
+    The PUT response body is the updated user, so no follow-up GET is needed. With
+    MARZBAN_STAGED_UPDATES=1 the patch is split into one PUT per field (expire, data_limit,
+    status, then the rest) for panel versions that need staged updates.
+    """
+    if not patch:
+        return await get_user(username)
+    owned = client is None
+    if owned:
+        client = await client_for(username)
+    invalidate_user(username)
     try:
-        expire_ts = int((datetime.now(timezone.utc) + timedelta(days=duration_days)).timestamp()) if duration_days > 0 else 0
-        data_limit = int(float(data_limit_gb) * (1024 ** 3)) if data_limit_gb and data_limit_gb > 0 else 0
-        await client.update_user(username, {"expire": expire_ts})
-        await client.update_user(username, {"data_limit": data_limit})
-        resp = await client._request("GET", f"/api/user/{username}")
-        return resp.json()
+        if settings.marzban_staged_updates and len(patch) > 1:
+            keys = [k for k in _STAGED_ORDER if k in patch] + [k for k in patch if k not in _STAGED_ORDER]
+            data: Any = None
+            for k in keys:
+                data = await client.update_user(username, {k: patch[k]})
+        else:
+            data = await client.update_user(username, dict(patch))
+        if not (isinstance(data, dict) and data.get("username")):
+            # Unexpected body (older builds); fall back to one read
+            data = await client.get_user(username)
+        _cache_put(username, data)
+        if "expire" in patch:
+            schedule_expiry_sync(username, data)
+        return data
     finally:
-        await client.aclose()
+        if owned:
+            await client.aclose()
+
+
+async def modify_user(username: str, build_patch: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Dict[str, Any]:
+    """Read-modify-write helper: derive a patch from the current snapshot and apply it in one PUT.
+
+    The read is served from the snapshot cache when a fresh entry exists (every op here
+    refreshes it), so a warm RMW costs a single PUT.
+    """
+    current = await get_user(username)
+    return await apply_user_patch(username, build_patch(current))
+
+
+async def update_user_limits(username: str, data_limit_gb: int | float, duration_days: int) -> Dict[str, Any]:
+    expire_ts = int((datetime.now(timezone.utc) + timedelta(days=duration_days)).timestamp()) if duration_days > 0 else 0
+    data_limit = int(float(data_limit_gb) * (1024 ** 3)) if data_limit_gb and data_limit_gb > 0 else 0
+    return await apply_user_patch(username, {"expire": expire_ts, "data_limit": data_limit})
 
 
 async def delete_user(username: str) -> None:
-    client = await get_client()
+    client = await client_for(username)
     try:
         # Ignore 404 to avoid noisy logs when user was already removed
         await client._request("DELETE", f"/api/user/{username}", allowed_statuses={404})
     finally:
+        invalidate_user(username)
         await client.aclose()
 
 
 async def reset_user(username: str) -> Dict[str, Any]:
-    client = await get_client()
+    client = await client_for(username)
     try:
         resp = await client._request("POST", f"/api/user/{username}/reset")
-        return resp.json()
+        data = resp.json()
+        _cache_put(username, data)
+        return data
+    except Exception:
+        invalidate_user(username)
+        raise
     finally:
         await client.aclose()
 
 
 async def revoke_sub(username: str) -> Dict[str, Any]:
-    client = await get_client()
+    client = await client_for(username)
     try:
         resp = await client._request("POST", f"/api/user/{username}/revoke_sub")
-        return resp.json()
+        data = resp.json()
+        _cache_put(username, data)
+        return data
+    except Exception:
+        invalidate_user(username)
+        raise
     finally:
         await client.aclose()
 
 
-async def get_user(username: str) -> Dict[str, Any]:
-    client = await get_client()
+async def get_user(username: str, *, use_cache: bool = True, allow_stale: bool = False) -> Dict[str, Any]:
+    """Return the user snapshot, served from the TTL cache when possible.
+
+    allow_stale=True returns an expired-but-recent entry immediately and refreshes it in the
+    background (stale-while-revalidate); use it for views where a few seconds of lag is fine.
+    use_cache=False always hits the panel (and refreshes the cache).
+    """
+    if use_cache:
+        if allow_stale:
+            cached, is_stale = _SNAPSHOT_CACHE.get_stale(username)
+            if cached is not None:
+                if is_stale:
+                    _schedule_revalidate(username)
+                return cached
+        else:
+            cached = _SNAPSHOT_CACHE.get(username)
+            if cached is not None:
+                return cached
     try:
-        return await client.get_user(username)
-    finally:
-        await client.aclose()
+        return await _fetch_user(username)
+    except httpx.HTTPStatusError as e:
+        if e.response is not None and e.response.status_code == 404:
+            invalidate_user(username)
+        raise
+
 
+async def get_users_snapshot(usernames: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """Stream all panel users page by page and return a username -> snapshot dict.
 
-async def get_user_summary(username: str) -> Dict[str, Any]:
-    data = await get_user(username)
+    When usernames is given, only those entries are kept so memory stays proportional
+    to the local user set rather than the whole panel.
+    """
+    wanted = {u for u in usernames if u} if usernames is not None else None
+    out: Dict[str, Dict[str, Any]] = {}
+
+    async def _scan(client) -> None:
+        try:
+            async for page in client.iter_user_pages():
+                for item in page:
+                    name = item.get("username")
+                    if not name or (wanted is not None and name not in wanted):
+                        continue
+                    out[name] = item
+                if wanted is not None and len(out) >= len(wanted):
+                    break
+        finally:
+            await client.aclose()
+
+    # Panels are scanned concurrently; each contributes its own users to the shared dict
+    clients = await get_all_clients()
+    results = await asyncio.gather(*[_scan(c) for c in clients.values()], return_exceptions=True)
+    errors = [(name, r) for name, r in zip(clients, results) if isinstance(r, BaseException)]
+    for name, err in errors:
+        logger.error("bulk user scan failed", extra={"extra": {"panel": name, "err": str(err)}})
+    if errors and len(errors) == len(results):
+        raise errors[0][1]
+    return out
+
+
+async def get_users_by_name(usernames: Iterable[str], *, chunk_size: Optional[int] = None) -> Dict[str, Dict[str, Any]]:
+    """Snapshots of just these usernames: GET /api/users?username=a&username=b..., one chunk per call.
+
+    Costs ceil(len(usernames) / chunk_size) requests per panel however large the panels are, so
+    a shard of the local users is read without walking the whole panel. A panel build that
+    ignores the username filter (the page holds names that weren't asked for) falls back to
+    get_users_snapshot() for whatever is still missing.
+    """
+    names = sorted({u for u in usernames if u})
+    out: Dict[str, Dict[str, Any]] = {}
+    if not names:
+        return out
+    size = max(1, int(chunk_size or settings.marzban_page_size))
+
+    async def _lookup(client) -> bool:
+        try:
+            for i in range(0, len(names), size):
+                chunk = names[i:i + size]
+                page = await client.get_users(offset=0, limit=len(chunk), username=chunk)
+                users = [u for u in page["users"] if isinstance(u, dict)]
+                asked = set(chunk)
+                if any(u.get("username") not in asked for u in users):
+                    return False
+                for item in users:
+                    out[item["username"]] = item
+            return True
+        finally:
+            await client.aclose()
+
+    clients = await get_all_clients()
+    results = await asyncio.gather(*[_lookup(c) for c in clients.values()], return_exceptions=True)
+    errors = [(name, r) for name, r in zip(clients, results) if isinstance(r, BaseException)]
+    for name, err in errors:
+        logger.error("user lookup by name failed", extra={"extra": {"panel": name, "err": str(err)}})
+    if errors and len(errors) == len(results):
+        raise errors[0][1]
+    missing = [n for n in names if n not in out]
+    if missing and any(r is False for r in results):
+        logger.warning("panel ignores the username filter; scanning all users instead")
+        out.update(await get_users_snapshot(missing))
+    return out
+
+
+async def get_user_summary(username: str, *, allow_stale: bool = False) -> Dict[str, Any]:
+    data = await get_user(username, allow_stale=allow_stale)
     def gb(v: int | None) -> str:
         if not v or v <= 0:
             return "∞"
@@ -134,25 +529,17 @@ async def get_user_summary(username: str) -> Dict[str, Any]:
 
 
 async def set_status(username: str, status: str) -> Dict[str, Any]:
-    client = await get_client()
-    try:
-        await client.update_user(username, {"status": status})
-        return await get_user(username)
-    finally:
-        await client.aclose()
+    return await apply_user_patch(username, {"status": status})
 
 
 async def add_data_gb(username: str, delta_gb: float) -> Dict[str, Any]:
-    current = await get_user(username)
-    current_limit = int(current.get("data_limit") or 0)
     add_bytes = int(float(delta_gb) * (1024 ** 3))
-    new_limit = (current_limit if current_limit > 0 else 0) + add_bytes
-    client = await get_client()
-    try:
-        await client.update_user(username, {"data_limit": new_limit})
-        return await get_user(username)
-    finally:
-        await client.aclose()
+
+    def _patch(current: Dict[str, Any]) -> Dict[str, Any]:
+        current_limit = int(current.get("data_limit") or 0)
+        return {"data_limit": (current_limit if current_limit > 0 else 0) + add_bytes}
+
+    return await modify_user(username, _patch)
 
 
 async def replace_user_username(old_username: str, new_username: str, note: str = "") -> Dict[str, Any]:
@@ -166,6 +553,8 @@ async def replace_user_username(old_username: str, new_username: str, note: str
         raise ValueError("new_username is required")
     if old_username == new_username:
         return await create_user_minimal(new_username, note=note)
+    # Keep the renamed user on the panel that hosted the old one
+    _PANEL_OF.set(new_username, await panel_for(old_username))
     # Delete old user best-effort
     try:
         await delete_user(old_username)
@@ -177,81 +566,208 @@ async def replace_user_username(old_username: str, new_username: str, note: str
 
 async def provision_for_plan(username: str, plan: Plan) -> Dict[str, Any]:
     """Provision user for a given Plan using UI-safe flow.
-    - Ensure minimal user exists
-    - Set expire and data_limit based on plan
-    - Return current user snapshot
+    - Ensure minimal user exists (POST; 409 means it already exists)
+    - Set expire and data_limit based on plan in one PUT
+    - Return the PUT response as the current user snapshot
     """
-    await create_user_minimal(username, note=f"order: {plan.title}")
     # Plan fields are bytes and days
-    gb = (plan.data_limit_bytes or 0) / (1024 ** 3)
     days = int(plan.duration_days or 0)
-    return await update_user_limits(username, gb, days)
-
-
-async def extend_expire(username: str, delta_days: int) -> Dict[str, Any]:
-    current = await get_user(username)
-    now_ts = int(datetime.now(timezone.utc).timestamp())
-    current_exp = int(current.get("expire") or 0)
-    base = current_exp if current_exp and current_exp > 0 else now_ts
-    new_exp = base + delta_days * 86400
-    client = await get_client()
+    expire_ts = int((datetime.now(timezone.utc) + timedelta(days=days)).timestamp()) if days > 0 else 0
+    data_limit = int(plan.data_limit_bytes or 0) if (plan.data_limit_bytes or 0) > 0 else 0
+    client = await client_for(username, for_create=True)
     try:
-        await client.update_user(username, {"expire": new_exp})
-        return await get_user(username)
+        await post_user_with_inbounds(client, _minimal_payload(username, note=f"order: {plan.title}"))
+        return await apply_user_patch(username, {"expire": expire_ts, "data_limit": data_limit}, client=client)
     finally:
         await client.aclose()
 
 
-async def list_expired() -> List[Dict[str, Any]]:
-    client = await get_client()
-    try:
-        resp = await client._request("GET", "/api/users/expired")
-        data = resp.json()
-        return data if isinstance(data, list) else data.get("result", [])
-    finally:
-        await client.aclose()
+async def extend_expire(username: str, delta_days: int) -> Dict[str, Any]:
+    def _patch(current: Dict[str, Any]) -> Dict[str, Any]:
+        now_ts = int(datetime.now(timezone.utc).timestamp())
+        current_exp = int(current.get("expire") or 0)
+        base = current_exp if current_exp and current_exp > 0 else now_ts
+        return {"expire": base + delta_days * 86400}
 
+    return await modify_user(username, _patch)
 
-async def delete_expired() -> Dict[str, Any]:
-    """Delete expired users.
 
-    Behavior:
-      - Try bulk DELETE /api/users/expired
-      - If 404 (endpoint missing), fallback to GET list and DELETE each user
-      - Return a summary dict
+async def iter_expired(expired_before: Optional[datetime] = None) -> AsyncIterator[Dict[str, Any]]:
+    """Stream expired users (0 < expire <= expired_before, default now) panel by panel.
+
+    Each snapshot is tagged with its "panel"; only one page per panel is held in memory.
     """
-    client = await get_client()
+    cutoff = expired_before or datetime.now(timezone.utc)
+    clients = await get_all_clients()
+    for name, client in clients.items():
+        async for user in client.iter_users(expired_before=cutoff):
+            user.setdefault("panel", name)
+            yield user
+
+
+async def list_expired(limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Expired users across panels; pass limit to stop the scan early."""
+    rows: List[Dict[str, Any]] = []
+    async for user in iter_expired():
+        rows.append(user)
+        if limit is not None and len(rows) >= limit:
+            break
+    return rows
+
+
+ProgressCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+async def _mark_services_deleted(usernames: List[str]) -> None:
+    """Flag local UserService rows for panel-deleted usernames in one UPDATE."""
+    if not usernames:
+        return
     try:
+        async with session_scope() as session:
+            await session.execute(
+                update(UserService)
+                .where(UserService.username.in_(usernames), UserService.status != "deleted")
+                .values(status="deleted")
+            )
+            await session.commit()
+    except Exception:
+        logger.exception("marking local services deleted failed", extra={"extra": {"count": len(usernames)}})
+
+
+async def delete_users(
+    client,
+    usernames: Iterable[str],
+    *,
+    concurrency: Optional[int] = None,
+    retries: Optional[int] = None,
+    progress: Optional[ProgressCallback] = None,
+    progress_interval: float = 2.0,
+    mark_batch: int = 100,
+) -> Dict[str, Any]:
+    """Delete users on one panel with bounded parallelism.
+
+    - Up to `concurrency` DELETEs in flight; a failed user gets `retries` extra attempts with backoff
+      (on top of the client's own retry loop). 404 counts as already gone.
+    - Deleted usernames are flushed to the local user_services table every `mark_batch` users.
+    - `progress` receives {"panel", "total", "done", "deleted", "missing", "failed"} at most every
+      `progress_interval` seconds and once at the end.
+    Returns the counters plus "results": {username: "deleted" | "missing" | "error: ..."}.
+    """
+    names = list(dict.fromkeys(u for u in usernames if u))
+    limit = max(1, int(concurrency or settings.marzban_delete_concurrency))
+    extra_attempts = max(0, int(settings.marzban_delete_retries if retries is None else retries))
+    results: Dict[str, str] = {}
+    counts = {"deleted": 0, "missing": 0, "failed": 0}
+    pending_marks: List[str] = []
+    last_report = 0.0
+    queue: "asyncio.Queue[str]" = asyncio.Queue()
+    for name in names:
+        queue.put_nowait(name)
+
+    def snapshot() -> Dict[str, Any]:
+        return {"panel": getattr(client, "panel", DEFAULT_PANEL), "total": len(names), "done": len(results), **counts}
+
+    async def report(force: bool = False) -> None:
+        nonlocal last_report
+        now = time.monotonic()
+        if progress is None or (not force and now - last_report < progress_interval):
+            return
+        last_report = now
         try:
-            resp = await client._request("DELETE", "/api/users/expired")
+            await progress(snapshot())
+        except Exception:
+            logger.debug("delete progress callback failed", exc_info=True)
+
+    async def delete_one(username: str) -> str:
+        for attempt in range(extra_attempts + 1):
+            try:
+                resp = await client._request("DELETE", f"/api/user/{username}", allowed_statuses={404})
+                return "missing" if resp.status_code == 404 else "deleted"
+            except Exception as e:
+                if attempt >= extra_attempts:
+                    return f"error: {e.__class__.__name__}: {e}"[:200]
+                await asyncio.sleep(min(10.0, 0.5 * (2 ** attempt)) + random.uniform(0, 0.25))
+        return "error: unreachable"
+
+    async def worker() -> None:
+        while True:
+            try:
+                username = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            outcome = await delete_one(username)
+            invalidate_user(username)
+            results[username] = outcome
+            if outcome in ("deleted", "missing"):
+                counts[outcome] += 1
+                pending_marks.append(username)
+            else:
+                counts["failed"] += 1
+            if len(pending_marks) >= mark_batch:
+                batch = pending_marks[:]
+                pending_marks.clear()
+                await _mark_services_deleted(batch)
+            await report()
+
+    with request_priority(PRIORITY_BACKGROUND):
+        await asyncio.gather(*[worker() for _ in range(min(limit, len(names)) or 1)])
+    await _mark_services_deleted(pending_marks)
+    await report(force=True)
+    return {**counts, "total": len(names), "results": results}
+
+
+async def _delete_expired_on(client, progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+    try:
+        # Older panels lack the bulk endpoint; their 404 is expected, not an error
+        resp = await client._request("DELETE", "/api/users/expired", allowed_statuses={404})
+        if resp.status_code != 404:
+            _SNAPSHOT_CACHE.clear()
             # Prefer JSON if available
             try:
                 data = resp.json()
-                return data if isinstance(data, dict) else {"status": resp.status_code}
             except Exception:
                 return {"status": resp.status_code}
-        except httpx.HTTPStatusError as e:
-            status = e.response.status_code if e.response is not None else None
-            if status != 404:
-                raise
-            # Fallback: list then delete individually
-            try:
-                lst_resp = await client._request("GET", "/api/users/expired")
-                items = lst_resp.json()
-                users = items if isinstance(items, list) else items.get("result", [])
-                usernames = [u.get("username") for u in users if isinstance(u, dict) and u.get("username")]
-            except Exception:
-                usernames = []
-            if not usernames:
-                return {"deleted": 0, "failed": 0, "bulk": False, "reason": "not_found"}
-            deleted = 0
-            failed = 0
-            for u in usernames:
-                try:
-                    await client._request("DELETE", f"/api/user/{u}")
-                    deleted += 1
-                except Exception:
-                    failed += 1
-            return {"deleted": deleted, "failed": failed, "bulk": False}
+            if isinstance(data, list):
+                # Marzban returns the removed usernames
+                removed = [str(u) for u in data if u]
+                await _mark_services_deleted(removed)
+                return {"deleted": len(removed), "failed": 0, "bulk": True, "results": {u: "deleted" for u in removed}}
+            return data if isinstance(data, dict) else {"status": resp.status_code}
+        # Fallback: stream the expired users, then DELETE them in parallel. Only usernames are
+        # kept (deleting while paging would shift the offsets under the scan). Like the bulk
+        # endpoint, only users the panel marked expired/limited qualify: a user an admin
+        # disabled by hand keeps its account even when its expiry has passed.
+        cutoff = datetime.now(timezone.utc)
+        usernames: List[str] = []
+        try:
+            async for u in client.iter_users(expired_before=cutoff):
+                if u.get("username") and u.get("status") in ("expired", "limited"):
+                    usernames.append(str(u["username"]))
+        except Exception:
+            logger.exception("listing expired users failed", extra={"extra": {"panel": client.panel}})
+        if not usernames:
+            return {"deleted": 0, "failed": 0, "bulk": False, "reason": "not_found"}
+        summary = await delete_users(client, usernames, progress=progress)
+        logger.info(
+            "expired users deleted",
+            extra={"extra": {"panel": client.panel, **{k: summary[k] for k in ("total", "deleted", "missing", "failed")}}},
+        )
+        return {**summary, "bulk": False}
     finally:
         await client.aclose()
+
+
+async def delete_expired(progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+    """Delete expired users on every panel.
+
+    Behavior (per panel, panels in parallel):
+      - Try bulk DELETE /api/users/expired
+      - If 404 (endpoint missing), stream the expired users and delete them via delete_users()
+      - Matching local user_services rows are marked status="deleted"
+      - Return a summary dict (keyed by panel name when several panels are configured)
+    """
+    clients = await get_all_clients()
+    results = await asyncio.gather(*[_delete_expired_on(c, progress) for c in clients.values()])
+    if len(results) == 1:
+        return results[0]
+    return dict(zip(clients, results))
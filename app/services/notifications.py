@@ -3,10 +3,13 @@ from __future__ import annotations
 import asyncio
 import logging
 import os
-from typing import Optional
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 from aiogram import Bot
 
+from app.config import settings
+
 logger = logging.getLogger(__name__)
 
 _bot_singleton: Optional[Bot] = None
@@ -28,42 +31,222 @@ async def _get_bot() -> Optional[Bot]:
         return _bot_singleton
 
 
-async def notify_user(telegram_id: int, text: str, *, disable_web_page_preview: bool = True) -> bool:
-    """Send a direct message to a user. Returns True if sent, False otherwise."""
-    bot = await _get_bot()
-    if bot is None:
-        return False
-    try:
-        await bot.send_message(chat_id=telegram_id, text=text, disable_web_page_preview=disable_web_page_preview)
-        return True
-    except Exception as e:
-        logger.warning("notify_user failed", extra={"extra": {"telegram_id": telegram_id, "err": str(e)}})
-        return False
+async def notify_user(
+    telegram_id: int,
+    text: str,
+    *,
+    disable_web_page_preview: bool = True,
+    lane: Optional[int] = None,
+) -> bool:
+    """Send a direct message to a user via the outbound queue. Returns True if sent, False otherwise.
 
+    lane defaults to transactional (the reply to something the user just did); scheduler
+    notifications go through notify_users_bulk on the bulk lane.
+    """
+    from app.services import outbound
 
-async def notify_log(text: str, *, disable_web_page_preview: bool = True) -> bool:
-    """Send a message to LOG_CHAT_ID if configured. Returns True if sent, False otherwise."""
-    bot = await _get_bot()
-    if bot is None:
+    if await _get_bot() is None:
         return False
+    result = await outbound.send(
+        telegram_id,
+        lane=outbound.LANE_TRANSACTIONAL if lane is None else lane,
+        text=text,
+        disable_web_page_preview=disable_web_page_preview,
+    )
+    if result != outbound.SENT:
+        logger.warning("notify_user failed", extra={"extra": {"telegram_id": telegram_id, "result": result}})
+    return result == outbound.SENT
+
+
+async def notify_users_bulk(
+    messages: Iterable[Tuple[int, str]],
+    *,
+    concurrency: Optional[int] = None,
+    rate_per_sec: Optional[float] = None,
+) -> int:
+    """Send many (telegram_id, text) messages concurrently, paced to rate_per_sec overall.
+
+    Returns the number of messages delivered.
+    """
+    results = await notify_users_bulk_results(messages, concurrency=concurrency, rate_per_sec=rate_per_sec)
+    return sum(1 for ok in results if ok)
+
+
+async def notify_users_bulk_results(
+    messages: Iterable[Tuple[int, str]],
+    *,
+    concurrency: Optional[int] = None,
+    rate_per_sec: Optional[float] = None,
+) -> List[bool]:
+    """Like notify_users_bulk, but returns whether each message was delivered, in input order."""
+    from app.services.outbound import LANE_BULK
+
+    items = list(messages)
+    if not items:
+        return []
+    sem = asyncio.Semaphore(max(1, int(concurrency or settings.notify_send_concurrency)))
+    interval = 1.0 / max(0.1, float(rate_per_sec or settings.notify_send_rate))
+    pace_lock = asyncio.Lock()
+    loop = asyncio.get_running_loop()
+    next_slot = loop.time()
+
+    async def _send(chat_id: int, text: str) -> bool:
+        nonlocal next_slot
+        async with sem:
+            async with pace_lock:
+                delay = next_slot - loop.time()
+                next_slot = max(next_slot, loop.time()) + interval
+            if delay > 0:
+                await asyncio.sleep(delay)
+            return await notify_user(chat_id, text, lane=LANE_BULK)
+
+    return list(await asyncio.gather(*[_send(chat_id, text) for chat_id, text in items]))
+
+
+def _log_chat_id() -> Optional[int]:
     raw = os.getenv("LOG_CHAT_ID", "").strip()
     if not raw:
-        return False
+        return None
     try:
-        chat_id = int(raw)
+        return int(raw)
     except Exception:
         logger.warning("notify_log: invalid LOG_CHAT_ID: %s", raw)
+        return None
+
+
+async def _send_log(chat_id: int, text: str, *, disable_web_page_preview: bool = True) -> bool:
+    from app.services import outbound
+
+    result = await outbound.send(
+        chat_id, lane=outbound.LANE_ADMIN, text=text, disable_web_page_preview=disable_web_page_preview
+    )
+    if result != outbound.SENT:
+        logger.warning("notify_log failed", extra={"extra": {"result": result}})
+    return result == outbound.SENT
+
+
+class _LogDigest:
+    """Buffers notify_log events and posts them as one message per window.
+
+    Events sharing a key merge into a count ("12× orders auto-cancelled"); events without a key merge
+    only with identical text. Lines keep the order in which they first appeared.
+    """
+
+    def __init__(self) -> None:
+        self._entries: Dict[str, List] = {}  # merge key -> [key, count, first text]
+        self._events = 0
+        self._since: Optional[datetime] = None
+        self._timer: Optional[asyncio.Task] = None
+        self._flushing: Set[asyncio.Task] = set()
+
+    def add(self, text: str, key: Optional[str]) -> bool:
+        """Buffer one event; True when the buffer is full and should be flushed now."""
+        merge = f"k:{key}" if key else f"t:{text}"
+        entry = self._entries.get(merge)
+        if entry is None:
+            self._entries[merge] = [key, 1, text]
+        else:
+            entry[1] += 1
+        self._events += 1
+        if self._since is None:
+            self._since = datetime.utcnow()
+        if self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later())
+        return self._events >= max(1, settings.log_digest_max_events)
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(settings.log_digest_window)
+        await self.flush()
+
+    @staticmethod
+    def _render(entries: List[List], events: int, since: datetime) -> List[str]:
+        header = f"🧾 Log digest {since:%H:%M}–{datetime.utcnow():%H:%M} UTC ({events} events)"
+        lines: List[str] = []
+        for key, count, text in entries:
+            if count == 1:
+                lines.append(f"• {text}")
+            else:
+                lines.append(f"• {count}× {key or text}")
+        # Telegram caps a message at 4096 chars
+        chunks: List[str] = []
+        chunk = header
+        for line in lines:
+            line = line[:3800]
+            if len(chunk) + len(line) + 1 > 3800:
+                chunks.append(chunk)
+                chunk = line
+            else:
+                chunk += "\n" + line
+        chunks.append(chunk)
+        return chunks
+
+    async def flush(self) -> bool:
+        if not self._entries:
+            return True
+        entries, events, since = list(self._entries.values()), self._events, self._since or datetime.utcnow()
+        self._entries, self._events, self._since = {}, 0, None
+        chat_id = _log_chat_id()
+        if chat_id is None:
+            return False
+        ok = True
+        for chunk in self._render(entries, events, since):
+            ok = await _send_log(chat_id, chunk) and ok
+        return ok
+
+    def flush_soon(self) -> None:
+        task = asyncio.create_task(self.flush())
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    def cancel(self) -> None:
+        if self._timer is not None and not self._timer.done():
+            self._timer.cancel()
+        self._timer = None
+
+
+_log_digest = _LogDigest()
+
+
+async def notify_log(
+    text: str,
+    *,
+    key: Optional[str] = None,
+    critical: bool = False,
+    disable_web_page_preview: bool = True,
+) -> bool:
+    """Post an event to LOG_CHAT_ID if configured.
+
+    Events are batched into a digest (LOG_DIGEST_WINDOW / LOG_DIGEST_MAX_EVENTS) and events with
+    the same key are counted, e.g. key="orders auto-cancelled". critical=True sends immediately
+    (failures someone has to act on).
+    Returns True if sent or buffered, False otherwise.
+    """
+    bot = await _get_bot()
+    if bot is None:
         return False
-    try:
-        await bot.send_message(chat_id=chat_id, text=text, disable_web_page_preview=disable_web_page_preview)
-        return True
-    except Exception as e:
-        logger.warning("notify_log failed", extra={"extra": {"err": str(e)}})
+    chat_id = _log_chat_id()
+    if chat_id is None:
         return False
+    if critical or settings.log_digest_window <= 0:
+        return await _send_log(chat_id, text, disable_web_page_preview=disable_web_page_preview)
+    if _log_digest.add(text, key):
+        # Flush in the background: the log chat is paced, and callers are often handlers
+        _log_digest.flush_soon()
+    return True
+
+
+async def flush_log_digest() -> bool:
+    """Post buffered notify_log events now instead of waiting for the window."""
+    return await _log_digest.flush()
 
 
 async def aclose_bot() -> None:
     global _bot_singleton
+    try:
+        await _log_digest.flush()
+    except Exception:
+        logger.warning("notify_log digest flush failed on shutdown", exc_info=True)
+    _log_digest.cancel()
     if _bot_singleton is not None:
         try:
             await _bot_singleton.session.close()
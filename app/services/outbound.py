@@ -0,0 +1,324 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from app.config import settings
+from app.marzban.metrics import LatencyHistogram
+from app.utils.rate import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Lanes, highest priority first: user-facing results of their own actions, admin traffic
+# (receipt forwards, log channel), then scheduler/bulk notifications
+LANE_TRANSACTIONAL = 0
+LANE_ADMIN = 1
+LANE_BULK = 2
+LANE_NAMES = ("transactional", "admin", "bulk")
+
+# Delivery outcomes
+SENT = "sent"
+BLOCKED = "blocked"  # user blocked the bot / chat is gone
+FAILED = "failed"
+
+# Process roles sharing the bot-wide OUTBOUND_RATE: the polling bot process gets
+# OUTBOUND_BOT_SHARE of it, worker replicas split the rest evenly
+ROLE_BOT = "bot"
+ROLE_WORKER = "worker"
+
+# Lanes are scanned this deep for an item whose chat is ready, so one throttled chat at the
+# head of a lane doesn't stall everything behind it
+_SCAN_DEPTH = 256
+
+
+@dataclass(eq=False)
+class _Item:
+    lane: int
+    chat_id: int
+    method: str
+    kwargs: Dict[str, Any]
+    bot: Any
+    key: Optional[Tuple[Any, ...]]
+    future: "asyncio.Future[str]"
+    enqueued: float
+    attempts: int = 0
+    not_before: float = 0.0
+
+
+@dataclass
+class LaneStats:
+    sent: int = 0
+    failed: int = 0
+    blocked: int = 0
+    retries: int = 0
+    coalesced: int = 0
+    wait: LatencyHistogram = field(default_factory=LatencyHistogram)  # enqueue → send start
+    latency: LatencyHistogram = field(default_factory=LatencyHistogram)  # Bot API call
+
+
+def _default_key(method: str, chat_id: int, kwargs: Dict[str, Any]) -> Tuple[Any, ...]:
+    return (
+        method,
+        chat_id,
+        kwargs.get("text"),
+        kwargs.get("caption"),
+        kwargs.get("photo") if isinstance(kwargs.get("photo"), str) else id(kwargs.get("photo")),
+        kwargs.get("document") if isinstance(kwargs.get("document"), str) else id(kwargs.get("document")),
+    )
+
+
+def process_rate(role: str, replicas: int = 1) -> float:
+    """This process's slice of the bot-wide OUTBOUND_RATE (see ROLE_BOT / ROLE_WORKER)."""
+    share = min(1.0, max(0.0, settings.outbound_bot_share))
+    if role == ROLE_BOT:
+        return settings.outbound_rate * share
+    return settings.outbound_rate * (1.0 - share) / max(1, int(replicas))
+
+
+class OutboundQueue:
+    """Process-wide outbound Telegram queue.
+
+    - Priority lanes (transactional > admin > bulk); within a lane, FIFO.
+    - One token bucket for the process's share of OUTBOUND_RATE (process_rate()), so the bot
+      process and every worker replica together stay under it, plus per-chat pacing: private
+      chats get one message per OUTBOUND_CHAT_INTERVAL, groups/channels one per
+      OUTBOUND_GROUP_INTERVAL.
+    - A message identical to one still queued for the same chat is coalesced into it (both
+      callers get the same outcome).
+    - 429 pauses the bucket and the chat for the server's retry_after and requeues the message
+      at the head of its lane; network/5xx errors retry with backoff.
+    """
+
+    def __init__(self, rate: Optional[float] = None) -> None:
+        self.rate = float(rate if rate is not None else process_rate(ROLE_BOT))
+        self._lanes: List[Deque[_Item]] = [deque() for _ in LANE_NAMES]
+        self._pending: Dict[Tuple[Any, ...], _Item] = {}
+        self._chat_ready: Dict[int, float] = {}
+        self._bucket = TokenBucket(self.rate, capacity=self.rate)
+        self._sem = asyncio.Semaphore(max(1, settings.outbound_concurrency))
+        self._wake = asyncio.Event()
+        self._inflight: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stats: List[LaneStats] = [LaneStats() for _ in LANE_NAMES]
+        self.errors: Counter[str] = Counter()
+
+    # ---- public ----
+    async def send(
+        self,
+        chat_id: int,
+        method: str = "send_message",
+        *,
+        lane: int = LANE_TRANSACTIONAL,
+        bot: Any = None,
+        coalesce: bool = True,
+        **kwargs: Any,
+    ) -> str:
+        """Queue a Bot API call (send_message, send_photo, ...) and wait for its outcome."""
+        self._ensure_running()
+        key = _default_key(method, chat_id, kwargs) if coalesce else None
+        if key is not None and key in self._pending:
+            self.stats[lane].coalesced += 1
+            return await asyncio.shield(self._pending[key].future)
+        loop = asyncio.get_running_loop()
+        item = _Item(lane, int(chat_id), method, kwargs, bot, key, loop.create_future(), time.monotonic())
+        if key is not None:
+            self._pending[key] = item
+        self._lanes[lane].append(item)
+        self._wake.set()
+        return await asyncio.shield(item.future)
+
+    def set_rate(self, rate: float) -> None:
+        """Resize this process's share of the send rate (e.g. when worker replicas come or go)."""
+        self.rate = float(rate)
+        self._bucket.set_rate(self.rate)
+
+    def depth(self) -> Dict[str, int]:
+        return {name: len(q) for name, q in zip(LANE_NAMES, self._lanes)}
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        lanes: Dict[str, Any] = {}
+        for name, q, st in zip(LANE_NAMES, self._lanes, self.stats):
+            lanes[name] = {
+                "depth": len(q),
+                "oldest_age": (now - q[0].enqueued) if q else 0.0,
+                "sent": st.sent, "failed": st.failed, "blocked": st.blocked,
+                "retries": st.retries, "coalesced": st.coalesced,
+                "wait_p50": st.wait.quantile(0.5), "wait_p95": st.wait.quantile(0.95),
+                "send_p50": st.latency.quantile(0.5), "send_p95": st.latency.quantile(0.95),
+                "send_p99": st.latency.quantile(0.99),
+            }
+        return {"lanes": lanes, "inflight": len(self._inflight), "rate": self.rate, "errors": dict(self.errors)}
+
+    # ---- dispatcher ----
+    def _ensure_running(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._loop is loop:
+            return
+        if self._loop is not loop:
+            # A new event loop (scripts calling asyncio.run twice): futures and primitives from the
+            # old one are unusable
+            self._lanes = [deque() for _ in LANE_NAMES]
+            self._pending = {}
+            self._bucket = TokenBucket(self.rate, capacity=self.rate)
+            self._sem = asyncio.Semaphore(max(1, settings.outbound_concurrency))
+            self._wake = asyncio.Event()
+            self._inflight = set()
+        self._loop = loop
+        self._task = loop.create_task(self._run())
+
+    def _chat_interval(self, chat_id: int) -> float:
+        return settings.outbound_group_interval if chat_id < 0 else settings.outbound_chat_interval
+
+    def _pick(self, now: float) -> Tuple[Optional[_Item], Optional[float]]:
+        """Highest-priority item whose chat may receive now, else the earliest ready time."""
+        earliest: Optional[float] = None
+        for lane in self._lanes:
+            for idx, item in enumerate(lane):
+                if idx >= _SCAN_DEPTH:
+                    break
+                ready = max(item.not_before, self._chat_ready.get(item.chat_id, 0.0))
+                if ready <= now:
+                    del lane[idx]
+                    return item, None
+                earliest = ready if earliest is None else min(earliest, ready)
+        return None, earliest
+
+    async def _run(self) -> None:
+        last_log = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now - last_log >= settings.outbound_stats_interval:
+                last_log = now
+                if any(st.sent or st.failed for st in self.stats):
+                    logger.info("outbound queue stats", extra={"extra": self._log_snapshot()})
+                # Forget pacing state of chats that have been quiet for a while
+                self._chat_ready = {c: t for c, t in self._chat_ready.items() if t > now}
+            item, wait_until = self._pick(now)
+            if item is None:
+                self._wake.clear()
+                timeout = None if wait_until is None else max(0.0, wait_until - now)
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._bucket.acquire()
+            await self._sem.acquire()
+            self._chat_ready[item.chat_id] = time.monotonic() + self._chat_interval(item.chat_id)
+            task = asyncio.create_task(self._deliver(item))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    def _log_snapshot(self) -> Dict[str, Any]:
+        return {
+            name: {"depth": len(q), "sent": st.sent, "failed": st.failed, "p95": st.latency.quantile(0.95)}
+            for name, q, st in zip(LANE_NAMES, self._lanes, self.stats)
+        }
+
+    def _requeue(self, item: _Item, delay: float) -> None:
+        item.attempts += 1
+        item.not_before = time.monotonic() + delay
+        self.stats[item.lane].retries += 1
+        self._lanes[item.lane].appendleft(item)
+        self._wake.set()
+
+    async def _deliver(self, item: _Item) -> None:
+        st = self.stats[item.lane]
+        started = time.monotonic()
+        if item.attempts == 0:
+            st.wait.observe(started - item.enqueued)
+        outcome = FAILED
+        try:
+            bot = item.bot
+            if bot is None:
+                from app.services.notifications import _get_bot
+
+                bot = await _get_bot()
+            if bot is None:
+                outcome = FAILED
+            else:
+                await getattr(bot, item.method)(chat_id=item.chat_id, **item.kwargs)
+                outcome = SENT
+        except TelegramRetryAfter as e:
+            self.errors["retry_after"] += 1
+            retry_after = float(e.retry_after or 1)
+            self._bucket.pause(retry_after)
+            self._chat_ready[item.chat_id] = time.monotonic() + retry_after
+            logger.warning("outbound flood wait", extra={"extra": {"chat_id": item.chat_id, "retry_after": retry_after, "lane": LANE_NAMES[item.lane]}})
+            if item.attempts < settings.outbound_max_retries:
+                self._requeue(item, retry_after)
+                return
+        except TelegramForbiddenError:
+            outcome = BLOCKED
+        except TelegramBadRequest as e:
+            outcome = BLOCKED if "chat not found" in str(e).lower() else FAILED
+            self.errors["bad_request"] += 1
+            logger.warning("outbound bad request", extra={"extra": {"chat_id": item.chat_id, "err": str(e)}})
+        except (TelegramNetworkError, TelegramServerError) as e:
+            self.errors[e.__class__.__name__] += 1
+            if item.attempts < settings.outbound_max_retries:
+                self._requeue(item, min(30.0, 2.0 ** item.attempts))
+                return
+            logger.warning("outbound send failed", extra={"extra": {"chat_id": item.chat_id, "err": str(e)}})
+        except Exception as e:
+            self.errors[e.__class__.__name__] += 1
+            logger.warning("outbound send failed", extra={"extra": {"chat_id": item.chat_id, "err": str(e)}})
+        finally:
+            st.latency.observe(time.monotonic() - started)
+            self._sem.release()
+        self._finish(item, outcome)
+
+    def _finish(self, item: _Item, outcome: str) -> None:
+        st = self.stats[item.lane]
+        if outcome == SENT:
+            st.sent += 1
+        elif outcome == BLOCKED:
+            st.blocked += 1
+        else:
+            st.failed += 1
+        if item.key is not None and self._pending.get(item.key) is item:
+            del self._pending[item.key]
+        if not item.future.done():
+            item.future.set_result(outcome)
+
+
+_queue: Optional[OutboundQueue] = None
+_role: Tuple[str, int] = (ROLE_BOT, 1)
+
+
+def get_outbound() -> OutboundQueue:
+    global _queue
+    if _queue is None:
+        _queue = OutboundQueue(process_rate(*_role))
+    return _queue
+
+
+def configure_outbound(role: str, replicas: int = 1) -> None:
+    """Declare this process's role (and, for workers, how many replicas are live)."""
+    global _role
+    if _role == (role, replicas):
+        return
+    _role = (role, replicas)
+    rate = process_rate(role, replicas)
+    if _queue is not None:
+        _queue.set_rate(rate)
+    logger.info("outbound rate set", extra={"extra": {"role": role, "replicas": replicas, "rate": rate}})
+
+
+async def send(chat_id: int, method: str = "send_message", *, lane: int = LANE_TRANSACTIONAL, **kwargs: Any) -> str:
+    """Shortcut for get_outbound().send(); returns SENT, BLOCKED or FAILED."""
+    return await get_outbound().send(chat_id, method, lane=lane, **kwargs)
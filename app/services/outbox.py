@@ -0,0 +1,312 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from app.config import settings
+from app.db.models import MarzbanOutbox
+from app.db.session import session_scope
+from app.marzban.limiter import PRIORITY_BACKGROUND, request_priority
+from app.services import marzban_ops as ops
+
+logger = logging.getLogger(__name__)
+
+# Mutations the outbox can replay. Only absolute (idempotent) changes: a retried PUT must not
+# add traffic or days twice when the first attempt succeeded but its response was lost.
+OPS: Dict[str, Callable[..., Awaitable[Any]]] = {
+    "set_status": lambda username, status: ops.set_status(username, status),
+    "patch": lambda username, patch: ops.apply_user_patch(username, patch),
+    "delete_user": lambda username: ops.delete_user(username),
+    "reset_user": lambda username: ops.reset_user(username),
+    "revoke_sub": lambda username: ops.revoke_sub(username),
+}
+
+OutboxCallback = Callable[[MarzbanOutbox, bool, Dict[str, Any]], Awaitable[None]]
+_CALLBACKS: Dict[str, OutboxCallback] = {}
+
+FINISHED_RETENTION_DAYS = 7
+
+
+def register_callback(name: str) -> Callable[[OutboxCallback], OutboxCallback]:
+    """Register a completion callback: fn(entry, ok, data) runs once an entry is done or failed."""
+    def _wrap(fn: OutboxCallback) -> OutboxCallback:
+        _CALLBACKS[name] = fn
+        return fn
+    return _wrap
+
+
+@register_callback("notify")
+async def _notify_callback(entry: MarzbanOutbox, ok: bool, data: Dict[str, Any]) -> None:
+    """data: {"chat_id": int, "ok": str | None, "fail": str | None}; {username}/{error} are filled in."""
+    from app.services.notifications import notify_user
+
+    template = data.get("ok") if ok else data.get("fail")
+    if not template or not data.get("chat_id"):
+        return
+    text = str(template).format(username=entry.username, error=(entry.last_error or "")[:300])
+    await notify_user(int(data["chat_id"]), text)
+
+
+async def enqueue(
+    username: str,
+    op: str,
+    payload: Optional[Dict[str, Any]] = None,
+    *,
+    idempotency_key: Optional[str] = None,
+    callback: Optional[str] = None,
+    callback_data: Optional[Dict[str, Any]] = None,
+    session: Optional[AsyncSession] = None,
+) -> int:
+    """Queue a Marzban mutation and return the outbox id without touching the panel.
+
+    - Pass `session` to enqueue inside the caller's transaction (committed by the caller).
+    - A repeated idempotency_key returns the existing entry instead of queueing again.
+    - A mutation identical to the newest still-pending one for the username is collapsed into it.
+    """
+    if op not in OPS:
+        raise ValueError(f"unknown outbox op: {op}")
+    if callback is not None and callback not in _CALLBACKS:
+        raise ValueError(f"unknown outbox callback: {callback}")
+    payload_json = json.dumps(payload or {}, sort_keys=True, ensure_ascii=False)
+    key = idempotency_key or f"{op}:{username}:{uuid.uuid4().hex}"
+
+    async def _enqueue(s: AsyncSession) -> int:
+        existing = await s.scalar(select(MarzbanOutbox.id).where(MarzbanOutbox.idempotency_key == key))
+        if existing:
+            return int(existing)
+        last = await s.scalar(
+            select(MarzbanOutbox)
+            .where(MarzbanOutbox.username == username, MarzbanOutbox.status.in_(("pending", "running")))
+            .order_by(MarzbanOutbox.id.desc())
+            .limit(1)
+        )
+        if last is not None and last.status == "pending" and last.op == op and last.payload == payload_json:
+            return int(last.id)
+        entry = MarzbanOutbox(
+            idempotency_key=key,
+            username=username,
+            op=op,
+            payload=payload_json,
+            status="pending",
+            next_attempt_at=datetime.utcnow(),
+            callback=callback,
+            callback_data=json.dumps(callback_data, ensure_ascii=False) if callback_data else None,
+        )
+        s.add(entry)
+        await s.flush()
+        return int(entry.id)
+
+    # This process (usually the bot) would otherwise keep serving its cached pre-change snapshot
+    # until the TTL runs out, and could re-cache the old state before the worker applies the op
+    ops.invalidate_user(username, hold=settings.marzban_cache_ttl + settings.outbox_poll_interval)
+    if session is not None:
+        return await _enqueue(session)
+    async with session_scope() as s:
+        try:
+            entry_id = await _enqueue(s)
+            await s.commit()
+            return entry_id
+        except IntegrityError:
+            # Concurrent enqueue with the same idempotency key won the insert
+            await s.rollback()
+            existing = await s.scalar(select(MarzbanOutbox.id).where(MarzbanOutbox.idempotency_key == key))
+            if existing is None:
+                raise
+            return int(existing)
+
+
+async def enqueue_set_status(
+    username: str,
+    status: str,
+    *,
+    notify_chat_id: int,
+    ok: Optional[str] = None,
+    session: Optional[AsyncSession] = None,
+) -> int:
+    """Queue a panel status change; notify_chat_id is told if it fails (and, with `ok`, when it lands).
+
+    The one path for admin status changes, so they all get the outbox's retries and reporting.
+    """
+    data: Dict[str, Any] = {
+        "chat_id": int(notify_chat_id),
+        "fail": f"⚠️ تغییر وضعیت سرویس {{username}} به {status} ناموفق بود: {{error}}",
+    }
+    if ok:
+        data["ok"] = ok
+    return await enqueue(username, "set_status", {"status": status}, callback="notify", callback_data=data, session=session)
+
+
+def _worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"[:64]
+
+
+def _backoff(attempts: int) -> float:
+    delay = settings.outbox_backoff_base * (2 ** max(0, attempts - 1))
+    return min(settings.outbox_backoff_max, delay) * random.uniform(0.8, 1.2)
+
+
+def _is_permanent(exc: BaseException) -> bool:
+    """4xx answers (other than timeouts/throttling) will not succeed on retry."""
+    if isinstance(exc, httpx.HTTPStatusError) and exc.response is not None:
+        code = exc.response.status_code
+        return 400 <= code < 500 and code not in {408, 429}
+    return isinstance(exc, (ValueError, TypeError))
+
+
+async def _claim(limit: int, worker: str) -> List[MarzbanOutbox]:
+    """Lock due entries that have no earlier unfinished entry for the same username."""
+    now = datetime.utcnow()
+    earlier = aliased(MarzbanOutbox)
+    blocked = (
+        select(earlier.id)
+        .where(
+            earlier.username == MarzbanOutbox.username,
+            earlier.id < MarzbanOutbox.id,
+            earlier.status.in_(("pending", "running")),
+        )
+        .exists()
+    )
+    async with session_scope() as session:
+        rows = (
+            await session.execute(
+                select(MarzbanOutbox)
+                .where(MarzbanOutbox.status == "pending", MarzbanOutbox.next_attempt_at <= now, ~blocked)
+                .order_by(MarzbanOutbox.id)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            )
+        ).scalars().all()
+        for row in rows:
+            row.status = "running"
+            row.locked_by = worker
+            row.locked_at = now
+        await session.commit()
+        return list(rows)
+
+
+async def _reclaim_stale() -> int:
+    """Hand entries claimed by a crashed worker back to the queue."""
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.outbox_lease_seconds)
+    async with session_scope() as session:
+        res = await session.execute(
+            update(MarzbanOutbox)
+            .where(MarzbanOutbox.status == "running", MarzbanOutbox.locked_at < cutoff)
+            .values(status="pending", locked_by=None, locked_at=None)
+        )
+        await session.commit()
+        return int(res.rowcount or 0)
+
+
+async def _purge_finished() -> int:
+    cutoff = datetime.utcnow() - timedelta(days=FINISHED_RETENTION_DAYS)
+    async with session_scope() as session:
+        res = await session.execute(
+            delete(MarzbanOutbox).where(MarzbanOutbox.status.in_(("done", "failed")), MarzbanOutbox.finished_at < cutoff)
+        )
+        await session.commit()
+        return int(res.rowcount or 0)
+
+
+async def _process(entry: MarzbanOutbox) -> None:
+    error: Optional[BaseException] = None
+    try:
+        kwargs = json.loads(entry.payload or "{}")
+        with request_priority(PRIORITY_BACKGROUND):
+            await OPS[entry.op](entry.username, **kwargs)
+    except Exception as e:
+        error = e
+    attempts = int(entry.attempts or 0) + 1
+    now = datetime.utcnow()
+    if error is None:
+        values: Dict[str, Any] = {"status": "done", "attempts": attempts, "last_error": None, "finished_at": now}
+    elif attempts >= settings.outbox_max_attempts or _is_permanent(error):
+        values = {"status": "failed", "attempts": attempts, "last_error": f"{error.__class__.__name__}: {error}", "finished_at": now}
+    else:
+        values = {
+            "status": "pending",
+            "attempts": attempts,
+            "last_error": f"{error.__class__.__name__}: {error}",
+            "next_attempt_at": now + timedelta(seconds=_backoff(attempts)),
+        }
+    values.update(locked_by=None, locked_at=None)
+    async with session_scope() as session:
+        await session.execute(update(MarzbanOutbox).where(MarzbanOutbox.id == entry.id).values(**values))
+        await session.commit()
+    for key, val in values.items():
+        setattr(entry, key, val)
+    log_extra = {"id": entry.id, "op": entry.op, "username": entry.username, "attempts": attempts, "status": values["status"]}
+    if values["status"] == "pending":
+        logger.warning("outbox entry will retry", extra={"extra": {**log_extra, "err": values["last_error"]}})
+        return
+    if values["status"] == "failed":
+        logger.error("outbox entry failed", extra={"extra": {**log_extra, "err": values["last_error"]}})
+    if entry.callback:
+        fn = _CALLBACKS.get(entry.callback)
+        try:
+            if fn is not None:
+                await fn(entry, values["status"] == "done", json.loads(entry.callback_data or "{}"))
+        except Exception:
+            logger.exception("outbox callback failed", extra={"extra": log_extra})
+
+
+async def run_outbox(workers: Optional[int] = None) -> None:
+    """Drain the outbox forever with a pool of workers (run in the worker process).
+
+    Entries for one username run strictly in id order: an entry is only claimed once every
+    earlier entry for the same username is done or failed.
+    """
+    size = max(1, int(workers or settings.outbox_workers))
+    worker = _worker_id()
+    queue: "asyncio.Queue[MarzbanOutbox]" = asyncio.Queue()
+    housekeeping_every = max(30.0, settings.outbox_lease_seconds / 2)
+    last_housekeeping = 0.0
+    loop = asyncio.get_running_loop()
+
+    async def consume() -> None:
+        while True:
+            entry = await queue.get()
+            try:
+                await _process(entry)
+            except Exception:
+                logger.exception("outbox worker error", extra={"extra": {"id": entry.id}})
+            finally:
+                queue.task_done()
+
+    consumers = [asyncio.create_task(consume()) for _ in range(size)]
+    logger.info("outbox started", extra={"extra": {"workers": size, "worker": worker}})
+    try:
+        while True:
+            try:
+                if loop.time() - last_housekeeping >= housekeeping_every:
+                    last_housekeeping = loop.time()
+                    reclaimed = await _reclaim_stale()
+                    purged = await _purge_finished()
+                    if reclaimed or purged:
+                        logger.info("outbox housekeeping", extra={"extra": {"reclaimed": reclaimed, "purged": purged}})
+                claimed = await _claim(size - queue.qsize(), worker) if queue.qsize() < size else []
+            except Exception:
+                logger.exception("outbox poll failed")
+                claimed = []
+            for entry in claimed:
+                queue.put_nowait(entry)
+            if not claimed:
+                await asyncio.sleep(settings.outbox_poll_interval)
+            else:
+                # Let the pool pick up work before claiming more
+                await asyncio.sleep(0)
+    finally:
+        for task in consumers:
+            task.cancel()
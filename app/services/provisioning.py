@@ -5,12 +5,12 @@ from datetime import datetime, timedelta, timezone
 
 import httpx
 
-from app.marzban.client import get_client
 from sqlalchemy import select
 from app.db.session import session_scope
 from app.db.models import Setting
 from app.utils.username import tg_username
 from app.config import settings
+from app.services.marzban_ops import apply_user_patch, client_for, post_user_with_inbounds
 
 
 logger = logging.getLogger(__name__)
@@ -28,30 +28,16 @@ async def _mark_trial_used(telegram_id: int) -> None:
         await session.commit()
 
 
-async def _get_vless_inbound_tags(client) -> list[str]:
-    """Fetch inbound tags for vless protocol and filter out non-service tags like 'Info'."""
-    try:
-        resp = await client._request("GET", "/api/inbounds")  # reuse authed client
-        data = resp.json()
-        vless = data.get("vless", []) if isinstance(data, dict) else []
-        tags = [item.get("tag") for item in vless if isinstance(item, dict) and item.get("tag")]
-        # Filter out control/info tags if present
-        return [t for t in tags if t.lower() != "info"] or tags
-    except Exception as e:
-        logger.warning("failed to fetch inbounds; falling back to empty list: %s", e)
-        return []
-
-
 async def provision_trial(telegram_id: int) -> dict:
     """Create or refresh a trial user in Marzban with a safe, UI-compatible flow.
 
     Strategy:
-      - Read vless inbound tags (exclude 'Info').
+      - Read vless inbound tags (exclude 'Info') from the shared catalog cache.
       - Create user with minimal payload (no template_id):
         username, status=active, expire=0, data_limit=0, data_limit_reset_strategy=no_reset,
         inbounds={vless: [...]}, proxies={vless: {}}.
-      - Then set expire and data_limit via two separate PUT calls.
-      - Finally return current user info.
+      - Then set expire and data_limit in a single PUT (see marzban_ops.apply_user_patch).
+      - Return the PUT response as the current user info.
     """
     # Resolve trial config from DB (overrides ENV), with ENV fallback
     enabled = settings.trial_enabled
@@ -106,22 +92,17 @@ async def provision_trial(telegram_id: int) -> dict:
     if not enabled:
         raise RuntimeError("trial_disabled")
 
-    client = await get_client()
+    username = tg_username(telegram_id)
+    client = await client_for(username, for_create=True)
     try:
-        username = tg_username(telegram_id)
 
-        # Prepare minimal creation payload
-        vless_tags = await _get_vless_inbound_tags(client)
-        if not vless_tags:
-            # As a last resort, try to at least provide an empty vless proxies section
-            vless_tags = []
+        # Prepare minimal creation payload (vless inbounds come from the shared catalog cache)
         create_payload = {
             "username": username,
             "status": "active",
             "expire": 0,
             "data_limit": 0,
             "data_limit_reset_strategy": "no_reset",
-            "inbounds": {"vless": vless_tags},
             "proxies": {"vless": {}},
             "next_plan": {
                 "add_remaining_traffic": False,
@@ -134,38 +115,31 @@ async def provision_trial(telegram_id: int) -> dict:
 
         # Create if not exists; if exists, proceed to update
         # Allow 409 (user exists) without raising/logging at HTTP layer to avoid noisy ERROR logs
-        resp = await client._request("POST", "/api/user", allowed_statuses={409}, json=create_payload)
+        resp = await post_user_with_inbounds(client, create_payload)
         if resp.status_code == 409:
             logger.info("user exists; will update", extra={"extra": {"username": username}})
         else:
             logger.info("trial created (minimal)", extra={"extra": {"username": username}})
 
-        # Stage updates (expire then data_limit) if limits configured
+        # Apply expire and data_limit in one PUT (staged per field when MARZBAN_STAGED_UPDATES=1)
         expire_ts = int((datetime.now(timezone.utc) + timedelta(days=duration_days)).timestamp()) if duration_days > 0 else 0
         data_limit_bytes = int(data_gb) * 1024 ** 3 if data_gb > 0 else 0
-
-        # Update expire first
+        result = None
         try:
-            await client.update_user(username, {"expire": expire_ts})
+            result = await apply_user_patch(username, {"expire": expire_ts, "data_limit": data_limit_bytes}, client=client)
         except httpx.HTTPStatusError as e:
-            logger.warning("set expire failed", extra={"extra": {"username": username, "status": e.response.status_code if e.response else None}})
+            logger.warning("set limits failed", extra={"extra": {"username": username, "status": e.response.status_code if e.response else None}})
 
-        # Then update data_limit
-        try:
-            await client.update_user(username, {"data_limit": data_limit_bytes})
-        except httpx.HTTPStatusError as e:
-            logger.warning("set data_limit failed", extra={"extra": {"username": username, "status": e.response.status_code if e.response else None}})
-
-        # Return current snapshot (best-effort)
         if one_per_user:
             try:
                 await _mark_trial_used(telegram_id)
             except Exception:
                 pass
 
-        try:
-            result = await client.get_user(username)
+        if result is not None:
             return result
+        try:
+            return await client.get_user(username)
         except Exception:
             # If fetch fails, synthesize a minimal response
             return {"username": username, "status": "active", "data_limit": data_limit_bytes, "expire": expire_ts}
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import asyncio
+import gzip
+import json
+import logging
+import os
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Type
+
+from sqlalchemy import delete, select
+
+from app.config import settings
+from app.db.models import AuditLog, CouponRedemption, Order, Transaction, WalletTopUp
+from app.db.session import session_scope
+
+logger = logging.getLogger(__name__)
+
+# Rows still in flight stay in the hot tables regardless of age
+_OPEN_ORDER_STATUSES = ("pending", "paid")
+_OPEN_TOPUP_STATUSES = ("pending",)
+
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _row_dict(row: Any) -> Dict[str, Any]:
+    return {c.key: _jsonable(getattr(row, c.key)) for c in row.__table__.columns}
+
+
+def _archive_path(table: str, day: date) -> str:
+    return os.path.join(settings.retention_archive_dir, table, f"{table}-{day:%Y%m%d}.jsonl.gz")
+
+
+def _append_jsonl_gz(path: str, records: List[Dict[str, Any]]) -> None:
+    """Append records as a new gzip member (readers see one continuous JSONL stream) and fsync."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = "".join(json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n" for r in records)
+    with open(path, "ab") as fh:
+        fh.write(gzip.compress(data.encode("utf-8")))
+        fh.flush()
+        os.fsync(fh.fileno())
+
+
+async def _write_archive(table: str, records: List[Dict[str, Any]]) -> None:
+    if records:
+        await asyncio.to_thread(_append_jsonl_gz, _archive_path(table, datetime.utcnow().date()), records)
+
+
+async def _archive_orders_batch(cutoff: datetime, batch: int) -> int:
+    """One chunk of closed orders older than cutoff, with their transactions (deleted first).
+
+    Orders a coupon redemption points at stay: redemption counts and per-user coupon limits
+    are computed from those rows.
+    """
+    redeemed = select(CouponRedemption.id).where(CouponRedemption.order_id == Order.id).exists()
+    async with session_scope() as session:
+        orders = (
+            await session.execute(
+                select(Order)
+                .where(Order.created_at < cutoff, Order.status.not_in(_OPEN_ORDER_STATUSES), ~redeemed)
+                .order_by(Order.id)
+                .limit(batch)
+            )
+        ).scalars().all()
+        if not orders:
+            return 0
+        ids = [o.id for o in orders]
+        txs = (await session.execute(select(Transaction).where(Transaction.order_id.in_(ids)))).scalars().all()
+        # Archive first: a crash after the write only re-archives the chunk (rows carry their ids)
+        await _write_archive("transactions", [_row_dict(t) for t in txs])
+        await _write_archive("orders", [_row_dict(o) for o in orders])
+        if txs:
+            await session.execute(delete(Transaction).where(Transaction.id.in_([t.id for t in txs])))
+        await session.execute(delete(Order).where(Order.id.in_(ids)))
+        await session.commit()
+        return len(ids)
+
+
+async def _archive_simple_batch(model: Type[Any], table: str, cutoff: datetime, batch: int, open_statuses=()) -> int:
+    async with session_scope() as session:
+        stmt = select(model).where(model.created_at < cutoff)
+        if open_statuses:
+            stmt = stmt.where(model.status.not_in(open_statuses))
+        rows = (await session.execute(stmt.order_by(model.id).limit(batch))).scalars().all()
+        if not rows:
+            return 0
+        await _write_archive(table, [_row_dict(r) for r in rows])
+        await session.execute(delete(model).where(model.id.in_([r.id for r in rows])))
+        await session.commit()
+        return len(rows)
+
+
+async def archive_old_rows(now: Optional[datetime] = None) -> Dict[str, int]:
+    """Move orders, wallet_topups and audit_logs past their retention into JSONL.gz archives.
+
+    Files live under RETENTION_ARCHIVE_DIR/<table>/<table>-YYYYMMDD.jsonl.gz (day of archiving).
+    Each chunk of RETENTION_BATCH rows is its own short transaction that deletes by primary key,
+    so MariaDB never holds locks across the whole table. There is a RETENTION_PAUSE pause between
+    chunks. A retention of 0 days keeps that table forever.
+    """
+    now = now or datetime.utcnow()
+    batch = max(1, settings.retention_batch)
+    plans = [
+        ("orders", settings.retention_orders_days, lambda c: _archive_orders_batch(c, batch)),
+        ("wallet_topups", settings.retention_topups_days,
+         lambda c: _archive_simple_batch(WalletTopUp, "wallet_topups", c, batch, _OPEN_TOPUP_STATUSES)),
+        ("audit_logs", settings.retention_audit_days, lambda c: _archive_simple_batch(AuditLog, "audit_logs", c, batch)),
+    ]
+    stats: Dict[str, int] = {}
+    for table, days, run_batch in plans:
+        moved = 0
+        if days > 0:
+            cutoff = now - timedelta(days=days)
+            while True:
+                n = await run_batch(cutoff)
+                moved += n
+                if n < batch:
+                    break
+                await asyncio.sleep(settings.retention_pause)
+        stats[table] = moved
+    logger.info("archive_old_rows done", extra={"extra": stats})
+    return stats
@@ -4,122 +4,392 @@ import asyncio
 import logging
 from datetime import datetime, timedelta, timezone
 from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
 
 from aiojobs import create_scheduler
-import httpx
-from sqlalchemy import select, update, and_
+from sqlalchemy import insert, select, update, and_
 
 from app.db.session import session_scope
-from app.db.models import User, Order
-from app.services.notifications import notify_user, notify_log
+from app.db.models import User, Order, ServiceNotifyState, UserService
+from app.services.notifications import notify_log, notify_users_bulk, notify_users_bulk_results
+from app.services.marzban_ops import expire_at_of as mz_expire_at_of
+from app.services.marzban_ops import get_users_by_name as mz_get_users_by_name
+from app.services.marzban_ops import get_users_snapshot as mz_get_users_snapshot
+from app.services.marzban_ops import refresh_all_inbound_tags as mz_refresh_all_inbound_tags
+from app.services.marzban_ops import delete_users as mz_delete_users
 from app.services.marzban_ops import get_user as mz_get_user
+from app.services.marzban_ops import record_expiry as mz_record_expiry
+from app.services.usage_series import record_hourly as record_usage_hourly
+from app.services.usage_series import rollup_and_prune as rollup_usage_and_prune
 from app.config import settings
+from app.services.job_scheduler import ALL_USERS, JobScheduler, Shard, prune_job_runs
 
 logger = logging.getLogger(__name__)
 
-
-async def job_sync_plans() -> None:
+async def job_sync_plans() -> Dict[str, int]:
     from app.scripts.sync_plans import sync_templates_to_plans
     async with session_scope() as session:
         changed = await sync_templates_to_plans(session)
         logger.info("job_sync_plans done", extra={"extra": {"changed": changed}})
+    return {"items": int(changed or 0)}
+
+
+async def job_refresh_inbounds() -> Dict[str, int]:
+    """Keep the shared vless inbound catalog warm so create paths skip GET /api/inbounds."""
+    counts = await mz_refresh_all_inbound_tags()
+    logger.debug("job_refresh_inbounds done", extra={"extra": {"counts": counts}})
+    return {"items": sum(counts.values())}
+
+
+async def _notify_targets(session, shard: Shard = ALL_USERS) -> List[Tuple[str, int]]:
+    """(service username, telegram_id) for every live service of an active user in the shard.
+
+    Users from before multi-service (no user_services rows) are covered by their own username.
+    """
+    rows = (
+        await session.execute(
+            select(UserService.username, User.telegram_id)
+            .join(User, User.id == UserService.user_id)
+            .where(User.status == "active", UserService.status != "deleted", shard.clause(User.id))
+        )
+    ).all()
+    has_service = select(UserService.id).where(UserService.user_id == User.id).exists()
+    legacy = (
+        await session.execute(select(User.marzban_username, User.telegram_id).where(User.status == "active", ~has_service, shard.clause(User.id)))
+    ).all()
+    return [(str(r[0]), int(r[1])) for r in [*rows, *legacy] if r[0]]
+
+
+async def _load_notify_states(session, usernames: List[str]) -> Dict[str, ServiceNotifyState]:
+    states: Dict[str, ServiceNotifyState] = {}
+    for i in range(0, len(usernames), 500):
+        chunk = usernames[i:i + 500]
+        for st in (await session.execute(select(ServiceNotifyState).where(ServiceNotifyState.username.in_(chunk)))).scalars():
+            states[st.username] = st
+    return states
+
+
+async def _save_notify_states(session, changes: Dict[str, Dict[str, Any]], existing: Dict[str, ServiceNotifyState]) -> None:
+    """Write state changes as one bulk UPDATE (by primary key) plus one bulk INSERT."""
+    updates = [{"username": u, **vals} for u, vals in changes.items() if u in existing]
+    inserts = [{"username": u, **vals} for u, vals in changes.items() if u not in existing]
+    if updates:
+        await session.execute(update(ServiceNotifyState), updates)
+    if inserts:
+        await session.execute(insert(ServiceNotifyState), inserts)
+    await session.commit()
+
 
+async def _sync_expiry_index(session, snapshots: Dict[str, Dict[str, Any]]) -> int:
+    """Bring user_services.expire_at / users.expire_at in line with the panel snapshot (batched)."""
+    names = list(snapshots)
+    svc_updates: List[Dict[str, Any]] = []
+    user_updates: List[Dict[str, Any]] = []
+    for i in range(0, len(names), 500):
+        chunk = names[i:i + 500]
+        for sid, username, current in (
+            await session.execute(select(UserService.id, UserService.username, UserService.expire_at).where(UserService.username.in_(chunk)))
+        ).all():
+            expire_at = mz_expire_at_of(snapshots.get(username))
+            if current != expire_at:
+                svc_updates.append({"id": sid, "expire_at": expire_at})
+        for uid, username, current in (
+            await session.execute(select(User.id, User.marzban_username, User.expire_at).where(User.marzban_username.in_(chunk)))
+        ).all():
+            expire_at = mz_expire_at_of(snapshots.get(username))
+            if current != expire_at:
+                user_updates.append({"id": uid, "expire_at": expire_at})
+    if svc_updates:
+        await session.execute(update(UserService), svc_updates)
+    if user_updates:
+        await session.execute(update(User), user_updates)
+    return len(svc_updates) + len(user_updates)
 
-async def job_notify_usage() -> None:
-    """Fetch usage from Marzban and notify users when crossing configured thresholds.
-    Uses settings.NOTIFY_USAGE_THRESHOLDS as CSV (e.g., "0.7,0.9").
-    Stores last_notified_usage_threshold to avoid duplicate notifications.
+
+async def job_notify_usage(shard: Shard = ALL_USERS) -> Dict[str, int]:
+    """Notify users when any of their services crosses a usage threshold.
+
+    Thresholds come from settings.NOTIFY_USAGE_THRESHOLDS as CSV (e.g., "0.7,0.9"). Usage is read
+    from one bulk panel snapshot, per-service state lives in service_notify_state and is written
+    in one batch before the (rate-limited, concurrent) sends. A service whose usage drops back
+    (reset/renewal) re-arms the thresholds above its new ratio. With several worker replicas each
+    handles the users of its shard (user_id % count) and looks just their services up by name,
+    instead of every replica walking the whole panel.
     """
     try:
         thresholds = [float(x.strip()) for x in settings.notify_usage_thresholds.split(',') if x.strip()]
         thresholds = sorted(set([t for t in thresholds if 0 < t < 1]))
     except Exception:
         thresholds = [0.7, 0.9]
-    if not thresholds:
-        return
 
+    # No early return without thresholds: the same pass feeds usage history and the expiry index
     async with session_scope() as session:
-        users = (await session.execute(select(User).where(User.status == "active"))).scalars().all()
-        for u in users:
-            try:
-                data = await mz_get_user(u.marzban_username)
-                limit = int(data.get("data_limit") or 0)
-                used = int(data.get("used_traffic") or 0)
-                ratio = (used / limit) if (limit and limit > 0) else 0.0
-                last_notified = float(u.last_notified_usage_threshold or 0)
-                crossed = None
-                for t in thresholds:
-                    if ratio >= t and t > last_notified:
-                        crossed = t
-                if crossed is None:
-                    continue
-                u.last_usage_bytes = used
-                u.last_usage_ratio = Decimal(str(ratio))
-                u.last_notified_usage_threshold = Decimal(str(crossed))
-                await session.flush()
-                pct = int(crossed * 100)
-                await notify_user(u.telegram_id, f"⚠️ اطلاعیه مصرف: شما از {pct}% حجم سرویس خود عبور کرده‌اید.")
-            except httpx.HTTPStatusError as e:
-                status = getattr(getattr(e, "response", None), "status_code", None)
-                if status == 404:
-                    logger.info(
-                        "job_notify_usage: user not found in Marzban; skipping",
-                        extra={"extra": {"user_id": u.id, "username": u.marzban_username}},
-                    )
-                    continue
-                logger.exception("job_notify_usage: http error for user %s", u.id)
-            except Exception:
-                logger.exception("job_notify_usage: error for user %s", u.id)
-        await session.commit()
+        targets = await _notify_targets(session, shard)
+    if not targets:
+        return {"items": 0}
+    # The panel reads run without a DB session: under the adaptive limiter they can take minutes
+    try:
+        usernames = [username for username, _ in targets]
+        if shard.count > 1:
+            snapshots = await mz_get_users_by_name(usernames)
+        else:
+            snapshots = await mz_get_users_snapshot(usernames)
+    except Exception:
+        logger.exception("job_notify_usage: bulk fetch from Marzban failed")
+        return {"items": 0, "errors": len(targets)}
+    async with session_scope() as session:
+        states = await _load_notify_states(session, [username for username, _ in targets])
+        changes: Dict[str, Dict[str, Any]] = {}
+        messages: List[Tuple[int, str]] = []
+        readings: Dict[str, Tuple[int, Optional[int]]] = {}
+        missing = 0
+        for username, telegram_id in targets:
+            data = snapshots.get(username)
+            if data is None:
+                missing += 1
+                continue
+            limit = int(data.get("data_limit") or 0)
+            used = int(data.get("used_traffic") or 0)
+            ratio = min(9.9999, (used / limit) if limit > 0 else 0.0)
+            state = states.get(username)
+            prev_used = int(state.last_usage_bytes or 0) if state else None
+            # Unchanged readings are passed too: they become the baseline of a service's first sample
+            readings[username] = (used, prev_used)
+            last_notified = float(state.last_notified_usage_threshold or 0) if state else 0.0
+            reached = max((t for t in thresholds if ratio >= t), default=None)
+            vals: Dict[str, Any] = {"last_usage_bytes": used, "last_usage_ratio": Decimal(str(round(ratio, 4)))}
+            if reached is not None and reached > last_notified:
+                vals["last_notified_usage_threshold"] = Decimal(str(reached))
+                messages.append((telegram_id, f"⚠️ اطلاعیه مصرف: سرویس {username} از {int(reached * 100)}% حجم خود عبور کرده است."))
+            elif last_notified and (reached is None or reached < last_notified):
+                vals["last_notified_usage_threshold"] = Decimal(str(reached)) if reached is not None else None
+            elif state is not None and int(state.last_usage_bytes or 0) == used:
+                continue
+            changes[username] = vals
+        # Usage history and the expiry index ride the same transaction as the notify state
+        sampled = await record_usage_hourly(session, readings)
+        expiry_synced = await _sync_expiry_index(session, snapshots)
+        await _save_notify_states(session, changes, states)
+    sent = await notify_users_bulk(messages)
+    logger.info(
+        "job_notify_usage done",
+        extra={"extra": {
+            "shard": f"{shard.index}/{shard.count}", "services": len(targets), "missing": missing, "updated": len(changes), "sampled": sampled,
+            "expiry_synced": expiry_synced, "notified": sent, "queued": len(messages),
+        }},
+    )
+    return {"items": len(targets), "errors": len(messages) - sent}
+
 
+async def job_rollup_usage() -> Dict[str, int]:
+    """Downsample usage history (hourly → daily → monthly) and drop rows past retention."""
+    stats = await rollup_usage_and_prune()
+    logger.info("job_rollup_usage done", extra={"extra": stats})
+    return {"items": sum(stats.values())}
 
-async def job_notify_expiry() -> None:
-    """Notify users N days before expiry based on settings.NOTIFY_EXPIRY_DAYS (CSV of days)."""
+
+async def job_notify_expiry(shard: Shard = ALL_USERS) -> Dict[str, int]:
+    """Notify users N days before a service expires (settings.NOTIFY_EXPIRY_DAYS, CSV of days).
+
+    Reads the local expiry index only (one range query on user_services.expire_at, plus
+    users.expire_at for users without service rows); no panel calls.
+    """
     try:
         days_list = [int(x.strip()) for x in settings.notify_expiry_days.split(',') if x.strip()]
         days_list = sorted(set([d for d in days_list if d >= 0]))
     except Exception:
         days_list = [3, 1, 0]
     if not days_list:
-        return
+        return {"items": 0}
 
-    now = datetime.now(timezone.utc)
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    window_end = today + timedelta(days=max(days_list) + 1)
     async with session_scope() as session:
-        users = (await session.execute(select(User).where(User.status == "active"))).scalars().all()
-        for u in users:
+        rows = (
+            await session.execute(
+                select(UserService.username, UserService.expire_at, User.telegram_id)
+                .join(User, User.id == UserService.user_id)
+                .where(
+                    UserService.expire_at >= today,
+                    UserService.expire_at < window_end,
+                    UserService.status != "deleted",
+                    User.status == "active",
+                    shard.clause(User.id),
+                )
+            )
+        ).all()
+        has_service = select(UserService.id).where(UserService.user_id == User.id).exists()
+        legacy = (
+            await session.execute(
+                select(User.marzban_username, User.expire_at, User.telegram_id).where(
+                    User.expire_at >= today, User.expire_at < window_end, User.status == "active", ~has_service,
+                    shard.clause(User.id),
+                )
+            )
+        ).all()
+        candidates = [(str(r[0]), r[1], int(r[2])) for r in [*rows, *legacy] if r[0]]
+        if not candidates:
+            return {"items": 0}
+        states = await _load_notify_states(session, [username for username, _, _ in candidates])
+        changes: Dict[str, Dict[str, Any]] = {}
+        messages: List[Tuple[int, str]] = []
+        for username, expire_at, telegram_id in candidates:
+            days_left = (expire_at.date() - today.date()).days
+            state = states.get(username)
+            last_day = int(state.last_notified_expiry_day) if state and state.last_notified_expiry_day is not None else -999
+            if days_left in days_list and days_left != last_day:
+                changes[username] = {"last_notified_expiry_day": days_left}
+                messages.append((telegram_id, f"⏳ اطلاعیه انقضا: {days_left} روز تا پایان سرویس {username} باقی مانده است."))
+        await _save_notify_states(session, changes, states)
+    sent = await notify_users_bulk(messages)
+    logger.info("job_notify_expiry done", extra={"extra": {"shard": f"{shard.index}/{shard.count}", "candidates": len(candidates), "notified": sent, "queued": len(messages)}})
+    return {"items": len(candidates), "errors": len(messages) - sent}
+
+
+async def _panel_expired(usernames: List[str], cutoff: datetime) -> Dict[str, List[str]]:
+    """Which of usernames the panels also report expired before cutoff, grouped by panel.
+
+    The panel list is sorted by expiry and stops past the cutoff; it also stops once every
+    username is found. Services renewed on the panel behind our back are left out.
+    """
+    from app.marzban.client import get_all_clients
+
+    wanted = set(usernames)
+    found: Dict[str, List[str]] = {}
+    aware_cutoff = cutoff.replace(tzinfo=timezone.utc)
+    for panel, client in (await get_all_clients()).items():
+        async for user in client.iter_users(expired_before=aware_cutoff):
+            name = user.get("username")
+            if name in wanted:
+                found.setdefault(panel, []).append(name)
+                wanted.discard(name)
+                if not wanted:
+                    return found
+    return found
+
+
+async def _reconcile_stale_expiry(usernames: List[str]) -> int:
+    """Fix index rows the panel disagrees with: renewed on the panel → new expiry, gone → deleted.
+
+    Without this they would stay at the head of the oldest-first cleanup batch forever.
+    """
+    import httpx
+
+    gone: List[str] = []
+    sem = asyncio.Semaphore(max(1, settings.marzban_delete_concurrency))
+
+    async def _one(username: str) -> None:
+        async with sem:
             try:
-                data = await mz_get_user(u.marzban_username)
-                expire_ts = int(data.get("expire") or 0)
-                if expire_ts <= 0:
-                    continue
-                exp_dt = datetime.fromtimestamp(expire_ts, tz=timezone.utc)
-                days_left = (exp_dt.date() - now.date()).days
-                last_day = int(u.last_notified_expiry_day or -999)
-                if days_left in days_list and days_left != last_day:
-                    u.last_notified_expiry_day = days_left
-                    await session.flush()
-                    await notify_user(u.telegram_id, f"⏳ اطلاعیه انقضا: {days_left} روز تا پایان سرویس باقی مانده است.")
+                await mz_record_expiry(username, await mz_get_user(username, use_cache=False))
             except httpx.HTTPStatusError as e:
-                status = getattr(getattr(e, "response", None), "status_code", None)
-                if status == 404:
-                    logger.info(
-                        "job_notify_expiry: user not found in Marzban; skipping",
-                        extra={"extra": {"user_id": u.id, "username": u.marzban_username}},
-                    )
-                    continue
-                logger.exception("job_notify_expiry: http error for user %s", u.id)
+                if e.response is not None and e.response.status_code == 404:
+                    gone.append(username)
             except Exception:
-                logger.exception("job_notify_expiry: error for user %s", u.id)
-        await session.commit()
+                logger.debug("expiry reconcile failed", extra={"extra": {"username": username}}, exc_info=True)
+
+    await asyncio.gather(*[_one(u) for u in usernames])
+    if gone:
+        async with session_scope() as session:
+            await session.execute(
+                update(UserService).where(UserService.username.in_(gone), UserService.status != "deleted").values(status="deleted")
+            )
+            await session.commit()
+    return len(gone)
 
 
-async def job_cleanup_receipts() -> None:
-    """Placeholder cleanup; receipts are Telegram File IDs (no local files)."""
-    days = settings.receipt_retention_days
-    logger.debug("cleanup_receipts: retention=%s days; telegram file-id only, skipping disk cleanup", days)
+async def job_cleanup_expired(shard: Shard = ALL_USERS) -> Dict[str, int]:
+    """Delete services expired for more than CLEANUP_EXPIRED_AFTER_DAYS from the panel.
 
+    Candidates come from the local expiry index, oldest first, up to CLEANUP_EXPIRED_BATCH per run.
+    Each user is told CLEANUP_NOTICE_HOURS ahead (or on the first run that sees the service). A
+    service is only deleted on a later run after its notice was delivered for the current expiry
+    (service_notify_state.cleanup_notice_at), and only if the panel still reports it expired.
+    Panel DELETEs run with MARZBAN_DELETE_CONCURRENCY. Local rows are marked deleted in bulk by
+    delete_users().
+    """
+    days = settings.cleanup_expired_after_days
+    if days <= 0:
+        return {"items": 0}
+    now = datetime.utcnow()
+    cutoff = now - timedelta(days=days)
+    notice_cutoff = cutoff + timedelta(hours=max(0, settings.cleanup_notice_hours))
+    async with session_scope() as session:
+        rows = (
+            await session.execute(
+                select(UserService.username, UserService.expire_at, User.telegram_id)
+                .join(User, User.id == UserService.user_id)
+                .where(UserService.expire_at < notice_cutoff, UserService.status != "deleted", shard.clause(User.id))
+                .order_by(UserService.expire_at)
+                .limit(max(1, settings.cleanup_expired_batch))
+            )
+        ).all()
+        if not rows:
+            return {"items": 0}
+        states = await _load_notify_states(session, [str(r[0]) for r in rows])
+    noticed: List[str] = []
+    messages: List[Tuple[int, str]] = []
+    due: List[str] = []
+    for username, expire_at, telegram_id in rows:
+        state = states.get(username)
+        # A notice from before the current expiry belongs to an earlier, since renewed, period
+        if state is not None and state.cleanup_notice_at is not None and state.cleanup_notice_at >= expire_at:
+            if expire_at < cutoff:
+                due.append(str(username))
+            continue
+        delete_at = max(now, expire_at + timedelta(days=days))
+        noticed.append(str(username))
+        messages.append((
+            int(telegram_id),
+            f"🗑 سرویس {username} منقضی شده و حدود {delete_at:%Y-%m-%d %H:%M} (UTC) حذف می‌شود. برای حفظ آن، پیش از این زمان تمدید کنید.",
+        ))
+    delivered = await notify_users_bulk_results(messages)
+    sent = sum(1 for ok in delivered if ok)
+    if sent:
+        # Only delivered notices count; the rest are retried on the next run
+        sent_at = datetime.utcnow()
+        changes = {u: {"cleanup_notice_at": sent_at} for u, ok in zip(noticed, delivered) if ok}
+        async with session_scope() as session:
+            await _save_notify_states(session, changes, states)
+
+    deleted = failed = 0
+    stale: List[str] = []
+    if due:
+        from app.marzban.client import get_all_clients
+
+        clients = await get_all_clients()
+        expired_on_panel = await _panel_expired(due, cutoff)
+        for panel, names in expired_on_panel.items():
+            summary = await mz_delete_users(clients[panel], names)
+            deleted += summary["deleted"] + summary["missing"]
+            failed += summary["failed"]
+        confirmed = {u for names in expired_on_panel.values() for u in names}
+        stale = [u for u in due if u not in confirmed]
+        if stale:
+            deleted += await _reconcile_stale_expiry(stale)
+    logger.info(
+        "job_cleanup_expired done",
+        extra={"extra": {
+            "shard": f"{shard.index}/{shard.count}", "candidates": len(rows), "noticed": sent, "due": len(due),
+            "deleted": deleted, "failed": failed, "not_expired_on_panel": len(stale),
+        }},
+    )
+    if deleted or failed:
+        # Failed deletes need a look now; a clean run can wait for the digest
+        await notify_log(f"Expired cleanup: deleted {deleted} services, {failed} failed (older than {days}d).", critical=failed > 0)
+    return {"items": len(rows), "errors": failed + (len(messages) - sent)}
+
+
+async def job_archive_old_rows() -> Dict[str, int]:
+    """Move old orders/top-ups/audit logs to JSONL.gz archives (receipts are Telegram file ids,
+    so there are no local receipt files to clean)."""
+    from app.services.retention import archive_old_rows
+
+    stats = await archive_old_rows()
+    return {"items": sum(stats.values())}
 
-async def job_autocancel_orders() -> None:
+
+async def job_autocancel_orders() -> Dict[str, int]:
     """Auto-cancel stale pending orders after configured hours."""
     hours = settings.pending_order_autocancel_hours
     cutoff = datetime.utcnow() - timedelta(hours=hours)
@@ -134,25 +404,43 @@ async def job_autocancel_orders() -> None:
         if count > 0:
             await notify_log(f"Auto-cancelled {count} pending orders older than {hours}h.")
         await session.commit()
+    return {"items": int(count)}
 
 
 async def run_scheduler() -> None:
+    from app.services.outbound import ROLE_WORKER, configure_outbound
+
+    # Worker replicas share what the bot process leaves of OUTBOUND_RATE
+    configure_outbound(ROLE_WORKER)
     sched = await create_scheduler()
+    try:
+        from app.marzban.client import get_all_clients
+        for mz_client in (await get_all_clients()).values():
+            await mz_client.warm_up()
+    except Exception:
+        logger.warning("Marzban warm-up skipped", exc_info=True)
 
-    async def periodic(coro, interval: float) -> None:
-        while True:
-            try:
-                await coro()
-            except Exception as e:
-                logger.exception("periodic job error: %s", e)
-            await asyncio.sleep(interval)
-
-    # Schedule periodic jobs
-    await sched.spawn(periodic(job_sync_plans, 6 * 60 * 60))         # every 6h
-    await sched.spawn(periodic(job_notify_usage, 60 * 60))           # every 1h
-    await sched.spawn(periodic(job_notify_expiry, 24 * 60 * 60))     # every 24h
-    await sched.spawn(periodic(job_cleanup_receipts, 24 * 60 * 60))  # every 24h
-    await sched.spawn(periodic(job_autocancel_orders, 60 * 60))      # every 1h
+    # Interval/cron jobs; leased ones run on one worker replica per slot (JOB_SCHEDULES overrides)
+    jobs = JobScheduler()
+    jobs.add("sync_plans", job_sync_plans, "every 6h")
+    # Inbound cache is per process, so every replica refreshes its own (no lease)
+    jobs.add("refresh_inbounds", job_refresh_inbounds, max(60.0, settings.marzban_inbounds_ttl / 2), leased=False, run_at_start=True)
+    # Per-user jobs: every replica takes its user_id % N shard
+    jobs.add("notify_usage", job_notify_usage, "every 1h", sharded=True)
+    jobs.add("rollup_usage", job_rollup_usage, "every 1h")
+    jobs.add("notify_expiry", job_notify_expiry, "every 1h", sharded=True)  # local index only
+    jobs.add("archive_old_rows", job_archive_old_rows, "30 3 * * *")  # daily, off-peak (UTC)
+    jobs.add("autocancel_orders", job_autocancel_orders, "every 1h")
+    jobs.add("cleanup_expired", job_cleanup_expired, "every 1h", sharded=True)
+    jobs.add("prune_job_runs", prune_job_runs, "every 24h")
+    jobs.on_shard_change = lambda shard: configure_outbound(ROLE_WORKER, shard.count)
+    await jobs.start()
+    # Marzban mutation outbox (handlers enqueue, the worker applies); safe on every replica (SKIP LOCKED)
+    from app.services.outbox import run_outbox
+    await sched.spawn(run_outbox())
+    # Admin broadcasts (DB-backed, resumable; one replica sends at a time)
+    from app.services.broadcast import run_broadcasts
+    await sched.spawn(run_broadcasts())
 
     logger.info("scheduler started")
     # Keep the scheduler running; on cancellation try to close bot singleton (notifications)
@@ -160,6 +448,7 @@ async def run_scheduler() -> None:
         while True:
             await asyncio.sleep(3600)
     except asyncio.CancelledError:
+        await jobs.stop()
         try:
             from app.services.notifications import aclose_bot
             await aclose_bot()
@@ -16,6 +16,7 @@ CAP_PLANS_SET_PRICE = "PLANS_SET_PRICE"
 CAP_PLANS_TOGGLE_ACTIVE = "PLANS_TOGGLE_ACTIVE"
 CAP_ORDERS_MODERATE = "ORDERS_MODERATE"
 CAP_WALLET_MODERATE = "WALLET_MODERATE"
+CAP_BROADCAST = "BROADCAST"
 
 
 def _parse_csv(s: str) -> Set[str]:
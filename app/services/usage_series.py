@@ -0,0 +1,252 @@
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from sqlalchemy import and_, delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.db.models import Setting, UsageSample
+from app.db.session import session_scope
+
+logger = logging.getLogger(__name__)
+
+HOURLY = "h"
+DAILY = "d"
+MONTHLY = "m"
+
+_HOUR = 3600
+_DAY = 86400
+_DELETE_CHUNK = 5000
+_WATERMARK_KEYS = {DAILY: "USAGE:ROLLUP:DAY", MONTHLY: "USAGE:ROLLUP:MONTH"}
+
+
+@dataclass(frozen=True)
+class UsagePoint:
+    bucket: datetime  # bucket start (UTC)
+    delta_bytes: int
+    used_bytes: int
+
+
+def _hour_start(ts: int) -> int:
+    return ts - ts % _HOUR
+
+
+def _day_start(ts: int) -> int:
+    return ts - ts % _DAY
+
+
+def _month_start(ts: int) -> int:
+    d = datetime.fromtimestamp(ts, tz=timezone.utc)
+    return int(datetime(d.year, d.month, 1, tzinfo=timezone.utc).timestamp())
+
+
+def _next_month(ts: int) -> int:
+    d = datetime.fromtimestamp(ts, tz=timezone.utc)
+    year, month = (d.year + 1, 1) if d.month == 12 else (d.year, d.month + 1)
+    return int(datetime(year, month, 1, tzinfo=timezone.utc).timestamp())
+
+
+def _add_months(ts: int, months: int) -> int:
+    d = datetime.fromtimestamp(_month_start(ts), tz=timezone.utc)
+    idx = d.year * 12 + (d.month - 1) + months
+    return int(datetime(idx // 12, idx % 12 + 1, 1, tzinfo=timezone.utc).timestamp())
+
+
+async def record_hourly(
+    session: AsyncSession,
+    readings: Mapping[str, Tuple[int, Optional[int]]],
+    now_ts: Optional[int] = None,
+) -> int:
+    """Add hourly samples from {username: (used_traffic, previous used_traffic or None)}.
+
+    The delta is the growth since the previous reading (the whole counter after a reset).
+    A service's first sample is only a baseline (delta 0): before it the previous reading is
+    unknown or stale (seeded by migration), and the lifetime counter is not one hour's usage.
+    Readings that did not change since an existing sample write nothing. A second run within the same hour adds to that hour's row. The caller commits.
+    """
+    if not readings:
+        return 0
+    bucket = _hour_start(int(now_ts if now_ts is not None else datetime.now(timezone.utc).timestamp()))
+    names = list(readings)
+    sampled: set = set()
+    for i in range(0, len(names), 500):
+        res = await session.execute(select(UsageSample.username).where(UsageSample.username.in_(names[i:i + 500])).distinct())
+        sampled.update(r[0] for r in res)
+    rows: Dict[str, Dict[str, int]] = {}
+    for username, (used, prev) in readings.items():
+        if prev is None or username not in sampled:
+            delta = 0
+        elif used == prev:
+            continue
+        else:
+            delta = used - prev if used >= prev else used
+        rows[username] = {"delta_bytes": max(0, int(delta)), "used_bytes": int(used)}
+    changed = list(rows)
+    existing: Dict[str, int] = {}
+    for i in range(0, len(changed), 500):
+        res = await session.execute(
+            select(UsageSample.username, UsageSample.delta_bytes).where(
+                UsageSample.username.in_(changed[i:i + 500]),
+                UsageSample.resolution == HOURLY,
+                UsageSample.bucket_ts == bucket,
+            )
+        )
+        existing.update({r[0]: int(r[1] or 0) for r in res})
+    updates = [
+        {"username": u, "resolution": HOURLY, "bucket_ts": bucket, "delta_bytes": existing[u] + v["delta_bytes"], "used_bytes": v["used_bytes"]}
+        for u, v in rows.items() if u in existing
+    ]
+    inserts = [{"username": u, "resolution": HOURLY, "bucket_ts": bucket, **v} for u, v in rows.items() if u not in existing]
+    if updates:
+        await session.execute(update(UsageSample), updates)
+    if inserts:
+        await session.execute(insert(UsageSample), inserts)
+    return len(rows)
+
+
+async def _get_watermark(session: AsyncSession, resolution: str) -> Optional[int]:
+    row = await session.get(Setting, _WATERMARK_KEYS[resolution])
+    try:
+        return int(row.value) if row and row.value else None
+    except ValueError:
+        return None
+
+
+async def _set_watermark(session: AsyncSession, resolution: str, ts: int) -> None:
+    key = _WATERMARK_KEYS[resolution]
+    row = await session.get(Setting, key)
+    if row is None:
+        session.add(Setting(key=key, value=str(ts)))
+    else:
+        row.value = str(ts)
+
+
+async def _rollup_period(session: AsyncSession, source: str, target: str, start: int, end: int) -> int:
+    """Aggregate source rows in [start, end) into one target row per service (bucket = start)."""
+    res = await session.execute(
+        select(UsageSample.username, func.sum(UsageSample.delta_bytes), func.max(UsageSample.used_bytes))
+        .where(UsageSample.resolution == source, UsageSample.bucket_ts >= start, UsageSample.bucket_ts < end)
+        .group_by(UsageSample.username)
+    )
+    rows = [
+        {"username": r[0], "resolution": target, "bucket_ts": start, "delta_bytes": int(r[1] or 0), "used_bytes": int(r[2] or 0)}
+        for r in res
+    ]
+    # Re-rolling a period (e.g. after a lost watermark) replaces the previous aggregate
+    await session.execute(delete(UsageSample).where(UsageSample.resolution == target, UsageSample.bucket_ts == start))
+    if rows:
+        await session.execute(insert(UsageSample), rows)
+    return len(rows)
+
+
+async def _rollup(source: str, target: str, now_ts: int) -> int:
+    """Roll every completed target period after the watermark; one transaction per period."""
+    period_start, next_period = (_day_start, lambda ts: ts + _DAY) if target == DAILY else (_month_start, _next_month)
+    current = period_start(now_ts)
+    total = 0
+    async with session_scope() as session:
+        mark = await _get_watermark(session, target)
+        if mark is None:
+            first = await session.scalar(select(func.min(UsageSample.bucket_ts)).where(UsageSample.resolution == source))
+            if first is None:
+                return 0
+            start = period_start(int(first))
+        else:
+            start = next_period(mark)
+        while start < current:
+            total += await _rollup_period(session, source, target, start, next_period(start))
+            await _set_watermark(session, target, start)
+            await session.commit()
+            start = next_period(start)
+    return total
+
+
+async def _purge(resolution: str, cutoff: int) -> int:
+    """Delete rows older than cutoff in bounded chunks so no statement holds locks for long."""
+    deleted = 0
+    while True:
+        async with session_scope() as session:
+            keys = (
+                await session.execute(
+                    select(UsageSample.username, UsageSample.bucket_ts)
+                    .where(UsageSample.resolution == resolution, UsageSample.bucket_ts < cutoff)
+                    .limit(_DELETE_CHUNK)
+                )
+            ).all()
+            if not keys:
+                return deleted
+            for bucket_ts in sorted({k[1] for k in keys}):
+                names = [k[0] for k in keys if k[1] == bucket_ts]
+                await session.execute(
+                    delete(UsageSample).where(
+                        UsageSample.resolution == resolution,
+                        UsageSample.bucket_ts == bucket_ts,
+                        UsageSample.username.in_(names),
+                    )
+                )
+            await session.commit()
+            deleted += len(keys)
+            if len(keys) < _DELETE_CHUNK:
+                return deleted
+
+
+async def rollup_and_prune(now_ts: Optional[int] = None) -> Dict[str, int]:
+    """Downsample hourly → daily → monthly for completed periods, then apply retention."""
+    now = int(now_ts if now_ts is not None else datetime.now(timezone.utc).timestamp())
+    stats = {
+        "daily_rows": await _rollup(HOURLY, DAILY, now),
+        "monthly_rows": await _rollup(DAILY, MONTHLY, now),
+    }
+    stats["hourly_purged"] = await _purge(HOURLY, _day_start(now) - settings.usage_hourly_retention_days * _DAY)
+    stats["daily_purged"] = await _purge(DAILY, _day_start(now) - settings.usage_daily_retention_days * _DAY)
+    stats["monthly_purged"] = await _purge(MONTHLY, _add_months(now, -settings.usage_monthly_retention_months))
+    return stats
+
+
+def _pick_resolution(start_ts: int, end_ts: int) -> str:
+    span = end_ts - start_ts
+    if span <= 3 * _DAY:
+        return HOURLY
+    if span <= 120 * _DAY:
+        return DAILY
+    return MONTHLY
+
+
+async def get_usage_series(
+    username: str,
+    start: datetime,
+    end: Optional[datetime] = None,
+    resolution: Optional[str] = None,
+) -> List[UsagePoint]:
+    """Usage buckets of one service in [start, end) as a single primary-key range scan.
+
+    resolution defaults by span: hourly up to 3 days, daily up to 120 days, monthly beyond.
+    Buckets without traffic are absent (read them as zero). Daily/monthly buckets appear once
+    their period is complete and rolled up.
+    """
+    def _ts(d: datetime) -> int:
+        return int((d if d.tzinfo else d.replace(tzinfo=timezone.utc)).timestamp())
+
+    start_ts = _ts(start)
+    end_ts = _ts(end or datetime.now(timezone.utc))
+    res = resolution or _pick_resolution(start_ts, end_ts)
+    async with session_scope() as session:
+        rows = (
+            await session.execute(
+                select(UsageSample.bucket_ts, UsageSample.delta_bytes, UsageSample.used_bytes)
+                .where(
+                    and_(
+                        UsageSample.username == username,
+                        UsageSample.resolution == res,
+                        UsageSample.bucket_ts >= start_ts,
+                        UsageSample.bucket_ts < end_ts,
+                    )
+                )
+                .order_by(UsageSample.bucket_ts)
+            )
+        ).all()
+    return [UsagePoint(datetime.fromtimestamp(int(r[0]), tz=timezone.utc), int(r[1] or 0), int(r[2] or 0)) for r in rows]
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursts up to `capacity`.
+
+    pause(seconds) empties the bucket and blocks every acquirer until the pause ends, which is
+    how a Telegram flood wait (retry_after) is applied to all senders sharing the bucket.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None) -> None:
+        self.rate = max(0.01, float(rate))
+        self.capacity = max(1.0, float(capacity if capacity is not None else rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        # The lock keeps waiters in FIFO order; each sleeps only for its own deficit
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+    def set_rate(self, rate: float) -> None:
+        """Change the refill rate (and burst capacity) without losing tokens already earned."""
+        self._refill(max(self._updated, time.monotonic()))
+        self.rate = max(0.01, float(rate))
+        self.capacity = max(1.0, self.rate)
+        self._tokens = min(self._tokens, self.capacity)
+
+    def pause(self, seconds: float) -> None:
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + max(0.0, seconds))
+        self._tokens = 0.0
+        self._updated = self._paused_until
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """Bounded LRU cache with per-entry TTL and an optional stale window.
+
+    - get() returns only fresh entries (age <= ttl).
+    - get_stale() also returns entries within ttl + stale_ttl and tells the caller whether
+      the value is stale, so it can serve it immediately and revalidate in the background.
+    - Least recently used entries are evicted once maxsize is reached.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30.0, stale_ttl: float = 0.0) -> None:
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = float(ttl)
+        self.stale_ttl = max(0.0, float(stale_ttl))
+        self._data: "OrderedDict[K, Tuple[V, float]]" = OrderedDict()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._data
+
+    def _lookup(self, key: K, max_age: float) -> Tuple[Optional[V], Optional[float]]:
+        item = self._data.get(key)
+        if item is None:
+            return None, None
+        val, ts = item
+        age = time.monotonic() - ts
+        if age > max_age:
+            if age > self.ttl + self.stale_ttl:
+                self._data.pop(key, None)
+            return None, None
+        self._data.move_to_end(key)
+        return val, age
+
+    def get(self, key: K) -> Optional[V]:
+        val, _ = self._lookup(key, self.ttl)
+        if val is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return val
+
+    def get_stale(self, key: K) -> Tuple[Optional[V], bool]:
+        """Return (value, is_stale); value is None on a miss."""
+        val, age = self._lookup(key, self.ttl + self.stale_ttl)
+        if val is None or age is None:
+            self.misses += 1
+            return None, False
+        if age > self.ttl:
+            self.stale_hits += 1
+            return val, True
+        self.hits += 1
+        return val, False
+
+    def set(self, key: K, value: V) -> None:
+        self._data[key] = (value, time.monotonic())
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: K) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
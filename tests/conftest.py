@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Iterator
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.config import settings
+from app.db import session as db_session
+from app.db.models import Base
+from app.marzban import client as mz_client
+from app.marzban.client import MarzbanClient
+from app.marzban.fake_server import FakeMarzban
+from app.marzban.registry import default_panel
+from app.services import marzban_ops
+
+FAKE_BASE_URL = "http://marzban.test"
+
+
+def _clear_module_caches() -> None:
+    marzban_ops._SNAPSHOT_CACHE.clear()
+    marzban_ops._CACHE_HOLD.clear()
+    marzban_ops._REVALIDATING.clear()
+    marzban_ops._PANEL_OF.clear()
+    marzban_ops.invalidate_inbound_tags()
+
+
+@pytest.fixture(autouse=True)
+def _fresh_module_caches() -> Iterator[None]:
+    """marzban_ops keeps process-wide caches; start and end every test with them empty so
+    snapshots, holds and panel placements never leak from one test's fake panel into the next."""
+    _clear_module_caches()
+    yield
+    _clear_module_caches()
+
+
+@pytest.fixture
+def fake_marzban() -> FakeMarzban:
+    """A fresh in-process Marzban; tune latency/error_rate or call inject_401/inject_429 per test."""
+    return FakeMarzban(seed=0)
+
+
+@pytest.fixture
+def marzban_client(fake_marzban: FakeMarzban, monkeypatch: pytest.MonkeyPatch) -> Iterator[MarzbanClient]:
+    """MarzbanClient wired to fake_marzban and installed as the shared client of the default panel,
+    so marzban_ops/provisioning talk to the fake as well."""
+    # Token sharing goes through the DB, which tests don't have
+    monkeypatch.setattr(settings, "marzban_share_token", False)
+    client = MarzbanClient(
+        FAKE_BASE_URL,
+        fake_marzban.admin_username,
+        fake_marzban.admin_password,
+        transport=fake_marzban.transport(),
+    )
+    client._backoff_base = 0.0
+    monkeypatch.setitem(mz_client._shared_clients, default_panel(), client)
+    yield client
+    asyncio.run(client.aclose_hard())
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch: pytest.MonkeyPatch) -> Iterator[AsyncEngine]:
+    """A fresh SQLite database with every table, installed behind session_scope().
+
+    NullPool: each test body runs its own asyncio.run(), and pooled aiosqlite connections are
+    tied to the loop that opened them.
+    """
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}", poolclass=NullPool)
+    monkeypatch.setattr(db_session, "_engine", engine)
+    monkeypatch.setattr(db_session, "_SessionLocal", async_sessionmaker(bind=engine, expire_on_commit=False))
+
+    async def _create() -> None:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    asyncio.run(_create())
+    yield engine
+    asyncio.run(engine.dispose())
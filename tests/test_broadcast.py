@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import pytest
+from sqlalchemy import select, update
+
+from app.db.models import Broadcast, Setting, User
+from app.db.session import session_scope
+from app.services import broadcast, notifications, outbound
+
+ADMIN_CHAT = 999
+
+
+class FakeSender:
+    """Stands in for outbound.send: records every send/edit and answers per chat id."""
+
+    def __init__(self, outcomes: Optional[Dict[int, str]] = None) -> None:
+        self.outcomes = outcomes or {}
+        self.sent: List[int] = []
+        self.edits: List[str] = []
+        self.crash_on: Optional[int] = None
+
+    async def __call__(self, chat_id: int, method: str = "send_message", **kwargs: Any) -> str:
+        if method == "edit_message_text":
+            self.edits.append(kwargs["text"])
+            return outbound.SENT
+        if chat_id == self.crash_on:
+            self.crash_on = None
+            raise RuntimeError("worker killed")
+        self.sent.append(chat_id)
+        return self.outcomes.get(chat_id, outbound.SENT)
+
+
+@pytest.fixture
+def sender(db, monkeypatch: pytest.MonkeyPatch) -> FakeSender:
+    fake = FakeSender()
+
+    async def _bot() -> object:
+        return object()
+
+    monkeypatch.setattr(notifications, "_get_bot", _bot)
+    monkeypatch.setattr(outbound, "send", fake)
+    monkeypatch.setattr(broadcast, "_bucket", None)
+    monkeypatch.setattr(broadcast.settings, "broadcast_rate", 10_000.0)
+    monkeypatch.setattr(broadcast.settings, "broadcast_page_size", 2)
+    monkeypatch.setattr(broadcast.settings, "broadcast_concurrency", 1)
+    monkeypatch.setattr(broadcast.settings, "broadcast_progress_interval", 0.0)
+    return fake
+
+
+async def _seed_users(n: int, *, banned=(), blocked_before=()) -> None:
+    async with session_scope() as session:
+        for tid in range(1, n + 1):
+            session.add(User(
+                telegram_id=tid, marzban_username=f"tg_{tid}", data_limit_bytes=0,
+                bot_blocked_at=datetime.utcnow() if tid in blocked_before else None,
+            ))
+        session.add_all([Setting(key=f"USER:{tid}:BANNED", value="1") for tid in banned])
+        await session.commit()
+
+
+async def _load(broadcast_id: int) -> Broadcast:
+    bc = await broadcast.get_broadcast(broadcast_id)
+    assert bc is not None
+    return bc
+
+
+def test_draft_is_only_sent_once_started_and_finishes_at_100_percent(sender: FakeSender) -> None:
+    sender.outcomes = {3: outbound.BLOCKED, 5: outbound.FAILED}
+
+    async def main() -> None:
+        await _seed_users(7, banned={4}, blocked_before={6})
+        bc = await broadcast.create_broadcast("hello", created_by=ADMIN_CHAT)
+        assert (bc.status, bc.total) == ("draft", 6)
+        assert await broadcast._claim("w1") is None
+
+        started = await broadcast.set_broadcast_state(bc.id, "start", progress_chat_id=ADMIN_CHAT, progress_message_id=1)
+        assert started is not None and started.status == "pending"
+        assert await broadcast.set_broadcast_state(bc.id, "start") is None
+        assert await broadcast._claim("w1") == bc.id
+        assert (await _load(bc.id)).status == "running"
+
+        await broadcast._run(bc.id, "w1")
+        done = await _load(bc.id)
+        assert done.status == "done" and done.locked_by is None
+        # Banned user 4 is never messaged but counted as blocked, like user 3 who blocked the bot
+        assert (done.sent, done.failed, done.blocked) == (3, 1, 2)
+        assert done.sent + done.failed + done.blocked == done.total == 6
+        assert "(100%)" in sender.edits[-1]
+        async with session_scope() as session:
+            blocked = (await session.execute(select(User.telegram_id).where(User.bot_blocked_at.is_not(None)))).scalars()
+            assert sorted(blocked) == [3, 6]
+
+    asyncio.run(main())
+    assert sender.sent == [1, 2, 3, 5, 7]
+
+
+def test_restarted_worker_resumes_from_the_cursor(sender: FakeSender) -> None:
+    sender.crash_on = 5
+
+    async def main() -> None:
+        await _seed_users(6)
+        bc = await broadcast.create_broadcast("hello", created_by=ADMIN_CHAT)
+        await broadcast.set_broadcast_state(bc.id, "start")
+        assert await broadcast._claim("old") == bc.id
+        with pytest.raises(RuntimeError):
+            await broadcast._run(bc.id, "old")
+        crashed = await _load(bc.id)
+        assert (crashed.status, crashed.locked_by, crashed.cursor_user_id, crashed.sent) == ("running", "old", 4, 4)
+
+        # The lease is still fresh: a second replica must not start sending the same broadcast
+        assert await broadcast._claim("new") is None
+        async with session_scope() as session:
+            stale = datetime.utcnow() - timedelta(seconds=broadcast.settings.broadcast_lease_seconds + 1)
+            await session.execute(update(Broadcast).where(Broadcast.id == bc.id).values(heartbeat_at=stale))
+            await session.commit()
+        assert await broadcast._claim("new") == bc.id
+
+        await broadcast._run(bc.id, "new")
+        done = await _load(bc.id)
+        assert done.status == "done"
+        assert (done.sent, done.total) == (6, 6)
+
+    asyncio.run(main())
+    # Pages committed before the crash are not sent again
+    assert sorted(c for c in sender.sent if c <= 4) == [1, 2, 3, 4]
+    assert set(sender.sent) == {1, 2, 3, 4, 5, 6}
+
+
+def test_paused_broadcast_keeps_its_cursor_until_resumed(sender: FakeSender) -> None:
+    async def main() -> None:
+        await _seed_users(4)
+        bc = await broadcast.create_broadcast("hello", created_by=ADMIN_CHAT)
+        await broadcast.set_broadcast_state(bc.id, "start")
+        assert await broadcast._claim("w1") == bc.id
+        await broadcast.set_broadcast_state(bc.id, "pause")
+        await broadcast._run(bc.id, "w1")
+        assert not sender.sent
+        assert await broadcast._claim("w1") is None
+
+        await broadcast.set_broadcast_state(bc.id, "resume")
+        assert await broadcast._claim("w2") == bc.id
+        await broadcast._run(bc.id, "w2")
+        assert (await _load(bc.id)).sent == 4
+
+    asyncio.run(main())
+    assert sender.sent == [1, 2, 3, 4]
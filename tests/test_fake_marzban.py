@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any
+
+import httpx
+
+from app.marzban.fake_server import FakeMarzban
+from tests.conftest import FAKE_BASE_URL
+
+
+async def _login(http: httpx.AsyncClient, fake: FakeMarzban, password: str | None = None) -> httpx.Response:
+    return await http.post(
+        "/api/admin/token",
+        data={"grant_type": "password", "username": fake.admin_username, "password": password or fake.admin_password},
+    )
+
+
+def _run(fake: FakeMarzban, scenario: Any) -> Any:
+    async def main() -> Any:
+        async with httpx.AsyncClient(transport=fake.transport(), base_url=FAKE_BASE_URL) as http:
+            return await scenario(http)
+
+    return asyncio.run(main())
+
+
+def test_auth_rejects_bad_password_and_missing_token(fake_marzban: FakeMarzban) -> None:
+    async def scenario(http: httpx.AsyncClient):
+        bad = await _login(http, fake_marzban, password="wrong")
+        anonymous = await http.get("/api/users")
+        token = (await _login(http, fake_marzban)).json()["access_token"]
+        authed = await http.get("/api/users", headers={"Authorization": f"Bearer {token}"})
+        return bad.status_code, anonymous.status_code, authed.status_code
+
+    assert _run(fake_marzban, scenario) == (401, 401, 200)
+    assert fake_marzban.logins == 1
+
+
+def test_list_users_paginates_with_total(fake_marzban: FakeMarzban) -> None:
+    for i in range(25):
+        fake_marzban.add_user(f"user{i:02d}")
+
+    async def scenario(http: httpx.AsyncClient):
+        token = (await _login(http, fake_marzban)).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        resp = await http.get("/api/users", params={"offset": 20, "limit": 10, "sort": "username"}, headers=headers)
+        return resp.json()
+
+    data = _run(fake_marzban, scenario)
+    assert data["total"] == 25
+    assert [u["username"] for u in data["users"]] == [f"user{i:02d}" for i in range(20, 25)]
+
+
+def test_expired_endpoints_skip_disabled_users_and_can_be_missing(fake_marzban: FakeMarzban) -> None:
+    past = int(time.time()) - 3600
+    fake_marzban.add_user("expired", expire=past)
+    fake_marzban.add_user("disabled", expire=past, status="disabled")
+    fake_marzban.add_user("active", expire=int(time.time()) + 3600)
+
+    async def scenario(http: httpx.AsyncClient):
+        token = (await _login(http, fake_marzban)).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        listed = [u["username"] for u in (await http.get("/api/users/expired", headers=headers)).json()]
+        fake_marzban.bulk_expired_delete = False
+        missing = await http.delete("/api/users/expired", headers=headers)
+        fake_marzban.bulk_expired_delete = True
+        removed = (await http.delete("/api/users/expired", headers=headers)).json()
+        return listed, missing.status_code, removed
+
+    listed, missing_status, removed = _run(fake_marzban, scenario)
+    assert listed == ["expired"]
+    assert missing_status == 404
+    assert removed == ["expired"]
+    assert sorted(fake_marzban.users) == ["active", "disabled"]
+
+
+def test_injected_faults_are_consumed_in_order(fake_marzban: FakeMarzban) -> None:
+    fake_marzban.inject_401()
+    fake_marzban.inject_429()
+
+    async def scenario(http: httpx.AsyncClient):
+        token = (await _login(http, fake_marzban)).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        return [(await http.get("/api/admin", headers=headers)).status_code for _ in range(3)]
+
+    assert _run(fake_marzban, scenario) == [401, 429, 200]
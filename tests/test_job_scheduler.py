@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timezone
+from typing import List
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.db.models import JobLease
+from app.db.session import session_scope
+from app.services.job_scheduler import CronSchedule, IntervalSchedule, JobScheduler, parse_schedule
+
+
+def _ts(*args: int) -> float:
+    return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+
+def _utc(ts: float) -> datetime:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).replace(tzinfo=None)
+
+
+def _fires(expr: str, start: float, count: int) -> List[datetime]:
+    sched = CronSchedule(expr)
+    out, ts = [], start
+    for _ in range(count):
+        ts = sched.next_after(ts)
+        out.append(_utc(ts))
+    return out
+
+
+@pytest.mark.parametrize(
+    "expr, seconds",
+    [("every 6h", 21600), ("every 15m", 900), ("90s", 90), ("3600", 3600), (120, 120)],
+)
+def test_parse_interval_schedules(expr, seconds) -> None:
+    sched = parse_schedule(expr)
+    assert isinstance(sched, IntervalSchedule)
+    assert sched.seconds == seconds
+
+
+@pytest.mark.parametrize("expr", ["61 * * * *", "* 24 * * *", "0 0 0 * *", "* * *", "5-1 * * * *", "*/0 * * * *"])
+def test_parse_rejects_bad_cron(expr) -> None:
+    with pytest.raises(ValueError):
+        parse_schedule(expr)
+
+
+def test_interval_slots_are_epoch_aligned() -> None:
+    sched = IntervalSchedule(3600)
+    assert sched.next_after(_ts(2026, 10, 17, 10, 59, 59)) == _ts(2026, 10, 17, 11)
+    # A slot boundary itself is already taken: the next one is a full interval later
+    assert sched.next_after(_ts(2026, 10, 17, 11)) == _ts(2026, 10, 17, 12)
+
+
+def test_cron_steps_and_ranges() -> None:
+    assert _fires("*/15 * * * *", _ts(2026, 10, 17, 10, 7), 3) == [
+        datetime(2026, 10, 17, 10, 15), datetime(2026, 10, 17, 10, 30), datetime(2026, 10, 17, 10, 45),
+    ]
+    assert _fires("30 9-17/4 * * *", _ts(2026, 10, 17, 12), 3) == [
+        datetime(2026, 10, 17, 13, 30), datetime(2026, 10, 17, 17, 30), datetime(2026, 10, 18, 9, 30),
+    ]
+
+
+def test_cron_day_of_month_or_day_of_week() -> None:
+    # Both day fields restricted: the 13th or any Friday (2026-11-06 and 2026-11-13 are Fridays)
+    assert _fires("0 0 13 * 5", _ts(2026, 11, 1), 4) == [
+        datetime(2026, 11, 6), datetime(2026, 11, 13), datetime(2026, 11, 20), datetime(2026, 11, 27),
+    ]
+    # Only day-of-week restricted: just Sundays, and 7 means Sunday too
+    assert _fires("0 3 * * 7", _ts(2026, 10, 17), 2) == [datetime(2026, 10, 18, 3), datetime(2026, 10, 25, 3)]
+
+
+def test_cron_feb_29_waits_for_a_leap_year() -> None:
+    assert _fires("0 0 29 2 *", _ts(2026, 3, 1), 2) == [datetime(2028, 2, 29), datetime(2032, 2, 29)]
+
+
+def test_cron_that_never_fires_raises() -> None:
+    with pytest.raises(ValueError):
+        CronSchedule("0 0 31 2 *").next_after(_ts(2026, 1, 1))
+
+
+def test_racing_replicas_run_each_slot_once(db: AsyncEngine) -> None:
+    replicas = [JobScheduler(owner=f"replica{i}", lease_ttl=60) for i in range(4)]
+
+    async def race(slot: int) -> List[bool]:
+        return list(await asyncio.gather(*[r._acquire("sync_plans", slot) for r in replicas]))
+
+    async def main() -> None:
+        # First slot: nobody has the row yet, so all of them try the INSERT
+        first = await race(100)
+        assert first.count(True) == 1
+        winner = replicas[first.index(True)]
+        # The same slot again, e.g. a replica whose clock lags: nobody runs it twice
+        assert (await race(100)).count(True) == 0
+        # The next slot while the winner still holds the lease: only the holder may take it
+        assert await race(200) == [r is winner for r in replicas]
+        await winner._release("sync_plans")
+        # Released: the conditional UPDATE lets exactly one replica through
+        assert (await race(300)).count(True) == 1
+        async with session_scope() as session:
+            lease = await session.scalar(select(JobLease).where(JobLease.name == "sync_plans"))
+        assert lease.last_slot == 300
+
+    asyncio.run(main())
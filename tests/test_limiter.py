@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import asyncio
+from typing import List
+
+import httpx
+import pytest
+
+from app.marzban import limiter
+from app.marzban.client import MarzbanClient
+from app.marzban.fake_server import FakeMarzban
+from app.marzban.limiter import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    AdaptiveLimiter,
+    CircuitBreaker,
+    CircuitOpenError,
+)
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> FakeClock:
+    fake = FakeClock()
+    monkeypatch.setattr(limiter, "time", fake)
+    return fake
+
+
+def test_aimd_grows_additively_and_backs_off_once_per_cooldown(clock: FakeClock) -> None:
+    lim = AdaptiveLimiter(initial=4, min_limit=2, max_limit=5, latency_target=1.0, backoff=0.5, cooldown=10)
+
+    async def main() -> None:
+        await lim.acquire()
+        lim.release(0.1, ok=True)
+        assert lim.limit == pytest.approx(4.25)
+        for _ in range(20):
+            await lim.acquire()
+            lim.release(0.1, ok=True)
+        assert lim.limit == 5  # capped at max_limit
+
+        await lim.acquire()
+        lim.release(0.1, ok=False)
+        assert lim.limit == pytest.approx(2.5)
+        # A burst of failures inside the cooldown is one overload signal, not many
+        await lim.acquire()
+        lim.release(0.1, ok=False)
+        assert lim.limit == pytest.approx(2.5)
+
+        clock.now += 10
+        await lim.acquire()
+        lim.release(3.0, ok=True)  # slower than latency_target counts as overload too
+        assert lim.limit == 2  # floored at min_limit
+        assert lim.decreases == 2
+
+    asyncio.run(main())
+
+
+def test_waiters_are_served_interactive_first_then_in_arrival_order() -> None:
+    lim = AdaptiveLimiter(initial=1, max_limit=1)
+    order: List[str] = []
+
+    async def worker(name: str, priority: int) -> None:
+        await lim.acquire(priority)
+        order.append(name)
+        await asyncio.sleep(0)
+        lim.release(0.0, ok=True)
+
+    async def main() -> None:
+        await lim.acquire()  # hold the only slot while the queue builds up
+        tasks = []
+        for name, prio in [("bg1", PRIORITY_BACKGROUND), ("ui1", PRIORITY_INTERACTIVE), ("bg2", PRIORITY_BACKGROUND), ("ui2", PRIORITY_INTERACTIVE)]:
+            tasks.append(asyncio.create_task(worker(name, prio)))
+            await asyncio.sleep(0)
+        assert lim.stats()["queued"] == 4
+        lim.release(0.0, ok=True)
+        await asyncio.gather(*tasks)
+        assert lim.inflight == 0
+
+    asyncio.run(main())
+    assert order == ["ui1", "ui2", "bg1", "bg2"]
+
+
+def test_cancelled_waiter_does_not_leak_a_slot() -> None:
+    lim = AdaptiveLimiter(initial=1, max_limit=1)
+
+    async def main() -> None:
+        await lim.acquire()
+        waiter = asyncio.create_task(lim.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        lim.release(0.0, ok=True)
+        assert lim.inflight == 0
+        await asyncio.wait_for(lim.acquire(), 1)
+
+    asyncio.run(main())
+
+
+def test_breaker_opens_probes_and_closes(clock: FakeClock) -> None:
+    br = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    br.record_failure()
+    br.record_failure()
+    assert br.state == "closed" and br.allow()
+    br.record_failure()
+    assert br.state == "open"
+    assert not br.allow() and br.rejected == 1
+
+    clock.now += 30
+    assert br.allow()  # the single half-open probe
+    assert br.state == "half_open"
+    assert not br.allow()
+    br.record_failure()  # failed probe: straight back to open
+    assert br.state == "open"
+
+    clock.now += 30
+    assert br.allow()
+    br.record_success()
+    assert br.state == "closed" and br.failures == 0
+    assert br.allow()
+
+
+def test_breaker_replaces_a_probe_that_never_reported(clock: FakeClock) -> None:
+    br = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    br.record_failure()
+    clock.now += 30
+    assert br.allow()
+    clock.now += 10
+    assert not br.allow()
+    clock.now += 20
+    assert br.allow()
+
+
+def test_client_fails_fast_once_the_panel_keeps_failing(
+    fake_marzban: FakeMarzban, marzban_client: MarzbanClient, clock: FakeClock
+) -> None:
+    fake_marzban.add_user("alice")
+    marzban_client._breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    start_limit = marzban_client._limiter.limit
+
+    async def main() -> None:
+        await marzban_client._ensure_token()
+        fake_marzban.error_rate = 1.0
+        with pytest.raises((CircuitOpenError, httpx.HTTPStatusError)):
+            await marzban_client.get_user("alice")
+        assert marzban_client._breaker.state == "open"
+        calls = fake_marzban.calls["get_user"]
+        with pytest.raises(CircuitOpenError):
+            await marzban_client.get_user("alice")
+        # Rejected without a request reaching the panel
+        assert fake_marzban.calls["get_user"] == calls
+
+        fake_marzban.error_rate = 0.0
+        clock.now += 30
+        assert (await marzban_client.get_user("alice"))["username"] == "alice"
+        assert marzban_client._breaker.state == "closed"
+
+    asyncio.run(main())
+    assert marzban_client._limiter.limit < start_limit
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import List
+
+import pytest
+
+from app.config import settings
+from app.marzban.client import MarzbanClient
+from app.marzban.fake_server import FakeMarzban
+
+
+def test_background_refresh_stores_shared_token(
+    fake_marzban: FakeMarzban, marzban_client: MarzbanClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    # Tokens are never "fresh" here, so the refresh scheduled after the first login fires after ~1s
+    fake_marzban.token_ttl = 2
+    monkeypatch.setattr(settings, "marzban_token_refresh_margin", 2.0)
+    stored: List[str] = []
+
+    async def _store(token: str) -> None:
+        await asyncio.sleep(0)  # a DB round trip suspends, which is where a cancel would land
+        stored.append(token)
+
+    monkeypatch.setattr(marzban_client, "_store_shared_token", _store)
+
+    async def main() -> None:
+        await marzban_client.get_users(limit=1)
+        await asyncio.sleep(1.3)
+
+    asyncio.run(main())
+    assert fake_marzban.logins == 2
+    assert len(stored) == 2
+    assert stored[-1] == marzban_client._auth.access_token
+
+
+def test_relogin_after_401(fake_marzban: FakeMarzban, marzban_client: MarzbanClient) -> None:
+    fake_marzban.add_user("alice")
+
+    async def main() -> None:
+        await marzban_client.get_user("alice")
+        fake_marzban.inject_401()
+        assert (await marzban_client.get_user("alice"))["username"] == "alice"
+
+    asyncio.run(main())
+    assert fake_marzban.logins == 2
+    assert marzban_client.metrics.snapshot()["GET /api/user/{username}"]["relogins"] == 1
+
+
+def test_concurrent_401s_share_one_relogin(fake_marzban: FakeMarzban, marzban_client: MarzbanClient) -> None:
+    for i in range(5):
+        fake_marzban.add_user(f"user{i}")
+
+    async def main() -> None:
+        await marzban_client.get_user("user0")
+        fake_marzban.revoke_tokens()
+        await asyncio.gather(*[marzban_client.get_user(f"user{i}") for i in range(5)])
+
+    asyncio.run(main())
+    assert fake_marzban.logins == 2
+
+
+def test_retries_429(fake_marzban: FakeMarzban, marzban_client: MarzbanClient) -> None:
+    fake_marzban.add_user("alice")
+    fake_marzban.inject_429(2)
+
+    asyncio.run(marzban_client.get_user("alice"))
+    assert fake_marzban.calls["get_user"] == 3
+
+
+def test_identical_gets_are_coalesced(fake_marzban: FakeMarzban, marzban_client: MarzbanClient) -> None:
+    fake_marzban.add_user("alice")
+    fake_marzban.latency = 0.05
+
+    async def main() -> None:
+        await marzban_client._ensure_token()
+        results = await asyncio.gather(*[marzban_client.get_user("alice") for _ in range(10)])
+        assert all(r["username"] == "alice" for r in results)
+        # Writes are never shared
+        await asyncio.gather(*[marzban_client.reset_user("alice") for _ in range(3)])
+
+    asyncio.run(main())
+    assert fake_marzban.calls["get_user"] == 1
+    assert marzban_client.coalesced_requests == 9
+    assert fake_marzban.calls["reset_user"] == 3
+
+
+def test_iter_user_pages_walks_until_total(fake_marzban: FakeMarzban, marzban_client: MarzbanClient) -> None:
+    for i in range(25):
+        fake_marzban.add_user(f"user{i:02d}")
+
+    async def main() -> List[List[str]]:
+        return [[u["username"] for u in page] async for page in marzban_client.iter_user_pages(10, sort="username")]
+
+    pages = asyncio.run(main())
+    assert [len(p) for p in pages] == [10, 10, 5]
+    assert fake_marzban.calls["list_users"] == 3
+
+
+def test_iter_users_expired_before_stops_at_cutoff(fake_marzban: FakeMarzban, marzban_client: MarzbanClient) -> None:
+    now = int(time.time())
+    for i in range(5):
+        fake_marzban.add_user(f"old{i}", expire=now - 3600 * (i + 1))
+    for i in range(30):
+        fake_marzban.add_user(f"new{i:02d}", expire=now + 3600 * (i + 1))
+
+    async def main() -> List[str]:
+        return [u["username"] async for u in marzban_client.iter_users(expired_before=now, page_size=10)]
+
+    assert sorted(asyncio.run(main())) == [f"old{i}" for i in range(5)]
+    # Sorted by expire, the first page already passes the cutoff
+    assert fake_marzban.calls["list_users"] == 1
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import List
+
+import pytest
+
+from app.marzban.client import MarzbanClient
+from app.marzban.fake_server import FakeMarzban
+from app.services import marzban_ops as ops
+from app.utils import ttl_cache
+
+
+@pytest.fixture(autouse=True)
+def _no_local_db(monkeypatch: pytest.MonkeyPatch) -> List[str]:
+    """marzban_ops marks local user_services rows; tests have no DB, so record the names instead."""
+    marked: List[str] = []
+
+    async def _mark(usernames: List[str]) -> None:
+        marked.extend(usernames)
+
+    monkeypatch.setattr(ops, "_mark_services_deleted", _mark)
+    return marked
+
+
+def _add_expiry_mix(fake: FakeMarzban) -> None:
+    past = int(time.time()) - 3600
+    fake.add_user("expired1", expire=past)
+    fake.add_user("expired2", expire=past - 60)
+    fake.add_user("disabled", expire=past, status="disabled")
+    fake.add_user("active", expire=int(time.time()) + 3600)
+
+
+def test_delete_expired_uses_bulk_endpoint(fake_marzban: FakeMarzban, marzban_client: MarzbanClient, _no_local_db: List[str]) -> None:
+    _add_expiry_mix(fake_marzban)
+
+    result = asyncio.run(ops.delete_expired())
+    assert result["bulk"] is True
+    assert result["deleted"] == 2
+    assert sorted(_no_local_db) == ["expired1", "expired2"]
+    assert fake_marzban.calls["delete_user"] == 0
+    assert sorted(fake_marzban.users) == ["active", "disabled"]
+
+
+def test_delete_expired_falls_back_to_per_user_deletes(
+    fake_marzban: FakeMarzban, marzban_client: MarzbanClient, _no_local_db: List[str]
+) -> None:
+    fake_marzban.bulk_expired_delete = False
+    _add_expiry_mix(fake_marzban)
+
+    result = asyncio.run(ops.delete_expired())
+    assert result["bulk"] is False
+    assert (result["deleted"], result["failed"]) == (2, 0)
+    assert fake_marzban.calls["delete_expired"] == 1
+    assert fake_marzban.calls["delete_user"] == 2
+    # Disabled by an admin, not expired by the panel: kept, like the bulk endpoint does
+    assert sorted(fake_marzban.users) == ["active", "disabled"]
+    assert sorted(_no_local_db) == ["expired1", "expired2"]
+
+
+def test_delete_users_counts_missing(fake_marzban: FakeMarzban, marzban_client: MarzbanClient) -> None:
+    fake_marzban.add_user("alice")
+    fake_marzban.add_user("bob")
+
+    summary = asyncio.run(ops.delete_users(marzban_client, ["alice", "bob", "ghost", "alice"], concurrency=2))
+    assert (summary["total"], summary["deleted"], summary["missing"], summary["failed"]) == (3, 2, 1, 0)
+    assert summary["results"]["ghost"] == "missing"
+    assert not fake_marzban.users
+
+
+def test_users_snapshot_full_scan_stops_once_all_found(fake_marzban: FakeMarzban, marzban_client: MarzbanClient, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(ops.settings, "marzban_page_size", 10)
+    for i in range(50):
+        fake_marzban.add_user(f"user{i:02d}")
+
+    snap = asyncio.run(ops.get_users_snapshot(["user00", "user05"]))
+    assert sorted(snap) == ["user00", "user05"]
+    assert fake_marzban.calls["list_users"] == 1
+
+
+def test_users_by_name_reads_only_the_asked_users(fake_marzban: FakeMarzban, marzban_client: MarzbanClient) -> None:
+    for i in range(95):
+        fake_marzban.add_user(f"user{i:02d}")
+    wanted = [f"user{i:02d}" for i in range(0, 95, 3)] + ["ghost"]
+
+    snap = asyncio.run(ops.get_users_by_name(wanted, chunk_size=10))
+    assert sorted(snap) == sorted(w for w in wanted if w != "ghost")
+    assert fake_marzban.calls["list_users"] == 4
+
+
+def test_users_by_name_falls_back_when_the_filter_is_ignored(
+    fake_marzban: FakeMarzban, marzban_client: MarzbanClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(ops.settings, "marzban_page_size", 10)
+    fake_marzban.username_filter = False
+    for i in range(30):
+        fake_marzban.add_user(f"user{i:02d}")
+
+    snap = asyncio.run(ops.get_users_by_name(["user03", "user27"], chunk_size=10))
+    assert sorted(snap) == ["user03", "user27"]
+
+
+def test_invalidate_with_hold_keeps_user_out_of_cache(fake_marzban: FakeMarzban, marzban_client: MarzbanClient) -> None:
+    fake_marzban.add_user("alice")
+
+    async def main() -> None:
+        await ops.get_user("alice")
+        ops.invalidate_user("alice", hold=60)
+        # A change the outbox worker applies in another process
+        fake_marzban.users["alice"]["status"] = "disabled"
+        assert (await ops.get_user("alice"))["status"] == "disabled"
+
+    asyncio.run(main())
+    assert fake_marzban.calls["get_user"] == 2
+    assert "alice" not in ops._SNAPSHOT_CACHE
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+def test_stale_snapshot_is_served_then_revalidated(
+    fake_marzban: FakeMarzban, marzban_client: MarzbanClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    clock = FakeClock()
+    monkeypatch.setattr(ttl_cache, "time", clock)
+    cache = ops._SNAPSHOT_CACHE
+    fake_marzban.add_user("alice")
+
+    async def main() -> None:
+        await ops.get_user("alice")
+        fake_marzban.users["alice"]["status"] = "disabled"
+        clock.now += cache.ttl + 1
+
+        # Stale but inside the window: served as-is, refreshed in the background
+        assert (await ops.get_user("alice", allow_stale=True))["status"] == "active"
+        assert fake_marzban.calls["get_user"] == 1
+        await asyncio.gather(*ops._REVALIDATING.values())
+        assert fake_marzban.calls["get_user"] == 2
+        assert (await ops.get_user("alice"))["status"] == "disabled"
+
+        # Past the stale window a read waits for the panel
+        fake_marzban.users["alice"]["status"] = "active"
+        clock.now += cache.ttl + cache.stale_ttl + 1
+        assert (await ops.get_user("alice", allow_stale=True))["status"] == "active"
+        assert fake_marzban.calls["get_user"] == 3
+        assert not ops._REVALIDATING
+
+    asyncio.run(main())
+
+
+def test_cache_hold_lapses_after_its_deadline(
+    fake_marzban: FakeMarzban, marzban_client: MarzbanClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    clock = FakeClock()
+    monkeypatch.setattr(ops, "time", clock)
+    monkeypatch.setattr(ttl_cache, "time", clock)
+    fake_marzban.add_user("alice")
+
+    async def main() -> None:
+        ops.invalidate_user("alice", hold=30)
+        await ops.get_user("alice")
+        assert "alice" not in ops._SNAPSHOT_CACHE
+        clock.now += 31
+        await ops.get_user("alice")
+        assert "alice" in ops._SNAPSHOT_CACHE
+        assert "alice" not in ops._CACHE_HOLD
+        await ops.get_user("alice")
+
+    asyncio.run(main())
+    assert fake_marzban.calls["get_user"] == 2
@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+import pytest
+
+from app.config import settings
+from app.services import outbound
+
+
+def test_bot_and_worker_replicas_share_one_budget(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "outbound_rate", 28.0)
+    monkeypatch.setattr(settings, "outbound_bot_share", 0.25)
+
+    bot = outbound.process_rate(outbound.ROLE_BOT)
+    workers = [outbound.process_rate(outbound.ROLE_WORKER, replicas=3) for _ in range(3)]
+    assert bot == pytest.approx(7.0)
+    assert sum(workers) + bot == pytest.approx(28.0)
+
+
+def test_configure_outbound_resizes_the_live_queue(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "outbound_rate", 20.0)
+    monkeypatch.setattr(settings, "outbound_bot_share", 0.5)
+    monkeypatch.setattr(outbound, "_queue", None)
+    monkeypatch.setattr(outbound, "_role", (outbound.ROLE_BOT, 1))
+
+    outbound.configure_outbound(outbound.ROLE_WORKER)
+    queue = outbound.get_outbound()
+    assert queue.rate == pytest.approx(10.0)
+    outbound.configure_outbound(outbound.ROLE_WORKER, 4)
+    assert queue.rate == pytest.approx(2.5)
+    assert queue._bucket.rate == pytest.approx(2.5)
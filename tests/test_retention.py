@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import asyncio
+import glob
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Any, Dict, List
+
+import pytest
+from sqlalchemy import func, select
+
+from app.db.models import AuditLog, Coupon, CouponRedemption, Order, Transaction, User, WalletTopUp
+from app.db.session import session_scope
+from app.services import retention
+
+NOW = datetime(2026, 10, 17, 12, 0)
+OLD = NOW - timedelta(days=400)
+RECENT = NOW - timedelta(days=10)
+
+
+@pytest.fixture
+def archive_dir(tmp_path, monkeypatch: pytest.MonkeyPatch) -> str:
+    path = str(tmp_path / "archive")
+    monkeypatch.setattr(retention.settings, "retention_archive_dir", path)
+    monkeypatch.setattr(retention.settings, "retention_orders_days", 365)
+    monkeypatch.setattr(retention.settings, "retention_topups_days", 365)
+    monkeypatch.setattr(retention.settings, "retention_audit_days", 180)
+    monkeypatch.setattr(retention.settings, "retention_batch", 2)
+    monkeypatch.setattr(retention.settings, "retention_pause", 0.0)
+    return path
+
+
+def _read_archive(archive_dir: str, table: str) -> List[Dict[str, Any]]:
+    rows: List[Dict[str, Any]] = []
+    for path in sorted(glob.glob(os.path.join(archive_dir, table, "*.jsonl.gz"))):
+        with gzip.open(path, "rt", encoding="utf-8") as fh:
+            rows.extend(json.loads(line) for line in fh)
+    return rows
+
+
+async def _seed() -> Dict[str, Any]:
+    async with session_scope() as session:
+        user = User(telegram_id=1, marzban_username="tg_1", data_limit_bytes=0)
+        coupon = Coupon(code="OFF10", value=Decimal("10"))
+        session.add_all([user, coupon])
+        await session.flush()
+
+        def order(status: str, created_at: datetime) -> Order:
+            return Order(user_id=user.id, status=status, amount=Decimal("150000.50"), created_at=created_at)
+
+        old_closed = [order("provisioned", OLD - timedelta(minutes=i)) for i in range(5)]
+        old_pending = order("pending", OLD)
+        old_redeemed = order("provisioned", OLD)
+        recent = order("provisioned", RECENT)
+        session.add_all(old_closed + [old_pending, old_redeemed, recent])
+        await session.flush()
+        session.add_all([Transaction(order_id=o.id, status="ok", payload_raw=f"tx-{o.id}") for o in old_closed[:3]])
+        session.add(Transaction(order_id=recent.id, status="ok"))
+        session.add(CouponRedemption(coupon_id=coupon.id, user_id=user.id, order_id=old_redeemed.id, applied_amount=Decimal("10")))
+        session.add_all([
+            WalletTopUp(user_id=user.id, amount=Decimal("5"), status="approved", receipt_file_id="a", created_at=OLD),
+            WalletTopUp(user_id=user.id, amount=Decimal("5"), status="pending", receipt_file_id="b", created_at=OLD),
+            AuditLog(actor="admin", action="ban", target_type="user", created_at=OLD),
+            AuditLog(actor="admin", action="ban", target_type="user", created_at=RECENT),
+        ])
+        await session.commit()
+        return {
+            "archived": sorted(o.id for o in old_closed),
+            "kept": sorted([old_pending.id, old_redeemed.id, recent.id]),
+        }
+
+
+def test_archive_moves_closed_orders_with_their_transactions(db, archive_dir: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    chunks: List[int] = []
+    real_batch = retention._archive_orders_batch
+
+    async def _counting_batch(cutoff: datetime, batch: int) -> int:
+        n = await real_batch(cutoff, batch)
+        chunks.append(n)
+        return n
+
+    monkeypatch.setattr(retention, "_archive_orders_batch", _counting_batch)
+
+    async def main() -> Dict[str, Any]:
+        ids = await _seed()
+        stats = await retention.archive_old_rows(now=NOW)
+        async with session_scope() as session:
+            ids["left"] = sorted((await session.execute(select(Order.id))).scalars())
+            ids["left_tx"] = sorted((await session.execute(select(Transaction.order_id))).scalars())
+            ids["topups"] = sorted((await session.execute(select(WalletTopUp.status))).scalars())
+            ids["audit"] = await session.scalar(select(func.count(AuditLog.id)))
+        return {**ids, "stats": stats}
+
+    res = asyncio.run(main())
+    assert res["stats"] == {"orders": 5, "wallet_topups": 1, "audit_logs": 1}
+    # Chunked: batch of 2 -> 2 + 2 + 1, each its own transaction
+    assert chunks == [2, 2, 1]
+    # Pending, coupon-redeemed and recent orders stay, as does the recent order's transaction
+    assert res["left"] == res["kept"]
+    assert res["left_tx"] == [res["kept"][-1]]
+    assert res["topups"] == ["pending"]
+    assert res["audit"] == 1
+
+    orders = _read_archive(archive_dir, "orders")
+    assert sorted(o["id"] for o in orders) == res["archived"]
+    assert {o["amount"] for o in orders} == {"150000.50"}
+    assert all(datetime.fromisoformat(o["created_at"]) < NOW - timedelta(days=365) for o in orders)
+    txs = _read_archive(archive_dir, "transactions")
+    assert sorted(t["order_id"] for t in txs) == res["archived"][:3]
+    assert {t["payload_raw"] for t in txs} == {f"tx-{t['order_id']}" for t in txs}
+    assert [r["status"] for r in _read_archive(archive_dir, "wallet_topups")] == ["approved"]
+
+
+def test_archive_appends_gzip_members_to_the_same_day_file(tmp_path) -> None:
+    path = str(tmp_path / "orders" / "orders-20261017.jsonl.gz")
+    retention._append_jsonl_gz(path, [{"id": 1, "note": "سلام"}])
+    retention._append_jsonl_gz(path, [{"id": 2}, {"id": 3}])
+    with gzip.open(path, "rt", encoding="utf-8") as fh:
+        assert [json.loads(line) for line in fh] == [{"id": 1, "note": "سلام"}, {"id": 2}, {"id": 3}]
+
+
+def test_zero_day_retention_keeps_the_table(db, archive_dir: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(retention.settings, "retention_orders_days", 0)
+
+    async def main() -> Dict[str, int]:
+        await _seed()
+        return await retention.archive_old_rows(now=NOW)
+
+    assert asyncio.run(main())["orders"] == 0
+    assert not os.path.exists(os.path.join(archive_dir, "orders"))
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import pytest
+
+from app.utils import ttl_cache
+from app.utils.ttl_cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> FakeClock:
+    fake = FakeClock()
+    monkeypatch.setattr(ttl_cache, "time", fake)
+    return fake
+
+
+def test_entries_expire_after_ttl(clock: FakeClock) -> None:
+    cache: TTLCache[str, int] = TTLCache(maxsize=4, ttl=10)
+    cache.set("a", 1)
+    clock.now += 10
+    assert cache.get("a") == 1
+    clock.now += 0.1
+    assert cache.get("a") is None
+    # Past ttl + stale_ttl the entry is dropped, not just hidden
+    assert "a" not in cache
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_entry_is_evicted(clock: FakeClock) -> None:
+    cache: TTLCache[str, int] = TTLCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # a is now the most recently used
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_get_stale_serves_within_the_stale_window(clock: FakeClock) -> None:
+    cache: TTLCache[str, int] = TTLCache(maxsize=4, ttl=10, stale_ttl=30)
+    cache.set("a", 1)
+    assert cache.get_stale("a") == (1, False)
+    clock.now += 25
+    assert cache.get("a") is None
+    assert cache.get_stale("a") == (1, True)
+    clock.now += 20
+    assert cache.get_stale("a") == (None, False)
+    assert "a" not in cache
+    assert cache.stats()["stale_hits"] == 1
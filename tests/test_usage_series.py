@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timezone
+from typing import Dict, Tuple
+
+import pytest
+from sqlalchemy import delete, func, select
+
+from app.db.models import Setting, UsageSample
+from app.db.session import session_scope
+from app.services import usage_series as us
+
+
+def _ts(*args: int) -> int:
+    return int(datetime(*args, tzinfo=timezone.utc).timestamp())
+
+
+NOW = _ts(2026, 10, 17, 12)
+# Hourly samples from Sep 28 to Oct 3: six days spanning a month boundary
+FIRST_HOUR = _ts(2026, 9, 28)
+HOURS = 6 * 24
+
+
+async def _seed() -> Dict[str, int]:
+    totals: Dict[str, int] = {}
+    async with session_scope() as session:
+        for name, rate in (("alice", 1000), ("bob", 7)):
+            used = 0
+            for h in range(HOURS):
+                delta = rate * (h % 5)
+                used += delta
+                session.add(UsageSample(
+                    username=name, resolution=us.HOURLY, bucket_ts=FIRST_HOUR + h * 3600, delta_bytes=delta, used_bytes=used,
+                ))
+            totals[name] = used
+        await session.commit()
+    return totals
+
+
+async def _sums(resolution: str, start: int = 0, end: int = 2**62) -> Dict[str, Tuple[int, int]]:
+    async with session_scope() as session:
+        rows = await session.execute(
+            select(UsageSample.username, func.sum(UsageSample.delta_bytes), func.count())
+            .where(UsageSample.resolution == resolution, UsageSample.bucket_ts >= start, UsageSample.bucket_ts < end)
+            .group_by(UsageSample.username)
+        )
+        return {r[0]: (int(r[1]), int(r[2])) for r in rows}
+
+
+def test_rollup_twice_leaves_totals_unchanged(db, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(us.settings, "usage_hourly_retention_days", 14)
+
+    async def main() -> None:
+        totals = await _seed()
+        first = await us.rollup_and_prune(NOW)
+        # Six complete days per service; September is complete, October is not yet
+        assert (first["daily_rows"], first["monthly_rows"]) == (12, 2)
+        # Hourly rows before Oct 3 are past retention; Oct 3 itself stays
+        assert first["hourly_purged"] == 2 * 5 * 24
+        daily = await _sums(us.DAILY)
+        monthly = await _sums(us.MONTHLY)
+        assert daily == {name: (total, 6) for name, total in totals.items()}
+        september_daily = await _sums(us.DAILY, end=_ts(2026, 10, 1))
+        assert {n: s for n, (s, _) in monthly.items()} == {n: s for n, (s, _) in september_daily.items()}
+
+        second = await us.rollup_and_prune(NOW)
+        assert (second["daily_rows"], second["monthly_rows"], second["hourly_purged"]) == (0, 0, 0)
+        assert await _sums(us.DAILY) == daily
+        assert await _sums(us.MONTHLY) == monthly
+
+        # A lost watermark re-rolls from the oldest remaining source rows; the re-rolled
+        # periods replace their aggregates instead of adding to them
+        async with session_scope() as session:
+            await session.execute(delete(Setting).where(Setting.key.in_(list(us._WATERMARK_KEYS.values()))))
+            await session.commit()
+        third = await us.rollup_and_prune(NOW)
+        assert (third["daily_rows"], third["monthly_rows"]) == (2, 2)
+        assert await _sums(us.DAILY) == daily
+        assert await _sums(us.MONTHLY) == monthly
+
+    asyncio.run(main())
+
+
+def test_rollup_waits_for_the_period_to_complete(db) -> None:
+    async def main() -> None:
+        await _seed()
+        stats = await us.rollup_and_prune(_ts(2026, 9, 28, 23))
+        assert (stats["daily_rows"], stats["monthly_rows"]) == (0, 0)
+        stats = await us.rollup_and_prune(_ts(2026, 9, 29, 0, 30))
+        assert (stats["daily_rows"], stats["monthly_rows"]) == (2, 0)
+        series = await us.get_usage_series("alice", datetime(2026, 9, 1), datetime(2026, 10, 1), resolution=us.DAILY)
+        assert [p.bucket for p in series] == [datetime(2026, 9, 28, tzinfo=timezone.utc)]
+
+    asyncio.run(main())